@@ -0,0 +1,512 @@
+"""
+Бенчмарки структур данных и препроцессинга.
+Запуск из корня репозитория: PYTHONPATH=. python bin/benchmark.py <команда> [аргументы]
+"""
+import random
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from src.data.base import Token, Entity, Arc, Example, Span, BertInputs, TOKENS_EXPRESSION
+from src.data.io import get_tokens_in_span, example_from_text
+from src.data.preprocessing import split_example_v2
+from src.data.tokenization import FastFullTokenizer
+from src.model.inputs import get_bert_inputs, pack_sequences, clear_chunk_pieces_cache
+from src.utils import batches_gen
+
+
+# memory
+
+
+def _dict_based(cls):
+    """
+    тот же класс, но без __slots__: атрибуты хранятся в __dict__, как было раньше
+    """
+    return type(f"{cls.__name__}Dict", (), {"__init__": cls.__init__})
+
+
+def build_synthetic_corpus(
+        num_docs: int,
+        num_tokens: int,
+        num_entities: int,
+        num_arcs: int,
+        token_cls=Token,
+        entity_cls=Entity,
+        arc_cls=Arc,
+        example_cls=Example,
+        seed: int = 228
+):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        tokens = []
+        start = 0
+        for j in range(num_tokens):
+            n = rng.randint(1, 10)
+            t = token_cls(
+                text="x" * n,
+                span_abs=Span(start, start + n),
+                span_rel=Span(start, start + n),
+                index_abs=j,
+                index_rel=j,
+                label="O",
+                pieces=["x"] * rng.randint(1, 3),
+                token_ids=[1] * rng.randint(1, 3),
+                id_sent=j // 20
+            )
+            tokens.append(t)
+            start += n + 1
+        entities = []
+        for j in range(num_entities):
+            k = rng.randint(0, num_tokens - 2)
+            entity = entity_cls(id=f"T{j}", label="ORG", text="x", tokens=tokens[k:k + 2], index=j)
+            entities.append(entity)
+        arcs = []
+        for j in range(num_arcs):
+            arc = arc_cls(id=f"R{j}", head=f"T{j}", dep=f"T{j + 1}", rel="FOO", head_index=j, dep_index=j + 1)
+            arcs.append(arc)
+        x = example_cls(
+            filename=str(i), id=str(i), text=" ".join(t.text for t in tokens), tokens=tokens, entities=entities, arcs=arcs
+        )
+        docs.append(x)
+    return docs
+
+
+def measure_memory(fn) -> int:
+    """
+    сколько байт занимает результат fn
+    """
+    tracemalloc.start()
+    res = fn()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del res
+    return current
+
+
+def benchmark_memory(num_docs, num_tokens, num_entities, num_arcs):
+    kwargs = dict(num_docs=num_docs, num_tokens=num_tokens, num_entities=num_entities, num_arcs=num_arcs)
+    classes_dict = dict(
+        token_cls=_dict_based(Token),
+        entity_cls=_dict_based(Entity),
+        arc_cls=_dict_based(Arc),
+        example_cls=_dict_based(Example)
+    )
+    size_dict = measure_memory(lambda: build_synthetic_corpus(**kwargs, **classes_dict))
+    size_slots = measure_memory(lambda: build_synthetic_corpus(**kwargs))
+    num_tokens_total = num_docs * num_tokens
+    print(f"num docs: {num_docs}, num tokens: {num_tokens_total}")
+    print(f"__dict__: {size_dict / 2 ** 20:.2f} MiB ({size_dict / num_tokens_total:.1f} bytes per token)")
+    print(f"__slots__: {size_slots / 2 ** 20:.2f} MiB ({size_slots / num_tokens_total:.1f} bytes per token)")
+    print(f"ratio: {size_slots / size_dict:.3f}")
+
+
+# align
+
+
+def _get_tokens_in_span_v1(start2token, start, end):
+    """
+    исходная реализация: перебор всех символов спана
+    """
+    res = []
+    for i in range(start, end):
+        if i in start2token:
+            res.append(start2token[i])
+    return res
+
+
+def benchmark_align(num_words, num_entities, entity_len, num_repeats, seed=228):
+    """
+    присвоение токенов сущностям документа с длинными сущностями (например, целыми клаузами в RuREBus)
+    """
+    rng = random.Random(seed)
+    text = " ".join("".join(rng.choice("абвгдеж") for _ in range(rng.randint(1, 12))) for _ in range(num_words))
+    tokens = []
+    start2token = {}
+    token_starts = []
+    for i, m in enumerate(TOKENS_EXPRESSION.finditer(text)):
+        t = Token(text=m.group(), span_abs=Span(*m.span()), index_abs=i)
+        tokens.append(t)
+        start2token[t.span_abs.start] = t
+        token_starts.append(t.span_abs.start)
+    spans = []
+    for _ in range(num_entities):
+        i = rng.randint(0, len(tokens) - entity_len)
+        spans.append((tokens[i].span_abs.start, tokens[i + entity_len - 1].span_abs.end))
+
+    def run(fn):
+        t0 = time.perf_counter()
+        for _ in range(num_repeats):
+            for start, end in spans:
+                fn(start, end)
+        return (time.perf_counter() - t0) / num_repeats
+
+    for start, end in spans:
+        assert get_tokens_in_span(tokens, token_starts, start, end) == _get_tokens_in_span_v1(start2token, start, end)
+
+    time_v1 = run(lambda start, end: _get_tokens_in_span_v1(start2token, start, end))
+    time_v2 = run(lambda start, end: get_tokens_in_span(tokens, token_starts, start, end))
+    num_chars = sum(end - start for start, end in spans)
+    print(f"num tokens: {len(tokens)}, num entities: {num_entities}, "
+          f"mean entity len: {entity_len} tokens / {num_chars / num_entities:.1f} chars")
+    print(f"dict probing: {time_v1 * 1000:.3f} ms per document")
+    print(f"bisect: {time_v2 * 1000:.3f} ms per document")
+    print(f"speedup: {time_v1 / time_v2:.1f}x")
+
+
+# split
+
+
+def _materialize_chunk(chunk: Example) -> Example:
+    """
+    кусок с самостоятельными копиями токенов и сущностей - так split_example_v2 работал до TokenView и EntityView
+    """
+    tokens = [t.copy for t in chunk.tokens]
+    entities = []
+    for entity in chunk.entities:
+        entity_new = Entity(
+            id=entity.id,
+            label=entity.label,
+            text=entity.text,
+            tokens=[tokens[t.index_rel] for t in entity.tokens],
+            is_event_trigger=entity.is_event_trigger,
+            attrs=entity.attrs.copy(),
+            comment=entity.comment,
+            index=entity.index,
+            id_chain=entity.id_chain
+        )
+        entities.append(entity_new)
+    return Example(
+        filename=chunk.filename,
+        id=chunk.id,
+        text=chunk.text,
+        tokens=tokens,
+        entities=entities,
+        events=chunk.events,
+        arcs=chunk.arcs,
+        label=chunk.label,
+        parent=chunk.parent
+    )
+
+
+def build_synthetic_documents(num_docs: int, num_sentences: int, num_entities: int, seed: int = 228):
+    rng = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        sentences = []
+        for _ in range(num_sentences):
+            words = ["".join(rng.choice("абвгдеж") for _ in range(rng.randint(1, 10))) for _ in range(rng.randint(5, 25))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        x = example_from_text(" ".join(sentences), id=str(i))
+        for t in x.tokens:
+            t.pieces = [t.text[j:j + 3] for j in range(0, len(t.text), 3)]
+            t.token_ids = list(range(len(t.pieces)))
+        for j in range(num_entities):
+            k = rng.randint(0, len(x.tokens) - 3)
+            if x.tokens[k].text != "." and x.tokens[k + 1].text != ".":
+                x.entities.append(Entity(id=f"T{j}", label="ORG", text="", tokens=x.tokens[k:k + 2]))
+        docs.append(x)
+    return docs
+
+
+def benchmark_split(num_docs, num_sentences, num_entities, windows):
+    """
+    split_example_v2 с TokenView и EntityView против кусков с копиями токенов и сущностей (как было раньше).
+    время копий = время split_example_v2 + время копирования
+    """
+    docs = build_synthetic_documents(num_docs=num_docs, num_sentences=num_sentences, num_entities=num_entities)
+    num_tokens = sum(len(x.tokens) for x in docs)
+    print(f"num docs: {num_docs}, num tokens: {num_tokens}")
+    for window in windows:
+        t0 = time.perf_counter()
+        chunks = [chunk for x in docs for chunk in split_example_v2(x, window=window, stride=1, fix_pointers=False)]
+        time_views = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        chunks_copy = [_materialize_chunk(chunk) for chunk in chunks]
+        time_copies = time_views + time.perf_counter() - t0
+        del chunks, chunks_copy
+
+        size_views = measure_memory(
+            lambda: [chunk for x in docs for chunk in split_example_v2(x, window=window, stride=1, fix_pointers=False)]
+        )
+        size_copies = measure_memory(
+            lambda: [
+                _materialize_chunk(chunk)
+                for x in docs for chunk in split_example_v2(x, window=window, stride=1, fix_pointers=False)
+            ]
+        )
+        print(f"window: {window}")
+        print(f"\tviews: {time_views:.3f} s, {size_views / 2 ** 20:.2f} MiB")
+        print(f"\tcopies: {time_copies:.3f} s, {size_copies / 2 ** 20:.2f} MiB")
+        print(f"\tratio: time {time_copies / time_views:.1f}x, memory {size_copies / size_views:.1f}x")
+
+
+# tokenizer
+
+
+def benchmark_tokenizer(vocab_file, do_lower_case, text_file, num_words, seed=228):
+    """
+    bert.tokenization.FullTokenizer vs FastFullTokenizer на словоформах текста (или синтетических словах).
+    как в apply_bpe, токенизатор вызывается на каждом токене отдельно
+    """
+    from bert.tokenization import FullTokenizer
+
+    if text_file is not None:
+        with open(text_file) as f:
+            words = TOKENS_EXPRESSION.findall(f.read())[:num_words]
+    else:
+        rng = random.Random(seed)
+        alphabet = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+        words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 15))) for _ in range(num_words)]
+
+    tokenizer = FullTokenizer(vocab_file=vocab_file, do_lower_case=do_lower_case)
+    fast_tokenizer = FastFullTokenizer(vocab_file=vocab_file, do_lower_case=do_lower_case)
+
+    def run(tok):
+        t0 = time.perf_counter()
+        res = [tok.convert_tokens_to_ids(tok.tokenize(w)) for w in words]
+        return res, time.perf_counter() - t0
+
+    expected, time_full = run(tokenizer)
+    actual, time_fast = run(fast_tokenizer)
+    num_mismatches = sum(a != b for a, b in zip(actual, expected))
+    print(f"num words: {len(words)}, num mismatches: {num_mismatches}")
+    print(f"FullTokenizer: {len(words) / time_full:.0f} words/s")
+    print(f"FastFullTokenizer: {len(words) / time_fast:.0f} words/s")
+    print(f"speedup: {time_full / time_fast:.1f}x")
+
+
+# packing
+
+
+def benchmark_packing(num_docs, num_sentences, window, max_tokens_per_batch, batch_size, packing_maxlen, seed=228):
+    """
+    входы bert по батчам кусков: строка на кусок vs упаковка кусков в строки длины packing_maxlen.
+    считается то, что реально обрабатывает bert: строки, позиции с паддингом, ячейки матриц внимания (rows * T^2).
+    батчи - как на инференсе (batches_gen, куски отсортированы по длине) или, если задан batch_size,
+    как при обучении с TrainSamplers.RANDOM (случайные куски)
+    """
+    docs = build_synthetic_documents(num_docs=num_docs, num_sentences=num_sentences, num_entities=0)
+    chunks = [chunk for x in docs for chunk in split_example_v2(x, window=window, stride=1, fix_pointers=False)]
+    if batch_size is None:
+        batches = list(batches_gen(chunks, max_tokens_per_batch=max_tokens_per_batch, pieces_level=True))
+    else:
+        rng = random.Random(seed)
+        batches = [rng.sample(chunks, batch_size) for _ in range(len(chunks) // batch_size)]
+    print(f"num chunks: {len(chunks)}, num batches: {len(batches)}")
+    num_pieces = sum(len(t.token_ids) for batch in batches for x in batch for t in x.tokens)
+    num_pieces += 2 * sum(len(batch) for batch in batches)
+    for name, maxlen in [("unpacked", None), ("packed", packing_maxlen)]:
+        num_rows = 0
+        num_positions = 0
+        num_attention_cells = 0
+        t0 = time.perf_counter()
+        for batch in batches:
+            bert_inputs = get_bert_inputs(batch, cls_token_id=1, sep_token_id=2, packing_maxlen=maxlen)
+            rows = len(bert_inputs.input_ids)
+            t = len(bert_inputs.input_ids[0])
+            num_rows += rows
+            num_positions += rows * t
+            num_attention_cells += rows * t ** 2
+        time_inputs = time.perf_counter() - t0
+        print(f"{name}:")
+        print(f"	rows: {num_rows}, positions: {num_positions} (non-pad: {num_pieces / num_positions:.3f}), "
+              f"attention cells: {num_attention_cells}")
+        print(f"	inputs time: {time_inputs:.3f} s")
+
+
+# feed dict
+
+
+def _get_bert_inputs_v1(
+        examples, cls_token_id, sep_token_id, pad_token_id=0, root_token_id=None, packing_maxlen=None
+) -> BertInputs:
+    """
+    исходная реализация get_bert_inputs: вложенные списки
+    """
+    segments = []  # bpe-кусочки куска со спец. токенами
+    segments_coords = []  # позиции первых кусочков токенов внутри сегмента
+    num_tokens = []
+    for x in examples:
+        segment = [cls_token_id]
+        coords = []
+        if root_token_id is not None:
+            coords.append(len(segment))
+            segment.append(root_token_id)
+        for t in x.tokens:
+            n = len(t.token_ids)
+            assert n != 0, f"[{x.id}] token {t} could not be split by pieces! " \
+                f"unicode code points: {[ord(c) for c in t.text]}"
+            coords.append(len(segment))
+            segment += t.token_ids
+        segment.append(sep_token_id)
+        segments.append(segment)
+        segments_coords.append(coords)
+        num_tokens.append(len(x.tokens))
+    num_pieces = [len(segment) for segment in segments]
+
+    if packing_maxlen is None:
+        rows = [[i] for i in range(len(examples))]
+    else:
+        rows = pack_sequences(num_pieces, maxlen=packing_maxlen)
+
+    input_ids = []
+    input_mask = []
+    first_pieces_coords = [None] * len(examples)
+    pad_coords = [None] * len(examples)
+    for id_row, row in enumerate(rows):
+        input_ids_row = []
+        input_mask_row = []
+        for id_segment, i in enumerate(row):
+            offset = len(input_ids_row)
+            first_pieces_coords[i] = [(id_row, offset + j) for j in segments_coords[i]]
+            pad_coords[i] = (id_row, offset)
+            input_ids_row += segments[i]
+            input_mask_row += [id_segment + 1] * num_pieces[i]
+        input_ids.append(input_ids_row)
+        input_mask.append(input_mask_row)
+
+    # padding
+    num_pieces_max = max(len(x) for x in input_ids)
+    num_coords_max = max(len(x) for x in first_pieces_coords)
+    segment_ids = []
+    for k in range(len(rows)):
+        n = num_pieces_max - len(input_ids[k])
+        input_ids[k] += [pad_token_id] * n
+        input_mask[k] += [0] * n
+        segment_ids.append([0] * num_pieces_max)
+    for i in range(len(examples)):
+        first_pieces_coords[i] += [pad_coords[i]] * (num_coords_max - len(first_pieces_coords[i]))
+
+    return BertInputs(
+        input_ids=input_ids,
+        input_mask=input_mask,
+        segment_ids=segment_ids,
+        first_pieces_coords=first_pieces_coords,
+        num_tokens=num_tokens,
+        num_pieces=num_pieces
+    )
+
+
+def benchmark_feed_dict(num_docs, num_sentences, window, max_tokens_per_batch, root, packing_maxlen, num_repeats):
+    """
+    входы bert для feed_dict: списки (исходная реализация) vs массивы int32 с кэшем кусочков (get_bert_inputs).
+    для get_bert_inputs отдельно первая эпоха (кэш пуст) и последующие
+    """
+    docs = build_synthetic_documents(num_docs=num_docs, num_sentences=num_sentences, num_entities=0)
+    chunks = [chunk for x in docs for chunk in split_example_v2(x, window=window, stride=1, fix_pointers=False)]
+    batches = list(batches_gen(chunks, max_tokens_per_batch=max_tokens_per_batch, pieces_level=True))
+    print(f"num chunks: {len(chunks)}, num batches: {len(batches)}")
+    kwargs = dict(cls_token_id=1, sep_token_id=2, root_token_id=3 if root else None, packing_maxlen=packing_maxlen)
+
+    def run(fn):
+        t0 = time.perf_counter()
+        for batch in batches:
+            fn(batch, **kwargs)
+        return (time.perf_counter() - t0) / len(batches)
+
+    time_lists = min(run(_get_bert_inputs_v1) for _ in range(num_repeats))
+    clear_chunk_pieces_cache()
+    time_arrays_cold = run(get_bert_inputs)
+    time_arrays = min(run(get_bert_inputs) for _ in range(num_repeats))
+    print(f"lists: {time_lists * 1e3:.2f} ms/batch")
+    print(f"arrays, first epoch: {time_arrays_cold * 1e3:.2f} ms/batch")
+    print(f"arrays: {time_arrays * 1e3:.2f} ms/batch")
+    print(f"speedup: first epoch {time_lists / time_arrays_cold:.1f}x, later epochs {time_lists / time_arrays:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_memory = subparsers.add_parser("memory", help="память под Token, Entity, Arc, Example: __slots__ vs __dict__")
+    parser_memory.add_argument("--num_docs", type=int, default=100, required=False)
+    parser_memory.add_argument("--num_tokens", type=int, default=1000, required=False)
+    parser_memory.add_argument("--num_entities", type=int, default=100, required=False)
+    parser_memory.add_argument("--num_arcs", type=int, default=50, required=False)
+
+    parser_align = subparsers.add_parser("align", help="присвоение токенов сущностям: перебор символов vs bisect")
+    parser_align.add_argument("--num_words", type=int, default=5000, required=False)
+    parser_align.add_argument("--num_entities", type=int, default=200, required=False)
+    parser_align.add_argument("--entity_len", type=int, default=50, required=False)
+    parser_align.add_argument("--num_repeats", type=int, default=20, required=False)
+
+    parser_split = subparsers.add_parser("split", help="куски документов в split_example_v2: TokenView vs копии токенов")
+    parser_split.add_argument("--num_docs", type=int, default=100, required=False)
+    parser_split.add_argument("--num_sentences", type=int, default=50, required=False)
+    parser_split.add_argument("--num_entities", type=int, default=100, required=False)
+    parser_split.add_argument("--windows", type=int, nargs="+", default=[1, 3, 5], required=False)
+
+    parser_tokenizer = subparsers.add_parser("tokenizer", help="скорость токенизации: FullTokenizer vs FastFullTokenizer")
+    parser_tokenizer.add_argument("--vocab_file", type=str, required=True)
+    parser_tokenizer.add_argument("--do_lower_case", action="store_true", required=False)
+    parser_tokenizer.add_argument("--text_file", type=str, default=None, required=False)
+    parser_tokenizer.add_argument("--num_words", type=int, default=200000, required=False)
+
+    parser_packing = subparsers.add_parser("packing", help="входы bert: строка на кусок vs упаковка кусков")
+    parser_packing.add_argument("--num_docs", type=int, default=100, required=False)
+    parser_packing.add_argument("--num_sentences", type=int, default=50, required=False)
+    parser_packing.add_argument("--window", type=int, default=1, required=False)
+    parser_packing.add_argument("--max_tokens_per_batch", type=int, default=10000, required=False)
+    parser_packing.add_argument("--batch_size", type=int, default=None, required=False)
+    parser_packing.add_argument("--packing_maxlen", type=int, default=512, required=False)
+
+    parser_feed_dict = subparsers.add_parser("feed_dict", help="входы bert для feed_dict: списки vs массивы int32")
+    parser_feed_dict.add_argument("--num_docs", type=int, default=100, required=False)
+    parser_feed_dict.add_argument("--num_sentences", type=int, default=50, required=False)
+    parser_feed_dict.add_argument("--window", type=int, default=1, required=False)
+    parser_feed_dict.add_argument("--max_tokens_per_batch", type=int, default=10000, required=False)
+    parser_feed_dict.add_argument("--root", action="store_true", required=False)
+    parser_feed_dict.add_argument("--packing_maxlen", type=int, default=None, required=False)
+    parser_feed_dict.add_argument("--num_repeats", type=int, default=5, required=False)
+
+    args = parser.parse_args()
+
+    if args.command == "memory":
+        benchmark_memory(
+            num_docs=args.num_docs,
+            num_tokens=args.num_tokens,
+            num_entities=args.num_entities,
+            num_arcs=args.num_arcs
+        )
+    elif args.command == "align":
+        benchmark_align(
+            num_words=args.num_words,
+            num_entities=args.num_entities,
+            entity_len=args.entity_len,
+            num_repeats=args.num_repeats
+        )
+    elif args.command == "split":
+        benchmark_split(
+            num_docs=args.num_docs,
+            num_sentences=args.num_sentences,
+            num_entities=args.num_entities,
+            windows=args.windows
+        )
+    elif args.command == "tokenizer":
+        benchmark_tokenizer(
+            vocab_file=args.vocab_file,
+            do_lower_case=args.do_lower_case,
+            text_file=args.text_file,
+            num_words=args.num_words
+        )
+    elif args.command == "packing":
+        benchmark_packing(
+            num_docs=args.num_docs,
+            num_sentences=args.num_sentences,
+            window=args.window,
+            max_tokens_per_batch=args.max_tokens_per_batch,
+            batch_size=args.batch_size,
+            packing_maxlen=args.packing_maxlen
+        )
+    elif args.command == "feed_dict":
+        benchmark_feed_dict(
+            num_docs=args.num_docs,
+            num_sentences=args.num_sentences,
+            window=args.window,
+            max_tokens_per_batch=args.max_tokens_per_batch,
+            root=args.root,
+            packing_maxlen=args.packing_maxlen,
+            num_repeats=args.num_repeats
+        )
@@ -56,19 +56,43 @@ Attribute = namedtuple("Attribute", ["id", "type", "value"])
 EventArgument = namedtuple("EventArgument", ["id", "role"])
 Span = namedtuple("Span", ["start", "end"])
 SpanExtended = namedtuple("Span", ["start", "end", "label", "score"])
+BertInputs = namedtuple(
+    "BertInputs",
+    ["input_ids", "input_mask", "segment_ids", "first_pieces_coords", "num_tokens", "num_pieces"]
+)
 
 
 # mutable structs
 
 
+# атрибуты хранятся в __slots__, а не в __dict__: на больших корпусах это заметно экономит память
+# (см. bin/benchmark.py memory). значения, которые выставляются вне __init__ (например, label_ids в apply_encodings),
+# тоже должны быть перечислены в __slots__.
+
+
 class ReprMixin:
+    __slots__ = ()
+
+    def _items(self):
+        """
+        пары (атрибут, значение) по всем выставленным слотам
+        """
+        for k in self.__slots__:
+            if k != "__weakref__" and hasattr(self, k):
+                yield k, getattr(self, k)
+
     def __repr__(self):
         class_name = self.__class__.__name__
-        params_str = ', '.join(f"{k}={v}" for k, v in self.__dict__.items())
+        params_str = ', '.join(f"{k}={v}" for k, v in self._items())
         return f'{class_name}({params_str})'
 
 
 class Token(ReprMixin):
+    __slots__ = (
+        "text", "span_abs", "span_rel", "index_abs", "index_rel", "label", "pieces", "token_ids",
+        "id_sent", "id_head", "rel", "pos", "label_ids"
+    )
+
     def __init__(
             self,
             text: str = None,
@@ -113,7 +137,7 @@ class Token(ReprMixin):
     @property
     def copy(self):
         t = Token()
-        for attr, value in self.__dict__.items():
+        for attr, value in self._items():
             if isinstance(value, list):
                 setattr(t, attr, value.copy())
             else:
@@ -127,7 +151,65 @@ class Token(ReprMixin):
         self.pos = None
 
 
+class TokenView(ReprMixin):
+    """
+    Токен куска (chunk) документа без копирования исходного токена.
+    span_rel и index_rel вычисляются по смещениям куска. Атрибуты уровня документа (текст, спаны, bpe-кусочки и т.п.)
+    читаются из токена документа и пишутся в него же: при window > 1 токен, попавший в несколько кусков,
+    хранится в памяти один раз.
+    Атрибуты уровня куска (TokenView.LOCAL: лейблы, предсказания парсера, label_ids) - copy-on-write:
+    пока кусок их не выставил, они читаются из токена документа, а запись идёт в собственные слоты представления
+    (_label, _label_ids, ...). Поэтому перекрывающиеся куски (window > stride) не видят лейблы и предсказания
+    друг друга.
+    """
+    LOCAL = ("label", "label_ids", "id_head", "rel", "pos")
+
+    __slots__ = ("token", "offset", "start") + tuple("_" + name for name in LOCAL)
+
+    def __init__(self, token: Token, offset: int, start: int):
+        """
+        :param token: токен документа
+        :param offset: начало куска в символах документа
+        :param start: начало куска в токенах документа
+        """
+        self.token = token
+        self.offset = offset
+        self.start = start
+
+    @property
+    def span_rel(self) -> Span:
+        span = self.token.span_abs
+        return Span(start=span.start - self.offset, end=span.end - self.offset)
+
+    @property
+    def index_rel(self) -> int:
+        return self.token.index_abs - self.start
+
+    @property
+    def copy(self) -> Token:
+        """
+        самостоятельный токен с теми же значениями атрибутов (как у Token.copy)
+        """
+        t = self.token.copy
+        t.span_rel = self.span_rel
+        t.index_rel = self.index_rel
+        for attr in self.LOCAL:
+            if hasattr(self, "_" + attr):
+                value = getattr(self, attr)
+                setattr(t, attr, value.copy() if isinstance(value, list) else value)
+        return t
+
+    def reset(self):
+        # токен документа не трогается
+        for attr in ("label", "id_head", "rel", "pos"):
+            setattr(self, attr, None)
+
+
 class Entity(ReprMixin):
+    __slots__ = (
+        "id", "label", "text", "tokens", "is_event_trigger", "attrs", "comment", "index", "id_chain", "span", "label_id"
+    )
+
     def __init__(
             self,
             id: str = None,
@@ -164,7 +246,55 @@ class Entity(ReprMixin):
         self.span = span
 
 
+class EntityView(ReprMixin):
+    """
+    Сущность куска (chunk) документа: то же, что TokenView, но для Entity.
+    tokens - токены куска (TokenView), index, id_chain и label_id (EntityView.LOCAL) - copy-on-write,
+    так как у каждого куска они свои (см. enumerate_entities). Остальные атрибуты общие с сущностью документа.
+    """
+    LOCAL = ("index", "id_chain", "label_id")
+
+    __slots__ = ("entity", "tokens") + tuple("_" + name for name in LOCAL)
+
+    def __init__(self, entity: Entity, tokens: List[TokenView]):
+        """
+        :param entity: сущность документа
+        :param tokens: токены сущности в куске
+        """
+        self.entity = entity
+        self.tokens = tokens
+
+
+def _delegate(parent, name, local=False):
+    """
+    свойство name представления, которое читается из атрибута parent (токена или сущности документа).
+    если local, то запись идёт в слот _name представления, а не в parent
+    """
+    name_local = "_" + name
+
+    def fget(self):
+        if local and hasattr(self, name_local):
+            return getattr(self, name_local)
+        return getattr(getattr(self, parent), name)
+
+    def fset(self, value):
+        setattr(self if local else getattr(self, parent), name_local if local else name, value)
+
+    return property(fget, fset)
+
+
+for _name in Token.__slots__:
+    if _name not in {"span_rel", "index_rel"}:
+        setattr(TokenView, _name, _delegate("token", _name, local=_name in TokenView.LOCAL))
+
+for _name in Entity.__slots__:
+    if _name != "tokens":
+        setattr(EntityView, _name, _delegate("entity", _name, local=_name in EntityView.LOCAL))
+
+
 class Event(ReprMixin):
+    __slots__ = ("id", "trigger", "label", "args", "attrs", "comment")
+
     def __init__(
             self,
             id: str = None,
@@ -181,8 +311,20 @@ class Event(ReprMixin):
         self.attrs = attrs if attrs is not None else []
         self.comment = comment
 
+    @property
+    def copy(self):
+        event = Event()
+        for attr, value in self._items():
+            if isinstance(value, list):
+                setattr(event, attr, value.copy())
+            else:
+                setattr(event, attr, value)
+        return event
+
 
 class Arc(ReprMixin):
+    __slots__ = ("id", "head", "dep", "rel", "comment", "score", "rel_id", "head_index", "dep_index")
+
     def __init__(
             self,
             id: str,
@@ -205,8 +347,20 @@ class Arc(ReprMixin):
         self.head_index = head_index
         self.dep_index = dep_index
 
+    @property
+    def copy(self):
+        arc = Arc.__new__(Arc)
+        for attr, value in self._items():
+            setattr(arc, attr, value)
+        return arc
+
 
 class Example(ReprMixin):
+    # __weakref__ - чтоб примеры могли быть ключами weakref.WeakKeyDictionary (см. src.utils.get_example_length)
+    __slots__ = (
+        "filename", "id", "text", "tokens", "entities", "arcs", "events", "label", "parent", "chunks", "__weakref__"
+    )
+
     def __init__(
             self,
             filename: str = None,
@@ -230,3 +384,16 @@ class Example(ReprMixin):
         self.label = label  # в случае классификации предложений
         self.parent = parent
         self.chunks = chunks if chunks is not None else []  # список инстансов класса Example
+
+    @property
+    def copy(self):
+        """
+        поверхностная копия: списки копируются, их элементы - нет
+        """
+        x = Example()
+        for attr, value in self._items():
+            if isinstance(value, list):
+                setattr(x, attr, value.copy())
+            else:
+                setattr(x, attr, value)
+        return x
@@ -0,0 +1,186 @@
+"""
+Кэш предобработанного корпуса на диске.
+Хранится граф объектов Example целиком (документы, токены, сущности, куски с TokenView/EntityView) одним файлом pickle:
+модели работают с Example, а куски ссылаются на токены и сущности своих документов, и pickle сохраняет эти общие ссылки.
+Это не компактный колоночный формат: плоские массивы для нарезки батчей без объектов - src.data.columnar,
+но из них нельзя восстановить Example, поэтому кэш на них не переведён.
+"""
+import os
+import re
+import hashlib
+import pickle
+from typing import List, Dict, Callable, Pattern, Union
+
+from src.data.base import Example, Languages, TOKENS_EXPRESSION
+from src.data.io import parse_collection
+from src.data.preprocessing import preprocess_example
+from src.utils import get_tokenizer_hash
+
+CACHE_VERSION = 5
+
+
+def load_or_build_corpus(
+        data_dir: str,
+        cache_path: str,
+        tokenizer,
+        window: int = 1,
+        stride: int = 1,
+        lang: str = Languages.RU,
+        tokens_pattern: Union[str, Pattern] = None,
+        fix_pointers: bool = True,
+        ignore_bad_examples: bool = False,
+        read_fn: Callable = None,
+        num_workers: int = None,
+        max_pieces: int = None,
+        max_entities: int = None
+) -> List[Example]:
+    """
+    Кэш цепочки parse_collection -> split_example_v2 -> apply_bpe -> enumerate_entities.
+    Кэш хранится в одном файле pickle, который читается за одно чтение (см. описание модуля).
+
+    ключ кэша:
+    * глобальный: хэш словаря токенизатора, do_lower_case, window, stride, регулярка токенов, язык, fix_pointers,
+    read_fn, max_pieces, max_entities, ignore_bad_examples. при изменении любого из параметров кэш строится заново.
+    ignore_bad_examples входит в ключ, потому что в нестрогом режиме нераспаршенные документы кэшируются как None,
+    а в строгом режиме на них должно падать исключение.
+    * на уровне документа: хэш содержимого файлов .txt и .ann.
+    пересчитываются только новые и изменённые документы; удалённые документы выкидываются из кэша.
+
+    apply_encodings не кэшируется: кодировки обычно обучаются на всём корпусе (fit_encodings),
+    а их применение - дешёвая линейная операция, которую нужно делать уже после загрузки.
+
+    :param data_dir: папка с файлами .txt и .ann
+    :param cache_path: путь к файлу кэша
+    :param tokenizer: bert.tokenization.FullTokenizer
+    :param num_workers: число процессов для parse_collection
+    :return: примеры уровня документа с заполненным атрибутом chunks. порядок такой же, как в parse_collection
+    """
+    if tokens_pattern is None:
+        tokens_pattern = TOKENS_EXPRESSION
+    elif isinstance(tokens_pattern, str):
+        tokens_pattern = re.compile(tokens_pattern)
+
+    key = get_corpus_key(
+        tokenizer=tokenizer,
+        window=window,
+        stride=stride,
+        lang=lang,
+        tokens_pattern=tokens_pattern,
+        fix_pointers=fix_pointers,
+        read_fn=read_fn,
+        max_pieces=max_pieces,
+        max_entities=max_entities,
+        ignore_bad_examples=ignore_bad_examples
+    )
+    doc2hash = get_docs_hashes(data_dir)
+
+    cache = load_cache(cache_path)
+    if cache is None or cache["key"] != key:
+        print("cache is missing or outdated; building from scratch")
+        docs = {}
+    else:
+        docs = cache["docs"]
+
+    names_to_build = [name for name, h in doc2hash.items() if name not in docs or docs[name][0] != h]
+    num_cached = len(doc2hash) - len(names_to_build)
+    print(f"num cached documents: {num_cached}")
+    print(f"num documents to build: {len(names_to_build)}")
+
+    docs = {name: v for name, v in docs.items() if name in doc2hash and doc2hash[name] == v[0]}
+    if names_to_build:
+        examples = parse_collection(
+            data_dir=data_dir,
+            tokens_pattern=tokens_pattern,
+            ignore_bad_examples=ignore_bad_examples,
+            read_fn=read_fn,
+            num_workers=num_workers,
+            names=names_to_build
+        )
+        name2example = {x.filename: x for x in examples}
+        for name in names_to_build:
+            x = name2example.get(name)
+            if x is not None:
+                preprocess_example(
+                    example=x,
+                    tokenizer=tokenizer,
+                    window=window,
+                    stride=stride,
+                    lang=lang,
+                    tokens_expression=tokens_pattern,
+                    fix_pointers=fix_pointers,
+                    max_pieces=max_pieces,
+                    max_entities=max_entities
+                )
+            # None - документ, который не удалось распарсить. тоже кэшируется, чтоб не парсить его каждый раз
+            docs[name] = doc2hash[name], x
+        save_cache(cache_path, {"key": key, "docs": docs})
+
+    examples = [docs[name][1] for name in sorted(doc2hash) if docs[name][1] is not None]
+    print(f"num examples: {len(examples)}")
+    return examples
+
+
+def get_corpus_key(
+        tokenizer,
+        window: int,
+        stride: int,
+        lang: str,
+        tokens_pattern: Pattern,
+        fix_pointers: bool,
+        read_fn: Callable = None,
+        max_pieces: int = None,
+        max_entities: int = None,
+        ignore_bad_examples: bool = False
+) -> str:
+    params = [
+        f"version={CACHE_VERSION}",
+        f"vocab={get_tokenizer_hash(tokenizer)}",
+        f"window={window}",
+        f"stride={stride}",
+        f"lang={lang}",
+        f"tokens_pattern={tokens_pattern.pattern}",
+        f"fix_pointers={fix_pointers}",
+        f"read_fn={read_fn.__name__ if read_fn is not None else None}",
+        f"max_pieces={max_pieces}",
+        f"max_entities={max_entities}",
+        f"ignore_bad_examples={ignore_bad_examples}"
+    ]
+    return hashlib.sha1("\n".join(params).encode()).hexdigest()
+
+
+def get_docs_hashes(data_dir: str) -> Dict[str, str]:
+    """
+    {имя документа: хэш содержимого .txt и .ann}
+    """
+    files = os.listdir(data_dir)
+    texts = {x.split('.')[0] for x in files if x.endswith('.txt')}
+    answers = {x.split('.')[0] for x in files if x.endswith('.ann')}
+    res = {}
+    for name in sorted(texts & answers):
+        h = hashlib.sha1()
+        for ext in ["txt", "ann"]:
+            with open(os.path.join(data_dir, f"{name}.{ext}"), "rb") as f:
+                h.update(f.read())
+            h.update(b"\0")
+        res[name] = h.hexdigest()
+    return res
+
+
+def load_cache(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return pickle.loads(data)
+    except Exception as e:
+        print(f"failed to load cache from {path} due to {type(e).__name__}: {e}")
+        return None
+
+
+def save_cache(path: str, cache):
+    # запись во временный файл и переименование, чтоб не оставить битый кэш при падении
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
@@ -0,0 +1,307 @@
+"""
+Колоночный формат корпуса на уровне кусков (chunks).
+Всё, что нужно для построения feed_dict моделей, хранится в плоских numpy-массивах с индексами-смещениями:
+* token_offsets[i]:token_offsets[i + 1] - токены куска i;
+* piece_offsets[j]:piece_offsets[j + 1] - bpe-кусочки токена j (в массиве token_ids);
+* entity_offsets[i]:entity_offsets[i + 1] - сущности куска i;
+* arc_offsets[i]:arc_offsets[i + 1] - отношения куска i.
+Массивы пишутся в отдельные .npy файлы и при чтении отображаются в память (np.load(mmap_mode="r")),
+поэтому батчи режутся прямо из буферов без создания инстансов Example.
+Строковые лейблы сущностей и отношений хранятся кодами; словари кодов лежат в meta.json.
+
+Модели (src.model) этот формат не читают: их обучение и инференс по-прежнему идут через списки Example
+(BaseModel._get_train_batches, BaseModelBert._get_bert_input_for_feed_dict). ColumnarCorpus - самостоятельный
+инструмент слоя данных: выгрузка подготовленного корпуса и нарезка батчей без TensorFlow
+(внешние загрузчики, анализ длин, бенчмарки).
+"""
+import os
+import json
+from typing import List, Dict, Iterable, Iterator, Sequence
+
+import numpy as np
+
+from src.data.base import Example, BertInputs
+from src.utils import batches_indices_gen
+
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+# имя массива -> dtype
+ARRAYS = {
+    # куски
+    "token_offsets": np.int64,
+    "entity_offsets": np.int64,
+    "arc_offsets": np.int64,
+    # токены
+    "piece_offsets": np.int64,
+    "token_ids": np.int32,
+    "span_rel": np.int32,  # [T, 2]
+    "span_abs": np.int32,  # [T, 2]
+    "index_abs": np.int32,
+    "id_sent": np.int32,
+    # сущности
+    "entity_spans": np.int32,  # [E, 2]: (index_rel первого токена, index_rel последнего токена)
+    "entity_labels": np.int32,  # коды лейблов
+    "entity_index": np.int32,
+    "entity_id_chain": np.int32,
+    # отношения
+    "arcs": np.int32,  # [A, 3]: (head_index, dep_index, код лейбла)
+}
+
+NONE_VALUE = -1  # на что заменяется None в целочисленных полях
+
+
+def write_columnar(chunks: Iterable[Example], output_dir: str):
+    """
+    :param chunks: куски после apply_bpe и enumerate_entities (например, [c for x in examples for c in x.chunks])
+    :param output_dir: папка, в которую пишутся .npy и meta.json
+    """
+    def to_int(v):
+        return v if v is not None else NONE_VALUE
+
+    data = {k: [] for k in ARRAYS.keys()}
+    for k in ["token_offsets", "entity_offsets", "arc_offsets", "piece_offsets"]:
+        data[k].append(0)
+    meta = {
+        "version": FORMAT_VERSION,
+        "ids": [],
+        "parents": [],
+        "filenames": [],
+        "entity_labels": [],
+        "arc_labels": []
+    }
+    entity_label2code = {}
+    arc_label2code = {}
+
+    for x in chunks:
+        meta["ids"].append(x.id)
+        meta["parents"].append(x.parent)
+        meta["filenames"].append(x.filename)
+
+        for t in x.tokens:
+            data["token_ids"] += t.token_ids
+            data["piece_offsets"].append(len(data["token_ids"]))
+            data["span_rel"].append(t.span_rel if t.span_rel is not None else (NONE_VALUE, NONE_VALUE))
+            data["span_abs"].append(t.span_abs if t.span_abs is not None else (NONE_VALUE, NONE_VALUE))
+            data["index_abs"].append(to_int(t.index_abs))
+            data["id_sent"].append(to_int(t.id_sent))
+        data["token_offsets"].append(len(data["index_abs"]))
+
+        for entity in x.entities:
+            if entity.label not in entity_label2code:
+                entity_label2code[entity.label] = len(meta["entity_labels"])
+                meta["entity_labels"].append(entity.label)
+            data["entity_spans"].append((entity.tokens[0].index_rel, entity.tokens[-1].index_rel))
+            data["entity_labels"].append(entity_label2code[entity.label])
+            data["entity_index"].append(to_int(entity.index))
+            data["entity_id_chain"].append(to_int(entity.id_chain))
+        data["entity_offsets"].append(len(data["entity_labels"]))
+
+        for arc in x.arcs:
+            if arc.rel not in arc_label2code:
+                arc_label2code[arc.rel] = len(meta["arc_labels"])
+                meta["arc_labels"].append(arc.rel)
+            data["arcs"].append((to_int(arc.head_index), to_int(arc.dep_index), arc_label2code[arc.rel]))
+        data["arc_offsets"].append(len(data["arcs"]))
+
+    os.makedirs(output_dir, exist_ok=True)
+    for k, dtype in ARRAYS.items():
+        values = data[k]
+        if k in {"span_rel", "span_abs", "entity_spans"}:
+            arr = np.array(values, dtype=dtype).reshape(-1, 2)
+        elif k == "arcs":
+            arr = np.array(values, dtype=dtype).reshape(-1, 3)
+        else:
+            arr = np.array(values, dtype=dtype)
+        np.save(os.path.join(output_dir, f"{k}.npy"), arr)
+    with open(os.path.join(output_dir, META_FILE), "w") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    print(f"saved {len(meta['ids'])} chunks to {output_dir}")
+
+
+class ColumnarCorpus:
+    """
+    Чтение корпуса, записанного write_columnar.
+    Методы get_* принимают индексы кусков батча и возвращают numpy-массивы в том же формате,
+    в котором их ожидают плейсхолдеры моделей (см. _get_feed_dict моделей).
+    """
+    def __init__(self, path: str, mmap: bool = True):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        assert self.meta["version"] == FORMAT_VERSION, \
+            f"expected format version {FORMAT_VERSION}, but got {self.meta['version']}"
+        mmap_mode = "r" if mmap else None
+        self.arrays = {k: np.load(os.path.join(path, f"{k}.npy"), mmap_mode=mmap_mode) for k in ARRAYS.keys()}
+
+        token_offsets = self.arrays["token_offsets"]
+        piece_offsets = self.arrays["piece_offsets"]
+        self.num_tokens = np.diff(token_offsets)
+        self.num_pieces = piece_offsets[token_offsets[1:]] - piece_offsets[token_offsets[:-1]]
+
+    def __len__(self) -> int:
+        return len(self.meta["ids"])
+
+    @property
+    def ids(self) -> List[str]:
+        return self.meta["ids"]
+
+    def batches_gen(
+            self,
+            max_tokens_per_batch: int = 10000,
+            pieces_level: bool = False,
+            **kwargs
+    ) -> Iterator[np.ndarray]:
+        """
+        аналог src.utils.batches_gen: отдаются индексы кусков
+        :param kwargs: политика батчевания, см. src.utils.batches_indices_gen
+        """
+        lengths = self.num_pieces if pieces_level else self.num_tokens
+        gen = batches_indices_gen(
+            lengths.tolist(),
+            max_tokens_per_batch=max_tokens_per_batch,
+            ids=self.ids,
+            indices_sorted=np.argsort(lengths, kind="stable").tolist(),
+            **kwargs
+        )
+        for batch in gen:
+            yield np.array(batch, dtype=np.int64)
+
+    def get_bert_inputs(
+            self,
+            indices: Sequence[int],
+            cls_token_id: int,
+            sep_token_id: int,
+            pad_token_id: int = 0
+    ) -> BertInputs:
+        """
+        аналог BaseModelBert._get_bert_input_for_feed_dict
+        """
+        indices = np.asarray(indices)
+        n = len(indices)
+        num_tokens = self.num_tokens[indices].astype(np.int32)
+        num_pieces = (self.num_pieces[indices] + 2).astype(np.int32)  # + [CLS], [SEP]
+        num_tokens_max = int(num_tokens.max())
+        num_pieces_max = int(num_pieces.max())
+
+        input_ids = np.full((n, num_pieces_max), pad_token_id, dtype=np.int32)
+        input_mask = np.zeros((n, num_pieces_max), dtype=np.int32)
+        segment_ids = np.zeros((n, num_pieces_max), dtype=np.int32)
+        first_pieces_coords = np.zeros((n, num_tokens_max, 2), dtype=np.int32)
+        first_pieces_coords[:, :, 0] = np.arange(n)[:, None]
+
+        token_offsets = self.arrays["token_offsets"]
+        piece_offsets = self.arrays["piece_offsets"]
+        token_ids = self.arrays["token_ids"]
+        for i, c in enumerate(indices):
+            t0, t1 = token_offsets[c], token_offsets[c + 1]
+            offsets = piece_offsets[t0:t1 + 1]
+            assert (np.diff(offsets) > 0).all(), f"[{self.ids[c]}] some tokens could not be split by pieces!"
+            p0, p1 = offsets[0], offsets[-1]
+            m = p1 - p0
+            input_ids[i, 0] = cls_token_id
+            input_ids[i, 1:m + 1] = token_ids[p0:p1]
+            input_ids[i, m + 1] = sep_token_id
+            input_mask[i, :m + 2] = 1
+            first_pieces_coords[i, :t1 - t0, 1] = offsets[:-1] - p0 + 1
+
+        return BertInputs(
+            input_ids=input_ids,
+            input_mask=input_mask,
+            segment_ids=segment_ids,
+            first_pieces_coords=first_pieces_coords,
+            num_tokens=num_tokens,
+            num_pieces=num_pieces
+        )
+
+    def get_mention_spans(self, indices: Sequence[int]) -> np.ndarray:
+        """
+        [num_entities, 3]: (номер куска в батче, начало, конец). если сущностей нет, то [(0, 0, 0)]
+        """
+        rows, starts, ends = self._get_rows(indices, "entity_offsets")
+        spans = self.arrays["entity_spans"]
+        res = np.zeros((len(rows), 3), dtype=np.int32)
+        res[:, 0] = rows
+        res[:, 1:] = _take_ranges(spans, starts, ends)
+        return res if len(res) > 0 else np.zeros((1, 3), dtype=np.int32)
+
+    def get_ner_labels(self, indices: Sequence[int], ner_enc: Dict[str, int]) -> np.ndarray:
+        """
+        [num_entities, 4]: (номер куска в батче, начало, конец, id лейбла). если сущностей нет, то [(0, 0, 0, 0)]
+        """
+        rows, starts, ends = self._get_rows(indices, "entity_offsets")
+        spans = self.arrays["entity_spans"]
+        codes = _take_ranges(self.arrays["entity_labels"], starts, ends)
+        res = np.zeros((len(rows), 4), dtype=np.int32)
+        res[:, 0] = rows
+        res[:, 1:3] = _take_ranges(spans, starts, ends)
+        res[:, 3] = _encode(codes, vocab=self.meta["entity_labels"], enc=ner_enc)
+        return res if len(res) > 0 else np.zeros((1, 4), dtype=np.int32)
+
+    def get_re_labels(self, indices: Sequence[int], re_enc: Dict[str, int]) -> np.ndarray:
+        """
+        [num_arcs, 4]: (номер куска в батче, head_index, dep_index, id лейбла). если отношений нет, то [(0, 0, 0, 0)]
+        """
+        rows, starts, ends = self._get_rows(indices, "arc_offsets")
+        arcs = _take_ranges(self.arrays["arcs"], starts, ends)
+        assert (arcs[:, :2] != NONE_VALUE).all(), "head_index and dep_index must be set"
+        res = np.zeros((len(rows), 4), dtype=np.int32)
+        res[:, 0] = rows
+        res[:, 1:3] = arcs[:, :2]
+        res[:, 3] = _encode(arcs[:, 2], vocab=self.meta["arc_labels"], enc=re_enc)
+        return res if len(res) > 0 else np.zeros((1, 4), dtype=np.int32)
+
+    def get_coref_labels(self, indices: Sequence[int]) -> np.ndarray:
+        """
+        аналог BertForCoreferenceResolutionMentionPair._get_feed_dict:
+        [num_entities, 3]: (номер куска в батче, индекс сущности, индекс антецедента + 1 или 0, если его нет).
+        """
+        entity_offsets = self.arrays["entity_offsets"]
+        arc_offsets = self.arrays["arc_offsets"]
+        entity_index = self.arrays["entity_index"]
+        arcs = self.arrays["arcs"]
+        res = []
+        for i, c in enumerate(np.asarray(indices)):
+            index_c = entity_index[entity_offsets[c]:entity_offsets[c + 1]]
+            assert (index_c != NONE_VALUE).all(), f"[{self.ids[c]}] entity indices must be set"
+            head2dep = {}
+            for head, dep, _ in arcs[arc_offsets[c]:arc_offsets[c + 1]]:
+                head2dep[head] = dep + 1
+            for k in index_c:
+                res.append((i, k, head2dep.get(k, 0)))
+        if len(res) == 0:
+            res.append((0, 0, 0))
+        return np.array(res, dtype=np.int32)
+
+    def _get_rows(self, indices: Sequence[int], offsets_name: str):
+        """
+        :return: номер куска в батче для каждого элемента, начала и концы диапазонов кусков
+        """
+        indices = np.asarray(indices)
+        offsets = self.arrays[offsets_name]
+        starts = offsets[indices]
+        ends = offsets[indices + 1]
+        rows = np.repeat(np.arange(len(indices), dtype=np.int32), ends - starts)
+        return rows, starts, ends
+
+
+def _take_ranges(arr: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    конкатенация arr[starts[i]:ends[i]] по всем i
+    """
+    if len(starts) == 0:
+        return arr[:0]
+    lengths = ends - starts
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    return arr[positions]
+
+
+def _encode(codes: np.ndarray, vocab: List[str], enc: Dict[str, int]) -> np.ndarray:
+    """
+    коды строковых лейблов корпуса -> id лейблов модели
+    """
+    if len(codes) == 0:
+        return codes
+    uniq, inv = np.unique(codes, return_inverse=True)
+    values = np.array([enc[vocab[u]] for u in uniq], dtype=np.int32)
+    return values[inv]
@@ -1,10 +1,15 @@
 import os
 import shutil
 import re
+import bisect
+import itertools
+import multiprocessing
 import tqdm
 import unicodedata
-from typing import List, Union, Pattern, Callable, IO
-from collections import defaultdict
+from typing import List, Union, Pattern, Callable, IO, Iterable, Iterator, Dict, Tuple, Optional
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from src.data.base import (
     Attribute,
@@ -35,16 +40,60 @@ def parse_collection(
         n: int = None,
         tokens_pattern: Union[str, Pattern] = None,
         ignore_bad_examples: bool = False,
-        read_fn: Callable = None
+        read_fn: Callable = None,
+        num_workers: int = None,
+        names: Iterable[str] = None
 ) -> List[Example]:
     """
     n - сколько примеров распарсить
+    names - если задано, то парсятся только документы с этими именами (без расширения)
+    num_workers - число процессов, по которым распределяется парсинг файлов.
+    None или 1 - парсинг в текущем процессе.
+    порядок примеров не зависит от num_workers.
+    read_fn должна быть picklable (то есть определена на уровне модуля), если num_workers > 1.
+    """
+    examples = list(iter_collection(
+        data_dir=data_dir,
+        n=n,
+        tokens_pattern=tokens_pattern,
+        ignore_bad_examples=ignore_bad_examples,
+        read_fn=read_fn,
+        num_workers=num_workers,
+        names=names
+    ))
+    return examples
+
+
+def iter_collection(
+        data_dir: str,
+        n: int = None,
+        tokens_pattern: Union[str, Pattern] = None,
+        ignore_bad_examples: bool = False,
+        read_fn: Callable = None,
+        num_workers: int = None,
+        names: Iterable[str] = None,
+        buffer_size: int = None,
+        error_counts: Dict[str, int] = None
+) -> Iterator[Example]:
+    """
+    Ленивая версия parse_collection: примеры отдаются по одному по мере парсинга.
+    В памяти одновременно находится не более buffer_size распаршенных, но ещё не отданных примеров,
+    поэтому корпус может не помещаться в оперативку, если потребитель тоже не копит примеры
+    (см. src.data.preprocessing.iter_preprocessed, BaseModel.predict_stream, to_brat).
+
+    :param buffer_size: сколько документов парсится за один заход пулом процессов.
+    по умолчанию num_workers * 16. при num_workers <= 1 не используется.
+    :param error_counts: словарь, в который пишутся счётчики проигнорированных ошибок
+    остальные аргументы - см. parse_collection
     """
     # выбираем файлы, для которых есть исходный текст и разметка
     files = os.listdir(data_dir)
     texts = {x.split('.')[0] for x in files if x.endswith('.txt')}
     answers = {x.split('.')[0] for x in files if x.endswith('.ann')}
-    names_to_use = sorted(texts & answers)  # сортировка для детерминированности
+    names_to_use = texts & answers
+    if names is not None:
+        names_to_use &= set(names)
+    names_to_use = sorted(names_to_use)  # сортировка для детерминированности
     print(f"num .txt files: {len(texts)}")
     print(f"num .ann files: {len(answers)}")
     print(f"num annotated texts: {len(names_to_use)}")
@@ -58,62 +107,108 @@ def parse_collection(
     else:
         tokens_expression = TOKENS_EXPRESSION
 
+    parse_fn = partial(
+        _parse_example_safe,
+        data_dir=data_dir,
+        tokens_expression=tokens_expression,
+        ignore_bad_examples=ignore_bad_examples,
+        read_fn=read_fn
+    )
+
     # парсим примеры для обучения
-    examples = []
-    error_counts = defaultdict(int)
-    for filename in tqdm.tqdm(names_to_parse):
-        try:
-            example = parse_example(
-                data_dir=data_dir,
-                filename=filename,
-                tokens_expression=tokens_expression,
-                read_fn=read_fn
-            )
-            examples.append(example)
-        except (BadLineError, MultiRelationError, NestedNerError, NestedNerSingleEntityTypeError, RegexError) as e:
-            err_name = type(e).__name__
-            print(f"[{filename}] known error {err_name} occurred:")
-            print(e)
-            if ignore_bad_examples:
-                print("example ignored due to flag ignore_bad_examples set to True")
-                print("=" * 50)
-                error_counts[err_name] += 1
-            else:
-                raise e
-        except EntitySpanError as e:
-            err_name = type(e).__name__
-            print(f"[{filename}] known error {err_name} occurred:")
-            print(e)
-            print("trying another readers...")
-            flag = False
-            for read_fn_alt in [read_file_v1, read_file_v2, read_file_v3]:
-                print("reader:", read_fn_alt.__name__)
-                if read_fn_alt.__name__ == read_fn.__name__:
-                    print("ignored due to the same as provided in args")
-                    continue
-                try:
-                    example = parse_example(
-                        data_dir=data_dir,
-                        filename=filename,
-                        tokens_expression=tokens_expression,
-                        read_fn=read_fn_alt
-                    )
-                    examples.append(example)
-                    flag = True
-                    break
-                except EntitySpanError as e:
-                    print(e)
-            if flag:
-                print("success :)")
-            else:
-                print("fail :(")
+    num_examples = 0
+    if error_counts is None:
+        error_counts = defaultdict(int)
+    pbar = tqdm.tqdm(total=len(names_to_parse))
+    if num_workers is None or num_workers <= 1:
+        results = map(parse_fn, names_to_parse)
+        for example in _collect_parsed(results, error_counts=error_counts, pbar=pbar):
+            num_examples += 1
+            yield example
+    else:
+        # imap сохраняет порядок входа => выход такой же, как и в однопроцессном режиме.
+        # документы подаются в пул порциями по buffer_size, чтоб пул не убегал вперёд медленного потребителя
+        buffer_size = buffer_size if buffer_size is not None else num_workers * 16
+        _get_invalid_chars_expression()  # чтоб дочерние процессы получили готовую регулярку
+        assert buffer_size > 0
+        chunksize = max(1, buffer_size // (num_workers * 4))
+        with multiprocessing.Pool(num_workers) as pool:
+            for start in range(0, len(names_to_parse), buffer_size):
+                results = pool.imap(parse_fn, names_to_parse[start:start + buffer_size], chunksize=chunksize)
+                for example in _collect_parsed(results, error_counts=error_counts, pbar=pbar):
+                    num_examples += 1
+                    yield example
+    pbar.close()
+    print(f"successfully parsed {num_examples} examples from {len(names_to_parse)} files.")
+    print(f"error counts: {error_counts}")
+
+
+def _collect_parsed(results: Iterable, error_counts: Dict[str, int], pbar: tqdm.tqdm) -> Iterator[Example]:
+    for example, err_name in results:
+        pbar.update(1)
+        if err_name is not None:
+            error_counts[err_name] += 1
+        if example is not None:
+            yield example
 
-        except Exception as e:
-            print(f"[{filename}] unknown error {type(e).__name__} occurred:")
+
+def _parse_example_safe(
+        filename: str,
+        data_dir: str,
+        tokens_expression: Pattern,
+        ignore_bad_examples: bool = False,
+        read_fn: Callable = None
+) -> Tuple[Optional[Example], Optional[str]]:
+    """
+    парсинг одного примера с обработкой известных ошибок.
+    вынесено в отдельную функцию уровня модуля, чтобы её можно было отправлять в дочерние процессы.
+    :return: (пример или None, если пример проигнорирован; название ошибки, если она учитывается в error_counts)
+    """
+    try:
+        example = parse_example(
+            data_dir=data_dir,
+            filename=filename,
+            tokens_expression=tokens_expression,
+            read_fn=read_fn
+        )
+        return example, None
+    except (BadLineError, MultiRelationError, NestedNerError, NestedNerSingleEntityTypeError, RegexError) as e:
+        err_name = type(e).__name__
+        print(f"[{filename}] known error {err_name} occurred:")
+        print(e)
+        if ignore_bad_examples:
+            print("example ignored due to flag ignore_bad_examples set to True")
+            print("=" * 50)
+            return None, err_name
+        else:
             raise e
-    print(f"successfully parsed {len(examples)} examples from {len(names_to_parse)} files.")
-    print(f"error counts: {error_counts}")
-    return examples
+    except EntitySpanError as e:
+        err_name = type(e).__name__
+        print(f"[{filename}] known error {err_name} occurred:")
+        print(e)
+        print("trying another readers...")
+        read_fn_used = read_fn if read_fn is not None else read_file_v1
+        for read_fn_alt in [read_file_v1, read_file_v2, read_file_v3]:
+            print("reader:", read_fn_alt.__name__)
+            if read_fn_alt.__name__ == read_fn_used.__name__:
+                print("ignored due to the same as provided in args")
+                continue
+            try:
+                example = parse_example(
+                    data_dir=data_dir,
+                    filename=filename,
+                    tokens_expression=tokens_expression,
+                    read_fn=read_fn_alt
+                )
+                print("success :)")
+                return example, None
+            except EntitySpanError as e:
+                print(e)
+        print("fail :(")
+        return None, None
+    except Exception as e:
+        print(f"[{filename}] unknown error {type(e).__name__} occurred:")
+        raise e
 
 
 def read_file_v1(f: IO) -> str:
@@ -330,48 +425,21 @@ def parse_example(
     text_clean = remove_bad_ids(text, bad_ids)
 
     # токенизация текста
-    tokens = []
-    start2token = {}
-    for i, m in enumerate(tokens_expression.finditer(text_clean)):
-        span = Span(*m.span())
-        token = Token(
-            text=m.group(),
-            span_abs=span,
-            span_rel=span,
-            index_abs=i,
-            index_rel=i,
-        )
-        tokens.append(token)
-        start2token[span.start] = token
+    tokens, token_starts = tokenize_text(text_clean, tokens_expression=tokens_expression)
 
     # очистка названия сущности от "плохих символов"
     # фикс спана сущности
     # присвоение токенов сущности
     for entity in entities:
-        start, end = entity.span
-        start_new = start
-        end_new = end
-        bad_ids_entity = []
-        for i in bad_ids:
-            if i <= start:
-                start_new -= 1
-                end_new -= 1
-                if i == start:
-                    bad_ids_entity.append(0)
-            elif start < i < end:
-                end_new -= 1
-                bad_ids_entity.append(i - start)
+        start_new, end_new, bad_ids_entity = fix_entity_span(entity.span, bad_ids)
         entity.span = start_new, end_new
         entity.text = remove_bad_ids(entity.text, bad_ids_entity)
         if text_clean[start_new:end_new] != entity.text:
             raise RegexError(f"[{filename}]  {text_clean[start_new:end_new]} != {entity.text}. "
                              f"Check entity {entity.id} in {filename}.ann file")
 
-        entity_tokens = []
-        for i in range(start_new, end_new):
-            if i in start2token:
-                entity_tokens.append(start2token[i])
-        entity.tokens = entity_tokens
+        # токены, которые начинаются внутри [start_new, end_new)
+        entity.tokens = get_tokens_in_span(tokens, token_starts, start_new, end_new)
 
     # создание инстанса класса Example
     example = Example(
@@ -387,6 +455,61 @@ def parse_example(
     return example
 
 
+def example_from_text(text: str, id: str, tokens_expression: Pattern = TOKENS_EXPRESSION) -> Example:
+    """
+    Пример уровня документа из сырого текста без файла .ann (например, для инференса в онлайн-сервисе).
+    Текст очищается от "плохих" символов и токенизируется так же, как в parse_example.
+    Сущностей, отношений и событий нет.
+    :param text: текст документа
+    :param id: идентификатор документа. он же filename (используется в to_brat)
+    :param tokens_expression: регулярка токенов
+    """
+    bad_ids = get_invalid_char_indices(text)
+    text_clean = remove_bad_ids(text, bad_ids)
+    tokens, _ = tokenize_text(text_clean, tokens_expression=tokens_expression)
+    example = Example(
+        filename=id,
+        id=id,
+        text=text_clean,
+        tokens=tokens,
+        entities=[],
+        arcs=[],
+        events=[]
+    )
+    return example
+
+
+def tokenize_text(text: str, tokens_expression: Pattern = TOKENS_EXPRESSION) -> Tuple[List[Token], List[int]]:
+    """
+    :return: токены и их начала (отсортированы по возрастанию)
+    """
+    tokens = []
+    token_starts = []
+    for i, m in enumerate(tokens_expression.finditer(text)):
+        span = Span(*m.span())
+        token = Token(
+            text=m.group(),
+            span_abs=span,
+            span_rel=span,
+            index_abs=i,
+            index_rel=i,
+        )
+        tokens.append(token)
+        token_starts.append(span.start)
+    return tokens, token_starts
+
+
+def get_tokens_in_span(tokens: List[Token], token_starts: List[int], start: int, end: int) -> List[Token]:
+    """
+    токены, начало которых лежит в [start, end).
+    :param tokens: токены текста
+    :param token_starts: начала токенов (отсортированы по возрастанию)
+    """
+    i = bisect.bisect_left(token_starts, start)
+    j = bisect.bisect_left(token_starts, end)
+    return tokens[i:j]
+
+
 # TODO: докинуть сюда логику с вложенным нером
 def is_valid_example(
         x: Example,
@@ -433,25 +556,83 @@ def _is_control(char):
     return False
 
 
-def get_invalid_char_indices(text):
+_INVALID_CHARS_EXPRESSION = None
+
+
+def _get_invalid_chars_expression() -> Pattern:
+    """
+    регулярка для поиска "плохих" символов.
+    * символы BMP: класс ровно из тех символов, на которых cp == 0 or cp == 0xfffd or _is_control(char)
+    (категории берутся из того же unicodedata). такой класс компилируется в битовую маску, поэтому матчинг быстрый;
+    * символы вне BMP матчатся все, а затем фильтруются в get_invalid_char_indices (они редкие).
+    строится один раз на процесс
+    """
+    global _INVALID_CHARS_EXPRESSION
+    if _INVALID_CHARS_EXPRESSION is None:
+        ranges = []
+        for cp in range(0x10000):
+            if cp == 0 or cp == 0xfffd or _is_control(chr(cp)):
+                if ranges and ranges[-1][1] == cp - 1:
+                    ranges[-1][1] = cp
+                else:
+                    ranges.append([cp, cp])
+        char_class = "".join(f"\\u{start:04x}-\\u{end:04x}" for start, end in ranges)
+        _INVALID_CHARS_EXPRESSION = re.compile(f"[{char_class}\\U00010000-\\U0010ffff]")
+    return _INVALID_CHARS_EXPRESSION
+
+
+def get_invalid_char_indices(text: str) -> List[int]:
+    """
+    отсортированные индексы "плохих" символов текста: нулевой символ, U+FFFD и управляющие символы (категория C*),
+    кроме табуляции и переносов строки.
+    то же, что проверка каждого символа через _is_control, но unicodedata.category не вызывается на каждый символ
+    """
     res = []
-    for i in range(len(text)):
-        char = text[i]
-        cp = ord(char)
-        if cp == 0 or cp == 0xfffd or _is_control(char):
-            res.append(i)
+    for m in _get_invalid_chars_expression().finditer(text):
+        char = m.group()
+        if ord(char) < 0x10000 or _is_control(char):
+            res.append(m.start())
     return res
 
 
-def remove_bad_ids(s, bad_ids):
-    s_clean = ""
+def remove_bad_ids(s: str, bad_ids: List[int]) -> str:
+    """
+    удаление символов с индексами bad_ids (отсортированы по возрастанию)
+    """
+    if not bad_ids:
+        return s
+    parts = []
     start = 0
     for end in bad_ids:
-        s_clean += s[start:end]
+        parts.append(s[start:end])
         start = end + 1
-    if start < len(s):
-        s_clean += s[start:]
-    return s_clean
+    parts.append(s[start:])
+    return "".join(parts)
+
+
+def fix_entity_span(span: Tuple[int, int], bad_ids: List[int]) -> Tuple[int, int, List[int]]:
+    """
+    сдвиг спана сущности после удаления символов bad_ids из текста.
+    эквивалентно циклу по всем bad_ids:
+    * i <= start: сдвигаются и начало, и конец; если i == start, то удаляется первый символ сущности;
+    * start < i < end: сдвигается конец, удаляется символ сущности i - start,
+    но позиции находятся бинарным поиском, а не перебором.
+
+    :param span: (start, end) в исходном тексте
+    :param bad_ids: отсортированные индексы удалённых символов
+    :return: (start_new, end_new, индексы удаляемых символов сущности относительно её начала)
+    """
+    start, end = span
+    num_le_start = bisect.bisect_right(bad_ids, start)
+    num_lt_end = max(bisect.bisect_left(bad_ids, end), num_le_start)
+    start_new = start - num_le_start
+    end_new = end - num_lt_end
+    bad_ids_entity = []
+    if num_le_start > 0 and bad_ids[num_le_start - 1] == start:
+        bad_ids_entity.append(0)
+    for i in bad_ids[num_le_start:num_lt_end]:
+        bad_ids_entity.append(i - start)
+    return start_new, end_new, bad_ids_entity
 
 
 def get_label_prefix(entity_token_index: int, num_entity_tokens: int, ner_encoding: str):
@@ -747,100 +928,182 @@ def to_conll(examples, path):
 
 # TODO: создавать инстансы класса Event на уровне model.predict
 def to_brat(
-        examples: List[Example],
+        examples: Iterable[Example],
         output_dir: str,
-        write_mode: str = "a"
+        write_mode: str = "a",
+        num_workers: int = None
 ):
-    assert write_mode in {"a", "w"}
-    os.makedirs(output_dir, exist_ok=True)
-    event_counter = defaultdict(int)
-    filenames = set()
-    for x in examples:
-        filenames.add(x.filename)
-
-        with open(os.path.join(output_dir, f"{x.filename}.txt"), write_mode) as f:
-            f.write(x.text)
-
-        with open(os.path.join(output_dir, f"{x.filename}.ann"), write_mode) as f:
-            events = {}
-            # сущности
-            for entity in x.entities:
-                start = entity.tokens[0].span_abs.start
-                end = entity.tokens[-1].span_abs.end
-                assert isinstance(entity.id, str)
-                assert entity.id[0] == "T"
-                line = f"{entity.id}\t{entity.label} {start} {end}\t{entity.text}\n"
-                f.write(line)
-                if entity.is_event_trigger:
-                    if entity.id not in events:
-                        id_event = event_counter[x.filename]
-                        events[entity.id] = Event(
-                            id=id_event,
-                            trigger=entity.id,
-                            label=entity.label,
-                        )
-                        event_counter[x.filename] += 1
-
-            # отношения
-            for arc in x.arcs:
-                assert isinstance(arc.rel, str), "forget to transform arc codes to values!"
-                if arc.head in events:
-                    arg = EventArgument(id=arc.dep, role=arc.rel)
-                    events[arc.head].args.append(arg)
-                else:
-                    id_arc = get_id(arc.id, "R")
-                    line = f"{id_arc}\t{arc.rel} Arg1:{arc.head} Arg2:{arc.dep}\n"
-                    f.write(line)
-
-            # события
-            for event in events.values():
-                assert event.id is not None
-                id_event = get_id(event.id, "E")
-                line = f"{id_event}\t{event.label}:{event.trigger}"
-                role2count = defaultdict(int)
-                args_str = ""
-                for arg in event.args:
-                    i = role2count[arg.role]
-                    role = arg.role
-                    if i > 0:
-                        role += str(i + 1)
-                    args_str += f"{role}:{arg.id}" + ' '
-                    role2count[arg.role] += 1
-                args_str = args_str.rstrip()
-                if args_str:
-                    line += ' ' + args_str
-                line += '\n'
-                f.write(line)
-
-
-def to_brat_v2(examples: List[Example], output_dir: str,):
+    """
+    examples может быть генератором: в памяти держатся только подряд идущие примеры одного файла
+    (и не более нескольких групп в очереди пула потоков).
+    подряд идущие примеры с одинаковым filename (например, куски одного документа) пишутся одним открытием файлов;
+    строки .ann собираются в памяти и пишутся одним вызовом write.
+    результат такой же, как при записи каждого примера по отдельности с режимом write_mode:
+    * "a" - тексты и разметки примеров одного файла дописываются друг за другом;
+    * "w" - остаётся последний пример файла.
+
+    :param num_workers: число потоков для записи файлов. None или 1 - запись в текущем потоке
+    """
+    _write_brat(examples, output_dir=output_dir, write_mode=write_mode, num_workers=num_workers, with_events=True)
+
+
+def to_brat_v2(examples: Iterable[Example], output_dir: str, num_workers: int = None):
     """
     без триггеров событий
     :param examples:
     :param output_dir:
+    :param num_workers: см. to_brat
     :return:
     """
+    _write_brat(examples, output_dir=output_dir, write_mode="w", num_workers=num_workers, with_events=False)
+
+
+def _write_brat(
+        examples: Iterable[Example],
+        output_dir: str,
+        write_mode: str,
+        num_workers: int = None,
+        with_events: bool = True
+):
+    assert write_mode in {"a", "w"}
     os.makedirs(output_dir, exist_ok=True)
-    for x in examples:
-        with open(os.path.join(output_dir, f"{x.filename}.txt"), "w") as f:
-            f.write(x.text)
-
-        with open(os.path.join(output_dir, f"{x.filename}.ann"), "w") as f:
-            # сущности
-            for entity in x.entities:
-                start = entity.tokens[0].span_abs.start
-                end = entity.tokens[-1].span_abs.end
-                assert isinstance(entity.id, str)
-                assert entity.id[0] == "T"
-                line = f"{entity.id}\t{entity.label} {start} {end}\t{entity.text}\n"
-                f.write(line)
-
-            # отношения
-            for arc in x.arcs:
-                assert isinstance(arc.rel, str), "forget to transform arc codes to values!"
-                id_arc = get_id(arc.id, "R")
-                line = f"{id_arc}\t{arc.rel} Arg1:{arc.head} Arg2:{arc.dep}\n"
-                f.write(line)
+    event_counter = defaultdict(int)
+
+    executor = None
+    pending = deque()  # (filename, future)
+    filename2future = {}
+    if num_workers is not None and num_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def flush(filename, texts, anns):
+        if executor is None:
+            _write_brat_files(output_dir, filename, "".join(texts), "".join(anns), write_mode)
+            return
+        # файл мог встретиться раньше: дожидаемся предыдущей записи, чтоб сохранить порядок
+        if filename in filename2future:
+            filename2future.pop(filename).result()
+        future = executor.submit(_write_brat_files, output_dir, filename, "".join(texts), "".join(anns), write_mode)
+        filename2future[filename] = future
+        pending.append((filename, future))
+        # ограничение на число групп в очереди
+        while len(pending) > num_workers * 4:
+            filename_done, future_done = pending.popleft()
+            future_done.result()
+            if filename2future.get(filename_done) is future_done:
+                del filename2future[filename_done]
+
+    try:
+        filename_curr = None
+        texts = []
+        anns = []
+        for x in examples:
+            if with_events:
+                ann = _get_ann_content(x, event_counter=event_counter)
+            else:
+                ann = _get_ann_content_v2(x)
+            if x.filename != filename_curr:
+                if filename_curr is not None:
+                    flush(filename_curr, texts, anns)
+                filename_curr = x.filename
+                texts = []
+                anns = []
+            if write_mode == "w":
+                texts = [x.text]
+                anns = [ann]
+            else:
+                texts.append(x.text)
+                anns.append(ann)
+        if filename_curr is not None:
+            flush(filename_curr, texts, anns)
+        for _, future in pending:
+            future.result()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+def _write_brat_files(output_dir: str, filename: str, text: str, ann: str, write_mode: str):
+    with open(os.path.join(output_dir, f"{filename}.txt"), write_mode) as f:
+        f.write(text)
+    with open(os.path.join(output_dir, f"{filename}.ann"), write_mode) as f:
+        f.write(ann)
+
+
+def _get_ann_content(x: Example, event_counter: Dict[str, int]) -> str:
+    """
+    содержимое файла .ann для примера x. сущности, которые являются триггерами событий, порождают события;
+    их номера берутся из event_counter (общий для всех примеров файла)
+    """
+    lines = []
+    events = {}
+    # сущности
+    for entity in x.entities:
+        start = entity.tokens[0].span_abs.start
+        end = entity.tokens[-1].span_abs.end
+        assert isinstance(entity.id, str)
+        assert entity.id[0] == "T"
+        lines.append(f"{entity.id}\t{entity.label} {start} {end}\t{entity.text}\n")
+        if entity.is_event_trigger:
+            if entity.id not in events:
+                id_event = event_counter[x.filename]
+                events[entity.id] = Event(
+                    id=id_event,
+                    trigger=entity.id,
+                    label=entity.label,
+                )
+                event_counter[x.filename] += 1
+
+    # отношения
+    for arc in x.arcs:
+        assert isinstance(arc.rel, str), "forget to transform arc codes to values!"
+        if arc.head in events:
+            arg = EventArgument(id=arc.dep, role=arc.rel)
+            events[arc.head].args.append(arg)
+        else:
+            id_arc = get_id(arc.id, "R")
+            lines.append(f"{id_arc}\t{arc.rel} Arg1:{arc.head} Arg2:{arc.dep}\n")
+
+    # события
+    for event in events.values():
+        assert event.id is not None
+        id_event = get_id(event.id, "E")
+        line = f"{id_event}\t{event.label}:{event.trigger}"
+        role2count = defaultdict(int)
+        args_str = ""
+        for arg in event.args:
+            i = role2count[arg.role]
+            role = arg.role
+            if i > 0:
+                role += str(i + 1)
+            args_str += f"{role}:{arg.id}" + ' '
+            role2count[arg.role] += 1
+        args_str = args_str.rstrip()
+        if args_str:
+            line += ' ' + args_str
+        line += '\n'
+        lines.append(line)
+    return "".join(lines)
+
+
+def _get_ann_content_v2(x: Example) -> str:
+    """
+    содержимое файла .ann для примера x без событий
+    """
+    lines = []
+    # сущности
+    for entity in x.entities:
+        start = entity.tokens[0].span_abs.start
+        end = entity.tokens[-1].span_abs.end
+        assert isinstance(entity.id, str)
+        assert entity.id[0] == "T"
+        lines.append(f"{entity.id}\t{entity.label} {start} {end}\t{entity.text}\n")
+
+    # отношения
+    for arc in x.arcs:
+        assert isinstance(arc.rel, str), "forget to transform arc codes to values!"
+        id_arc = get_id(arc.id, "R")
+        lines.append(f"{id_arc}\t{arc.rel} Arg1:{arc.head} Arg2:{arc.dep}\n")
+    return "".join(lines)
 
 
 def get_id(id_arg: Union[int, str], prefix: str) -> str:
@@ -856,13 +1119,129 @@ def get_id(id_arg: Union[int, str], prefix: str) -> str:
         raise ValueError(f"expected type of id_arg is string or integer, but got {type(id_arg)}")
 
 
-# TODO: протестировать!!1!
-def from_conllu(path: str, warn: bool = True) -> List[Example]:
-    examples = []
-    expression = re.compile(r'# sent_id = (.+\.xml)_(\d+)')
+CONLLU_SENT_ID_EXPRESSION = re.compile(r'# sent_id = (.+\.xml)_(\d+)')
+
+
+def from_conllu(path: str, warn: bool = True, num_workers: int = None, docs_per_shard: int = 64) -> List[Example]:
+    """
+    Чтение файла .conllu (например, SynTagRus). Документ - последовательность предложений с одинаковым
+    именем файла в # sent_id; предложение - чанк документа.
+    num_workers, docs_per_shard - см. iter_conllu
+    """
+    examples = list(iter_conllu(path=path, warn=warn, num_workers=num_workers, docs_per_shard=docs_per_shard))
+    return examples
+
+
+def iter_conllu(
+        path: str,
+        warn: bool = True,
+        num_workers: int = None,
+        docs_per_shard: int = 64,
+        buffer_size: int = None
+) -> Iterator[Example]:
+    """
+    Ленивая версия from_conllu: документы отдаются по мере того, как они закрываются (начинается следующий документ).
+    Файл читается построчно и целиком в памяти не держится.
+
+    Если num_workers > 1, то файл режется по границам документов (строки # sent_id с новым именем файла)
+    на куски по docs_per_shard документов, которые парсятся в пуле процессов.
+    Порядок и содержимое документов не зависят от num_workers.
+
+    :param path: путь к файлу .conllu
+    :param warn: печатать ли предупреждения о предложениях со странными индексами токенов
+    :param num_workers: число процессов. None или 1 - парсинг в текущем процессе
+    :param docs_per_shard: сколько документов в одном куске, отправляемом в процесс
+    :param buffer_size: сколько кусков парсится за один заход пулом. по умолчанию num_workers * 4
+    """
+    # счётчики парсера и счётчики по отданным документам. в конце сверяются: дешёвая проверка,
+    # что ни одно предложение и ни один токен не потерялись
+    stats = defaultdict(int)
+    num_docs = 0
     num_chunks = 0
-    num_chunks_ignored = 0
-    num_tokens_total = 0
+    num_tokens = 0
+    with open(path) as f:
+        if num_workers is None or num_workers <= 1:
+            documents = _iter_conllu_documents(f, warn=warn, stats=stats)
+        else:
+            documents = _iter_conllu_documents_parallel(
+                f, warn=warn, stats=stats, num_workers=num_workers, docs_per_shard=docs_per_shard,
+                buffer_size=buffer_size
+            )
+        for x in documents:
+            num_docs += 1
+            num_chunks += len(x.chunks)
+            num_tokens += sum(len(chunk.tokens) for chunk in x.chunks)
+            yield x
+
+    assert stats["num_chunks"] == num_chunks, f"{stats['num_chunks']} != {num_chunks}"
+    assert stats["num_tokens"] == num_tokens, f"{stats['num_tokens']} != {num_tokens}"
+
+    print("===== DATASET INFO =====")
+    print("num documents:", num_docs)
+    print("num sentences:", num_chunks)
+    print("num tokens:", num_tokens)
+    print("num sentences ignored:", stats["num_chunks_ignored"])
+
+
+def _iter_conllu_documents_parallel(
+        lines: Iterable[str],
+        warn: bool,
+        stats: Dict[str, int],
+        num_workers: int,
+        docs_per_shard: int,
+        buffer_size: int = None
+) -> Iterator[Example]:
+    buffer_size = buffer_size if buffer_size is not None else num_workers * 4
+    assert buffer_size > 0
+    parse_fn = partial(_parse_conllu_shard, warn=warn)
+    shards = _iter_conllu_shards(lines, docs_per_shard=docs_per_shard)
+    with multiprocessing.Pool(num_workers) as pool:
+        while True:
+            # куски подаются в пул порциями, чтоб не читать весь файл в память раньше потребителя
+            buffer = list(itertools.islice(shards, buffer_size))
+            if not buffer:
+                break
+            for examples, stats_shard in pool.imap(parse_fn, buffer):
+                for k, v in stats_shard.items():
+                    stats[k] += v
+                yield from examples
+
+
+def _iter_conllu_shards(lines: Iterable[str], docs_per_shard: int) -> Iterator[List[str]]:
+    """
+    Нарезка строк файла на куски из целых документов.
+    Кусок заканчивается перед строкой # sent_id, с которой начинается новый документ,
+    поэтому парсинг кусков по отдельности даёт то же, что и парсинг всего файла.
+    """
+    assert docs_per_shard > 0
+    shard = []
+    filename_doc = None
+    num_docs = 0
+    for line in lines:
+        if line.startswith("# sent_id"):
+            m = CONLLU_SENT_ID_EXPRESSION.match(line.strip())
+            if m is not None and m.group(1) != filename_doc:
+                if num_docs == docs_per_shard:
+                    yield shard
+                    shard = []
+                    num_docs = 0
+                filename_doc = m.group(1)
+                num_docs += 1
+        shard.append(line)
+    if shard:
+        yield shard
+
+
+def _parse_conllu_shard(lines: List[str], warn: bool) -> Tuple[List[Example], Dict[str, int]]:
+    stats = defaultdict(int)
+    examples = list(_iter_conllu_documents(lines, warn=warn, stats=stats))
+    return examples, dict(stats)
+
+
+def _iter_conllu_documents(lines: Iterable[str], warn: bool, stats: Dict[str, int]) -> Iterator[Example]:
+    """
+    Парсинг строк файла .conllu. В stats пишутся счётчики num_chunks, num_tokens, num_chunks_ignored.
+    """
     num_tokens_chunk = 0
     chunks_i = []
     tokens_ij = []
@@ -894,119 +1273,105 @@ def from_conllu(path: str, warn: bool = True) -> List[Example]:
         chunks_i.append(chunk)
         tokens_ij.clear()
 
-    with open(path) as f:
-        for i, line in enumerate(f):
-            line = line.strip()
-            if len(line) == 0:
-                continue
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
 
-            if line[0] == "#":
-                if line.startswith("# sent_id"):
-                    if flag_strange:
-                        flag_strange = False
-                        num_chunks_ignored += 1
-                        tokens_ij.clear()
-                        num_tokens_chunk = 0
-                    else:
-                        if filename_doc is not None:
-                            if len(tokens_ij) > 0:
-                                append_chunk()
-                                num_chunks += 1
-                                num_tokens_total += num_tokens_chunk
-                                num_tokens_chunk = 0
-                            else:
-                                print(f"[{filename_doc}] chunk {id_sent} has no tokens")
-
-                    m = expression.match(line)
-                    filename_chunk = m.group(1)
-                    id_sent = int(m.group(2))
-
-                    if filename_doc is None:
-                        filename_doc = filename_chunk
-                    else:
-                        if filename_doc != filename_chunk:
-                            if len(chunks_i) > 0:
-                                x = Example(filename=filename_doc, chunks=chunks_i.copy())
-                                examples.append(x)
-                                chunks_i.clear()
-                            else:
-                                print(f"[{filename_doc}] no valid chunks")
-                            filename_doc = filename_chunk
-
-                elif line.startswith("# text"):
-                    text = line[9:]
-            else:
+        if line[0] == "#":
+            if line.startswith("# sent_id"):
                 if flag_strange:
-                    continue
-                features = line.split("\t")
-                token_id = features[0]
-                token = features[1]
-                pos = features[3]
-                head = features[6]
-                rel = features[7]
-
-                try:
-                    int(token_id)
-                except ValueError:
-                    if warn:
-                        print(f"[{filename_doc}] [{id_sent}] strange token index {token_id}")
-                    flag_strange = True
-
-                try:
-                    head = int(head)
-                except ValueError:
-                    if warn:
-                        print(f"[{filename_doc}] [{id_sent}] strange head index {head} "
-                              f"for token {token_id} <bos>{token}<eos>")
-                    flag_strange = True
+                    flag_strange = False
+                    stats["num_chunks_ignored"] += 1
+                    tokens_ij.clear()
+                    num_tokens_chunk = 0
+                else:
+                    if filename_doc is not None:
+                        if len(tokens_ij) > 0:
+                            append_chunk()
+                            stats["num_chunks"] += 1
+                            stats["num_tokens"] += num_tokens_chunk
+                            num_tokens_chunk = 0
+                        else:
+                            print(f"[{filename_doc}] chunk {id_sent} has no tokens")
+
+                m = CONLLU_SENT_ID_EXPRESSION.match(line)
+                filename_chunk = m.group(1)
+                id_sent = int(m.group(2))
+
+                if filename_doc is None:
+                    filename_doc = filename_chunk
+                else:
+                    if filename_doc != filename_chunk:
+                        if len(chunks_i) > 0:
+                            x = Example(filename=filename_doc, chunks=chunks_i.copy())
+                            chunks_i.clear()
+                            yield x
+                        else:
+                            print(f"[{filename_doc}] no valid chunks")
+                        filename_doc = filename_chunk
 
-                if flag_strange:
-                    continue
+            elif line.startswith("# text"):
+                text = line[9:]
+        else:
+            if flag_strange:
+                continue
+            features = line.split("\t")
+            token_id = features[0]
+            token = features[1]
+            pos = features[3]
+            head = features[6]
+            rel = features[7]
+
+            try:
+                int(token_id)
+            except ValueError:
+                if warn:
+                    print(f"[{filename_doc}] [{id_sent}] strange token index {token_id}")
+                flag_strange = True
+
+            try:
+                head = int(head)
+            except ValueError:
+                if warn:
+                    print(f"[{filename_doc}] [{id_sent}] strange head index {head} "
+                          f"for token {token_id} <bos>{token}<eos>")
+                flag_strange = True
+
+            if flag_strange:
+                continue
 
-                if head == 0:
-                    head = -1
-                else:
-                    head -= 1
+            if head == 0:
+                head = -1
+            else:
+                head -= 1
 
-                t = Token(
-                    text=token,
-                    id_head=head,
-                    rel=rel,
-                    pos=pos
-                )
-                tokens_ij.append(t)
-                num_tokens_chunk += 1
+            t = Token(
+                text=token,
+                id_head=head,
+                rel=rel,
+                pos=pos
+            )
+            tokens_ij.append(t)
+            num_tokens_chunk += 1
 
     if flag_strange:
-        num_chunks_ignored += 1
+        stats["num_chunks_ignored"] += 1
     else:
         if filename_doc is not None:
             if len(tokens_ij) > 0:
                 append_chunk()
-                num_chunks += 1
-                num_tokens_total += num_tokens_chunk
+                stats["num_chunks"] += 1
+                stats["num_tokens"] += num_tokens_chunk
             else:
                 print(f"[{filename_doc}] chunk {id_sent} has no tokens")
 
     if len(chunks_i) > 0:
         x = Example(filename=filename_doc, chunks=chunks_i.copy())
-        examples.append(x)
+        yield x
     else:
         print(f"[{filename_doc}] no valid chunks")
 
-    n = sum(len(x.chunks) for x in examples)
-    assert num_chunks == n, f"{num_chunks} != {n}"
-    n = sum(sum(len(chunk.tokens) for chunk in x.chunks) for x in examples)
-    assert num_tokens_total == n, f"{num_tokens_total} != {n}"
-
-    print("===== DATASET INFO =====")
-    print("num documents:", len(examples))
-    print("num sentences:", num_chunks)
-    print("num tokens:", num_tokens_total)
-    print("num sentences ignored:", num_chunks_ignored)
-
-    return examples
-
 
 # if __name__ == "__main__":
 #     path = "/home/vitaly/Desktop/ru_syntagrus-ud-dev.conllu"
@@ -1,30 +1,133 @@
+import bisect
 import copy
-from typing import List, Pattern, Tuple, Dict
+import re
+import hashlib
+import multiprocessing
+import os
+import pickle
+import shelve
+import weakref
+from typing import List, Pattern, Tuple, Dict, Iterable, Iterator, Union, Callable
 from itertools import accumulate
 from rusenttokenize import ru_sent_tokenize
 from collections import defaultdict
 import nltk
 
 from src.data.base import (
-    Entity,
     Example,
     Languages,
     NerEncodings,
     NerPrefixJoiners,
     TOKENS_EXPRESSION,
     Span,
+    TokenView,
+    EntityView,
 )
-from src.utils import get_connected_components
+from src.data.io import example_from_text
+from src.utils import get_connected_components, get_tokenizer_hash, LRUCache
 
 # split
 
 
+def split_sentences(
+        text: str,
+        lang: str = Languages.RU,
+        tokens_expression: Pattern = None
+) -> Tuple[List[str], List[int]]:
+    """
+    Разбиение текста на предложения.
+    :return: предложения и pointers - индексы токенов, с которых начинаются предложения, плюс число токенов в конце
+    """
+    split_fn = ru_sent_tokenize if lang == Languages.RU else nltk.sent_tokenize
+    expression = tokens_expression if tokens_expression is not None else TOKENS_EXPRESSION
+    sent_candidates = [sent for sent in split_fn(text) if len(sent) > 0]
+    lengths = [len(expression.findall(sent)) for sent in sent_candidates]
+    pointers = [0] + list(accumulate(lengths))
+    return sent_candidates, pointers
+
+
+class SentencesCache:
+    """
+    Кэш результатов split_sentences по хэшу текста, языку и регулярке токенов.
+    В памяти хранится не более maxsize документов (LRU). Если задан path, то записи дополнительно
+    хранятся на диске (shelve) и переживают перезапуск: повторные эксперименты с другими window и stride
+    не разбивают тексты на предложения заново.
+
+    Предложения хранятся в виде спанов в исходном тексте, а не строк.
+    Дисковый кэш не рассчитан на одновременную запись из нескольких процессов.
+    """
+    def __init__(self, maxsize: int = 100000, path: str = None):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self.disk = shelve.open(path) if path is not None else None
+
+    def get(
+            self,
+            text: str,
+            lang: str = Languages.RU,
+            tokens_expression: Pattern = None
+    ) -> Tuple[List[str], List[int]]:
+        """
+        то же, что split_sentences(text, lang, tokens_expression)
+        """
+        expression = tokens_expression if tokens_expression is not None else TOKENS_EXPRESSION
+        key = self.get_key(text=text, lang=lang, tokens_expression=expression)
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        if value is None:
+            sent_candidates, pointers = split_sentences(text=text, lang=lang, tokens_expression=expression)
+            value = self._encode(text, sent_candidates), pointers
+            self.memory.put(key, value)
+            if self.disk is not None:
+                self.disk[key] = value
+        sentences, pointers = value
+        return self._decode(text, sentences), list(pointers)
+
+    @staticmethod
+    def get_key(text: str, lang: str, tokens_expression: Pattern) -> str:
+        h = hashlib.sha1()
+        h.update(f"{lang}\n{tokens_expression.pattern}\n".encode())
+        h.update(text.encode())
+        return h.hexdigest()
+
+    @staticmethod
+    def _encode(text: str, sent_candidates: List[str]) -> Tuple:
+        """
+        предложения -> спаны в тексте. если какое-то предложение не является подстрокой текста
+        (сплиттер что-то поменял внутри), то хранятся сами строки
+        """
+        spans = []
+        start = 0
+        for sent in sent_candidates:
+            start = text.find(sent, start)
+            if start == -1:
+                return tuple(sent_candidates)
+            spans.append((start, start + len(sent)))
+            start += len(sent)
+        return tuple(spans)
+
+    @staticmethod
+    def _decode(text: str, sentences: Tuple) -> List[str]:
+        if sentences and isinstance(sentences[0], str):
+            return list(sentences)
+        return [text[start:end] for start, end in sentences]
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+
 def split_example_v1(
         example: Example,
         window: int = 1,
         stride: int = 1,
         lang: str = Languages.RU,
-        tokens_expression: Pattern = None
+        tokens_expression: Pattern = None,
+        sentences_cache: SentencesCache = None
 ) -> List[Example]:
     """
     Кусок исходного примера размером window предложений
@@ -35,29 +138,21 @@ def split_example_v1(
     :param stride: страйд
     :param lang: язык
     :param tokens_expression
+    :param sentences_cache: кэш разбиения на предложения
     :return:
     """
     assert example.id is not None
 
     if not example.text:
         print(f"[{example.id} WARNING]: empty text")
-        return [Example(**example.__dict__)]
+        return [example.copy]
 
-    if lang == Languages.RU:
-        split_fn = ru_sent_tokenize
+    if sentences_cache is not None:
+        sent_candidates, pointers = sentences_cache.get(example.text, lang=lang, tokens_expression=tokens_expression)
     else:
-        split_fn = nltk.sent_tokenize
-
-    if tokens_expression is not None:
-        expression = tokens_expression
-    else:
-        expression = TOKENS_EXPRESSION
-
-    sent_candidates = [sent for sent in split_fn(example.text) if len(sent) > 0]
-    lengths = [len(expression.findall(sent)) for sent in sent_candidates]
-    assert sum(lengths) == len(example.tokens)
+        sent_candidates, pointers = split_sentences(example.text, lang=lang, tokens_expression=tokens_expression)
+    assert pointers[-1] == len(example.tokens)
 
-    pointers = [0] + list(accumulate(lengths))
     entity_spans = [
         Span(start=entity.tokens[0].index_abs, end=entity.tokens[-1].index_abs) for entity in example.entities
     ]
@@ -119,11 +214,15 @@ def split_example_v2(
         stride: int = 1,
         lang: str = Languages.RU,
         tokens_expression: Pattern = None,
-        fix_pointers: bool = True
+        fix_pointers: bool = True,
+        sentences_cache: SentencesCache = None,
+        max_pieces: int = None,
+        max_entities: int = None
 ) -> List[Example]:
     """
     Кусок исходного примера размером window предложений.
-    deepcopy применяется только к копированию инстансов класса Arc, Event.
+    Токены и сущности куска не копируются: это TokenView и EntityView над токенами и сущностями документа.
+    События и отношения - поверхностные копии, так как индексы сущностей у каждого куска свои.
     работает на порядок быстрее, чем v1
 
     :param example: пример на уровне документа
@@ -138,6 +237,11 @@ def split_example_v2(
     что не есть хорошо при инференсе на уровне документа.
     по этой причине было решено сначала фиксить pointers, а потом выводить куски над пофикшенными предложениями:
     см. fix_pointers_fn и get_sentences_spans_fixed_pointers
+    :param sentences_cache: кэш разбиения на предложения (см. SentencesCache)
+    :param max_pieces: если задан, то window и stride игнорируются: куски без перекрытий набираются из целых
+     предложений до бюджета в max_pieces bpe-кусочков (см. get_sentences_spans_by_budget).
+     к токенам уже должен быть применён apply_bpe. при инференсе нужно ставить config["inference"]["window"] = None
+    :param max_entities: бюджет сущностей на кусок при max_pieces
     :return:
     """
     # чтоб избавиться от warning "Expected type Optional[str], got (o: object)"
@@ -145,16 +249,14 @@ def split_example_v2(
     assert isinstance(example.id, str)
     if not example.text:
         print(f"[{example.id} WARNING]: empty text")
-        return [Example(**example.__dict__)]
-
-    split_fn = ru_sent_tokenize if lang == Languages.RU else nltk.sent_tokenize
-    expression = tokens_expression if tokens_expression is not None else TOKENS_EXPRESSION
+        return [example.copy]
 
-    sent_candidates = [sent for sent in split_fn(example.text) if len(sent) > 0]
-    lengths = [len(expression.findall(sent)) for sent in sent_candidates]
-    assert sum(lengths) == len(example.tokens)
+    if sentences_cache is not None:
+        sent_candidates, pointers = sentences_cache.get(example.text, lang=lang, tokens_expression=tokens_expression)
+    else:
+        sent_candidates, pointers = split_sentences(example.text, lang=lang, tokens_expression=tokens_expression)
+    assert pointers[-1] == len(example.tokens)
 
-    pointers = [0] + list(accumulate(lengths))
     entity_spans = [
         Span(start=entity.tokens[0].index_abs, end=entity.tokens[-1].index_abs) for entity in example.entities
     ]
@@ -165,7 +267,18 @@ def split_example_v2(
     # TODO: делать это вне этой функции
     assign_sent_ids_to_tokens(example=example, pointers=pointers)
 
-    if fix_pointers:
+    if max_pieces is not None:
+        sent_num_pieces = get_sent_num_pieces(example=example, pointers=pointers)
+        sent_spans = get_sentences_spans_by_budget(
+            sent_num_pieces=sent_num_pieces,
+            sent_num_entities=get_sent_num_entities(example=example, num_sentences=len(pointers) - 1),
+            max_pieces=max_pieces,
+            max_entities=max_entities
+        )
+        for i, n in enumerate(sent_num_pieces):
+            if n > max_pieces:
+                print(f"[{example.id} WARNING]: sentence {i} has {n} pieces > max_pieces {max_pieces}")
+    elif fix_pointers:
         sent_spans = get_sentences_spans(
             entity_spans=entity_spans,
             pointers=pointers,
@@ -189,93 +302,85 @@ def split_example_v2(
         start = pointers[span.start]
         end = pointers[span.end]
 
-        # tokens
-        # TODO: рассмотреть случай, при котором text начинается с пробелов
-        # tokens = example.tokens[span.span_tokens[0]:span.span_tokens[1]]
-        tokens = []
-        # print(len(example.tokens), start_token)
-        offset = example.tokens[start].span_abs.start
-        token_assignment_map = {}
-        for j, t in enumerate(example.tokens[start:end]):
-            # t_copy = Token(
-            #     text=t.text,
-            #     span_abs=t.span_abs,
-            #     span_rel=Span(start=t.span_abs.start - offset, end=t.span_abs.end - offset),
-            #     index_abs=t.index_abs,
-            #     index_rel=j,
-            #     labels=t.labels.copy(),
-            #     pieces=t.pieces.copy(),
-            #     token_ids=t.token_ids.copy(),
-            #     id_sent=t.id_sent,
-            #     id_head=t.id_head,
-            #     rel=t.rel
-            # )
-            t_copy = t.copy
-            t_copy.span_rel = Span(start=t.span_abs.start - offset, end=t.span_abs.end - offset)
-            t_copy.index_rel = j
-            tokens.append(t_copy)
-            token_assignment_map[t] = t_copy
+        id_child = f"{example.id}_{span.start}-{span.end}"
+        example_copy = get_chunk(example=example, id_chunk=id_child, text=text, start=start, end=end)
+        res.append(example_copy)
 
-        # entities
-        entity_ids = set()
-        entities = []
-        for entity in example.entities:
-            if start <= entity.tokens[0].index_abs <= entity.tokens[-1].index_abs < end:
-                entity_new = Entity(
-                    id=entity.id,
-                    label=entity.label,
-                    text=entity.text,
-                    tokens=[token_assignment_map[t] for t in entity.tokens],
-                    is_event_trigger=entity.is_event_trigger,
-                    attrs=entity.attrs.copy(),
-                    comment=entity.comment,
-                    index=entity.index,
-                    id_chain=entity.id_chain
-                )
-                entities.append(entity_new)
-                entity_ids.add(entity.id)
+    return res
 
-        # events  TODO: сделать без deepcopy
-        events = [copy.deepcopy(event) for event in example.events if event.trigger in entity_ids]
 
-        # arcs  TODO: сделать без deepcopy
-        arcs = [copy.deepcopy(arc) for arc in example.arcs if (arc.head in entity_ids) and (arc.dep in entity_ids)]
+def get_chunk(example: Example, id_chunk: str, text: str, start: int, end: int) -> Example:
+    """
+    кусок документа из токенов [start, end)
+    """
+    # tokens
+    # TODO: рассмотреть случай, при котором text начинается с пробелов
+    # токены куска - представления токенов документа без копирования (см. TokenView)
+    offset = example.tokens[start].span_abs.start
+    tokens = [TokenView(t, offset=offset, start=start) for t in example.tokens[start:end]]
+
+    # entities: представления сущностей документа над токенами куска (см. EntityView)
+    entity_ids = set()
+    entities = []
+    for entity in example.entities:
+        if start <= entity.tokens[0].index_abs <= entity.tokens[-1].index_abs < end:
+            entities.append(EntityView(entity, tokens=[tokens[t.index_abs - start] for t in entity.tokens]))
+            entity_ids.add(entity.id)
+
+    # events, arcs: поверхностные копии, так как индексы сущностей у каждого куска свои
+    events = [event.copy for event in example.events if event.trigger in entity_ids]
+    arcs = [arc.copy for arc in example.arcs if (arc.head in entity_ids) and (arc.dep in entity_ids)]
+
+    chunk = Example(
+        filename=example.filename,
+        id=id_chunk,
+        text=text,
+        tokens=tokens,
+        entities=entities,
+        events=events,
+        arcs=arcs,
+        label=example.label,
+        parent=example.id,
+    )
+    return chunk
 
-        id_child = f"{example.id}_{span.start}-{span.end}"
-        example_copy = Example(
-            filename=example.filename,
-            id=id_child,
-            text=text,
-            tokens=tokens,
-            entities=entities,
-            events=events,
-            arcs=arcs,
-            label=example.label,
-            parent=example.id,
-        )
 
-        res.append(example_copy)
+def fix_pointers_fn(pointers: List[int], entity_spans: List[Span]) -> List[int]:
+    """
+    выкидываются границы предложений, которые проходят через сущность: span.start < p <= span.end.
+    за O((num_sentences + num_entities) * log(num_entities)), а не перебором всех спанов для каждой границы
+    """
+    is_bad_pointer = get_bad_pointer_fn(entity_spans)
+    return [p for p in pointers if not is_bad_pointer(p)]
 
-    return res
 
+def get_bad_pointer_fn(entity_spans: List[Span]) -> Callable[[int], bool]:
+    """
+    Функция p -> {True, если существует span из entity_spans: span.start < p <= span.end}.
+    Полуинтервалы (start, end] сортируются и сливаются в непересекающиеся отрезки, проверка - бинпоиском.
+    """
+    intervals = sorted((span[0] + 1, span[1]) for span in entity_spans if span[0] < span[1])
+    starts = []
+    ends = []
+    for start, end in intervals:
+        if starts and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+
+    def is_bad_pointer(p: int) -> bool:
+        i = bisect.bisect_right(starts, p) - 1
+        return i >= 0 and p <= ends[i]
 
-def fix_pointers_fn(pointers: List[int], entity_spans: List[Span]) -> List[int]:
-    res = []
-    for p in pointers:
-        is_good = True
-        for span in entity_spans:
-            if span.start < p <= span.end:
-                is_good = False
-                break
-        if is_good:
-            res.append(p)
-    return res
+    return is_bad_pointer
 
 
 def get_sentences_spans(entity_spans: List[Span], pointers: List[int], window: int = 1, stride: int = None) -> List[Span]:
     """
     предполагается, что pointers не пофикшены: то есть граница предложения может проходить через сущность.
-    TODO: дописать описание
+    проверка того, что граница окна проходит через сущность, делается бинпоиском по слитым спанам сущностей
+    (см. get_bad_pointer_fn), а не перебором всех сущностей.
 
     :param entity_spans: индексы токенов границ именных сущностей
     :param pointers: индексы токенов, определяющий границы предложений.
@@ -301,41 +406,35 @@ def get_sentences_spans(entity_spans: List[Span], pointers: List[int], window: i
     if window >= num_sentences:
         return [Span(start=0, end=num_sentences)]
 
+    is_bad_pointer = get_bad_pointer_fn(entity_spans)
+
     res = []
     start = 0
     end = window
-    is_good_split = True  # разделение на предложения плохое, если оно проходит через именную сущность
     bad_starts = set()  # индексы предложений, которые содержат только часть сущности
     while True:
-        # print(span_ptr)
-        end_token_id = pointers[end]
-
-        for span in entity_spans:
-            if span[0] < end_token_id <= span[1]:
-                is_good_split = False
-                break
-
-        if is_good_split:
+        if is_bad_pointer(pointers[end]):
+            bad_starts.add(end)
+            end = min(num_sentences, end + 1)
+        else:
             res.append(Span(start=start, end=end))
             start = min(num_sentences - 1, start + stride)
             while start in bad_starts:
                 start += 1
             end = min(num_sentences, start + window)
-        else:
-            bad_starts.add(end)
-            end = min(num_sentences, end + 1)
 
         if end == num_sentences:
             res.append(Span(start=start, end=end))
             break
 
-        # присвоение флагу is_good_split дефолтного значения
-        is_good_split = True
-
     return res
 
 
 def get_sentences_spans_fixed_pointers(num_sentences: int, window: int = 1, stride: int = None) -> List[Span]:
+    """
+    окна по window предложений с шагом stride. если хвост документа не покрыт последним полным окном,
+    то добавляется укороченное окно [start, num_sentences) с очередного шага
+    """
     # stride
     if stride is None:
         stride = window
@@ -354,6 +453,69 @@ def get_sentences_spans_fixed_pointers(num_sentences: int, window: int = 1, stri
             start += stride
         else:
             break
+    # при stride > 1 хвост документа может не попасть ни в одно окно.
+    # добавляем укороченное окно с того же шага, как в get_sentences_spans
+    if res[-1].end < num_sentences:
+        res.append(Span(start=start, end=num_sentences))
+    return res
+
+
+def get_sentences_spans_by_budget(
+        sent_num_pieces: List[int],
+        sent_num_entities: List[int] = None,
+        max_pieces: int = 510,
+        max_entities: int = None
+) -> List[Span]:
+    """
+    Жадная упаковка целых предложений в куски без перекрытий: очередное предложение добавляется в текущий кусок,
+    если после этого суммарное число bpe-кусочков не превысит max_pieces, а число сущностей - max_entities.
+    Предложение, которое само по себе не влезает в бюджет, становится отдельным куском.
+
+    :param sent_num_pieces: число bpe-кусочков в каждом предложении
+    :param sent_num_entities: число сущностей в каждом предложении
+    :param max_pieces: бюджет кусочков на кусок (без [CLS] и [SEP])
+    :param max_entities: бюджет сущностей на кусок. ограничивает тензоры пар сущностей размера E^2 в RE и coref
+    :return: spans: список спанов предложений
+    """
+    assert max_pieces > 0, f"max_pieces: {max_pieces}"
+    if max_entities is not None:
+        assert sent_num_entities is not None
+        assert len(sent_num_entities) == len(sent_num_pieces)
+
+    res = []
+    start = 0
+    num_pieces = 0
+    num_entities = 0
+    for i, n in enumerate(sent_num_pieces):
+        e = sent_num_entities[i] if max_entities is not None else 0
+        if i > start:
+            if num_pieces + n > max_pieces or (max_entities is not None and num_entities + e > max_entities):
+                res.append(Span(start=start, end=i))
+                start = i
+                num_pieces = 0
+                num_entities = 0
+        num_pieces += n
+        num_entities += e
+    if len(sent_num_pieces) > 0:
+        res.append(Span(start=start, end=len(sent_num_pieces)))
+    return res
+
+
+def get_sent_num_pieces(example: Example, pointers: List[int]) -> List[int]:
+    """
+    число bpe-кусочков по предложениям. к токенам должен быть применён apply_bpe
+    """
+    return [sum(len(t.pieces) for t in example.tokens[pointers[i]:pointers[i + 1]]) for i in range(len(pointers) - 1)]
+
+
+def get_sent_num_entities(example: Example, num_sentences: int) -> List[int]:
+    """
+    число сущностей по предложениям. сущность относится к предложению своего первого токена.
+    токенам должны быть присвоены id_sent (см. assign_sent_ids_to_tokens)
+    """
+    res = [0] * num_sentences
+    for entity in example.entities:
+        res[entity.tokens[0].id_sent] += 1
     return res
 
 
@@ -366,19 +528,92 @@ def assign_sent_ids_to_tokens(example: Example, pointers: List[int]):
             t.id_sent = i
 
 
+class BpeCache:
+    """
+    Кэш text -> (pieces, token_ids) для одного токенизатора.
+    В памяти хранится не более maxsize токенов (LRU). Если задан path (например, bpe_cache.pkl рядом с vocab.txt
+    в папке модели), то кэш подгружается оттуда при создании и сохраняется туда методом save.
+    Файл от другого словаря или регистра игнорируется.
+
+    Списки pieces и token_ids общие у всех токенов с одинаковым текстом: их нельзя менять на месте.
+    """
+    def __init__(self, tokenizer, maxsize: int = 1000000, path: str = None):
+        self.tokenizer = tokenizer
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self._tokenizer_hash = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def get(self, text: str) -> Tuple[List[str], List[int]]:
+        value = self.memory.get(text)
+        if value is None:
+            pieces = self.tokenizer.tokenize(text)
+            value = pieces, self.tokenizer.convert_tokens_to_ids(pieces)
+            self.memory.put(text, value)
+        return value
+
+    @property
+    def tokenizer_hash(self) -> str:
+        if self._tokenizer_hash is None:
+            self._tokenizer_hash = get_tokenizer_hash(self.tokenizer)
+        return self._tokenizer_hash
+
+    def save(self, path: str = None):
+        path = path if path is not None else self.path
+        assert path is not None, "path is not set"
+        data = {"tokenizer": self.tokenizer_hash, "items": list(self.memory.items())}
+        # запись во временный файл и переименование, чтоб не оставить битый кэш при падении
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        print(f"bpe cache with {len(self.memory)} tokens saved to {path}")
+
+    def load(self, path: str = None):
+        path = path if path is not None else self.path
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        if data["tokenizer"] != self.tokenizer_hash:
+            print(f"bpe cache {path} was built with another tokenizer; ignoring it")
+            return
+        for text, value in data["items"]:
+            self.memory.put(text, value)
+        print(f"bpe cache with {len(self.memory)} tokens loaded from {path}")
+
+
+# кэши по умолчанию: по одному на токенизатор, живут, пока жив токенизатор
+_bpe_caches = weakref.WeakKeyDictionary()
+
+
+def get_bpe_cache(tokenizer) -> BpeCache:
+    """
+    общий кэш токенизатора, который apply_bpe использует по умолчанию
+    """
+    try:
+        return _bpe_caches[tokenizer]
+    except KeyError:
+        cache = _bpe_caches[tokenizer] = BpeCache(tokenizer)
+        return cache
+
+
 # TODO: последние два аргумента нужны только для flat ner!!1!
 def apply_bpe(
         example: Example,
         tokenizer,
         ner_prefix_joiner: str = NerPrefixJoiners.HYPHEN,
-        ner_encoding: str = NerEncodings.BIO
+        ner_encoding: str = NerEncodings.BIO,
+        bpe_cache: BpeCache = None
 ):
+    """
+    :param bpe_cache: кэш bpe-кусочков. по умолчанию - общий кэш токенизатора (см. get_bpe_cache)
+    """
     if ner_encoding != NerEncodings.BIO:
         raise NotImplementedError
 
+    bpe_cache = bpe_cache if bpe_cache is not None else get_bpe_cache(tokenizer)
     for t in example.tokens:
-        t.pieces = tokenizer.tokenize(t.text)
-        t.token_ids = tokenizer.convert_tokens_to_ids(t.pieces)
+        t.pieces, t.token_ids = bpe_cache.get(t.text)
         # num_pieces = len(t.pieces)
         # for label in t.labels:
         #     # (Иван, B-PER) -> ([Ив, #ан], [B-PER, I-PER])
@@ -392,6 +627,26 @@ def apply_bpe(
         #         t.labels_pieces += [pad] * (num_pieces - 1)
 
 
+def apply_bpe_corpus(examples: Iterable[Example], tokenizer, bpe_cache: BpeCache = None):
+    """
+    apply_bpe над корпусом: токенизатор вызывается один раз на каждую уникальную словоформу.
+    токены кусков, собранных split_example_v2, - представления токенов документов,
+    поэтому достаточно применить к документам.
+    :param bpe_cache: кэш bpe-кусочков (например, с диска). новые словоформы тоже в него пишутся
+    """
+    examples = list(examples)
+    bpe_cache = bpe_cache if bpe_cache is not None else get_bpe_cache(tokenizer)
+    text2value = {}
+    for x in examples:
+        for t in x.tokens:
+            if t.text not in text2value:
+                text2value[t.text] = bpe_cache.get(t.text)
+    print(f"num unique tokens: {len(text2value)}")
+    for x in examples:
+        for t in x.tokens:
+            t.pieces, t.token_ids = text2value[t.text]
+
+
 def enumerate_entities(example: Example):
     id2index = {}
     entities_sorted = sorted(example.entities, key=lambda e: (e.tokens[0].index_rel, e.tokens[-1].index_rel))
@@ -404,6 +659,221 @@ def enumerate_entities(example: Example):
         arc.dep_index = id2index[arc.dep]
 
 
+def preprocess_example(
+        example: Example,
+        tokenizer,
+        window: int = 1,
+        stride: int = 1,
+        lang: str = Languages.RU,
+        tokens_expression: Pattern = None,
+        fix_pointers: bool = True,
+        sentences_cache: SentencesCache = None,
+        bpe_cache: BpeCache = None,
+        max_pieces: int = None,
+        max_entities: int = None
+):
+    """
+    split_example_v2 -> apply_bpe -> enumerate_entities для одного документа.
+    результат пишется в example.chunks
+    :param max_pieces, max_entities: бюджет куска вместо window и stride (см. split_example_v2)
+    """
+    # токены кусков - представления токенов документа, поэтому bpe применяется один раз на уровне документа
+    apply_bpe(example, tokenizer=tokenizer, bpe_cache=bpe_cache)
+    example.chunks = split_example_v2(
+        example=example,
+        window=window,
+        stride=stride,
+        lang=lang,
+        tokens_expression=tokens_expression,
+        fix_pointers=fix_pointers,
+        sentences_cache=sentences_cache,
+        max_pieces=max_pieces,
+        max_entities=max_entities
+    )
+    for chunk in example.chunks:
+        enumerate_entities(chunk)
+
+
+def iter_preprocessed(examples: Iterable[Example], tokenizer, **kwargs) -> Iterator[Example]:
+    """
+    ленивая версия preprocess_example над потоком документов (например, из src.data.io.iter_collection)
+    :param kwargs: см. preprocess_example
+    """
+    for x in examples:
+        preprocess_example(x, tokenizer=tokenizer, **kwargs)
+        yield x
+
+
+def preprocess_corpus(
+        examples: List[Example],
+        tokenizer,
+        window: int = 1,
+        stride: int = 1,
+        lang: str = Languages.RU,
+        tokens_expression: Pattern = None,
+        fix_pointers: bool = True,
+        assign_chains: bool = False,
+        num_workers: int = None,
+        chunksize: int = None,
+        max_pieces: int = None,
+        max_entities: int = None
+) -> List[Example]:
+    """
+    preprocess_example (и assign_id_chain, если assign_chains) над всем корпусом в пуле процессов.
+    Результат пишется в examples (атрибут chunks, а также pieces, token_ids, id_sent токенов и id_chain сущностей)
+    и совпадает с последовательным вызовом preprocess_example; порядок документов не меняется.
+
+    Из процессов возвращаются не графы объектов, а компактные значения (см. _pack_preprocessed):
+    bpe-кусочки токенов, номера предложений, id_chain, а также границы, тексты и индексы сущностей кусков.
+    Сами куски собираются в родительском процессе поверх его токенов (TokenView), как в split_example_v2.
+
+    :param examples: документы
+    :param tokenizer: bert.tokenization.FullTokenizer. должен быть picklable
+    :param assign_chains: выполнить assign_id_chain до разбиения на куски
+    :param num_workers: число процессов. None или 1 - в текущем процессе
+    :param chunksize: сколько документов отправляется в процесс за раз. по умолчанию ~ len(examples) / (num_workers * 4)
+    остальные аргументы - см. preprocess_example
+    :return: examples
+    """
+    kwargs = dict(
+        window=window,
+        stride=stride,
+        lang=lang,
+        tokens_expression=tokens_expression,
+        fix_pointers=fix_pointers,
+        assign_chains=assign_chains,
+        max_pieces=max_pieces,
+        max_entities=max_entities
+    )
+    if num_workers is None or num_workers <= 1:
+        for x in examples:
+            _preprocess_example_worker_fn(x, tokenizer=tokenizer, **kwargs)
+        return examples
+
+    chunksize = chunksize if chunksize is not None else max(1, len(examples) // (num_workers * 4))
+    with multiprocessing.Pool(num_workers, initializer=_init_preprocessing_worker, initargs=(tokenizer, kwargs)) as pool:
+        # imap сохраняет порядок входа
+        for x, packed in zip(examples, pool.imap(_preprocess_packed, examples, chunksize=chunksize)):
+            _unpack_preprocessed(x, packed)
+    return examples
+
+
+_worker_state = {}
+
+
+def _init_preprocessing_worker(tokenizer, kwargs):
+    _worker_state["tokenizer"] = tokenizer
+    _worker_state["kwargs"] = kwargs
+
+
+def _preprocess_packed(example: Example) -> Tuple:
+    _preprocess_example_worker_fn(example, tokenizer=_worker_state["tokenizer"], **_worker_state["kwargs"])
+    return _pack_preprocessed(example)
+
+
+def _preprocess_example_worker_fn(example: Example, tokenizer, assign_chains: bool = False, **kwargs):
+    if assign_chains:
+        assign_id_chain([example])
+    preprocess_example(example, tokenizer=tokenizer, **kwargs)
+
+
+def _pack_preprocessed(x: Example) -> Tuple:
+    """
+    * токены: (pieces, token_ids, id_sent)
+    * сущности: id_chain
+    * куски: (id, text, start, end, [index сущности куска]); None, если у документа пустой текст
+    """
+    tokens = [(t.pieces, t.token_ids, t.id_sent) for t in x.tokens]
+    chains = [entity.id_chain for entity in x.entities]
+    if not x.text:
+        chunks = None
+    else:
+        chunks = []
+        for chunk in x.chunks:
+            start = chunk.tokens[0].start
+            end = start + len(chunk.tokens)
+            chunks.append((chunk.id, chunk.text, start, end, [entity.index for entity in chunk.entities]))
+    return tokens, chains, chunks
+
+
+def _unpack_preprocessed(x: Example, packed: Tuple):
+    tokens, chains, chunks = packed
+    for t, (pieces, token_ids, id_sent) in zip(x.tokens, tokens):
+        t.pieces = pieces
+        t.token_ids = token_ids
+        t.id_sent = id_sent
+    for entity, id_chain in zip(x.entities, chains):
+        entity.id_chain = id_chain
+    if chunks is None:
+        x.chunks = [x.copy]
+        return
+    x.chunks = []
+    for id_chunk, text, start, end, entity_indices in chunks:
+        chunk = get_chunk(example=x, id_chunk=id_chunk, text=text, start=start, end=end)
+        id2index = {}
+        for entity, index in zip(chunk.entities, entity_indices):
+            entity.index = index
+            id2index[entity.id] = index
+        for arc in chunk.arcs:
+            arc.head_index = id2index[arc.head]
+            arc.dep_index = id2index[arc.dep]
+        x.chunks.append(chunk)
+
+
+def examples_from_texts(
+        texts: Iterable[str],
+        tokenizer,
+        ids: Iterable[str] = None,
+        window: int = 1,
+        stride: int = 1,
+        lang: str = Languages.RU,
+        tokens_pattern: Union[str, Pattern] = None,
+        fix_pointers: bool = True,
+        max_pieces: int = None,
+        max_entities: int = None
+) -> List[Example]:
+    """
+    Документы для инференса из сырых текстов, без файлов на диске:
+    example_from_text -> split_example_v2 -> apply_bpe -> enumerate_entities.
+    Результат можно сразу подавать в BaseModel.predict.
+
+    :param texts: тексты документов
+    :param tokenizer: bert.tokenization.FullTokenizer
+    :param ids: идентификаторы документов. по умолчанию - порядковые номера текстов
+    :param tokens_pattern: регулярка токенов. по умолчанию TOKENS_EXPRESSION
+    остальные аргументы - см. preprocess_example
+    :return: примеры уровня документа с заполненным атрибутом chunks
+    """
+    if tokens_pattern is None:
+        tokens_expression = TOKENS_EXPRESSION
+    elif isinstance(tokens_pattern, str):
+        tokens_expression = re.compile(tokens_pattern)
+    else:
+        tokens_expression = tokens_pattern
+
+    texts = list(texts)
+    ids = [str(i) for i in range(len(texts))] if ids is None else list(ids)
+    assert len(ids) == len(texts), f"{len(ids)} != {len(texts)}"
+    assert len(set(ids)) == len(ids), "ids must be unique"
+
+    examples = []
+    for id, text in zip(ids, texts):
+        x = example_from_text(text, id=id, tokens_expression=tokens_expression)
+        preprocess_example(
+            example=x,
+            tokenizer=tokenizer,
+            window=window,
+            stride=stride,
+            lang=lang,
+            tokens_expression=tokens_expression,
+            fix_pointers=fix_pointers,
+            max_pieces=max_pieces,
+            max_entities=max_entities
+        )
+        examples.append(x)
+    return examples
+
+
 def fit_encodings(
         examples: List[Example],
         min_label_freq: int = 3,
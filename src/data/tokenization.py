@@ -0,0 +1,244 @@
+"""
+Быстрая замена bert.tokenization.FullTokenizer с тем же интерфейсом (tokenize, convert_tokens_to_ids)
+и тем же результатом.
+
+* BasicTokenizer: те же шаги (очистка текста, пробелы вокруг иероглифов, нижний регистр и удаление диакритики,
+отделение пунктуации), но классы символов считаются один раз на символ и кэшируются.
+* WordpieceTokenizer: жадный поиск самого длинного куска из словаря делается проходом по префиксному дереву
+(отдельные деревья для начальных кусков и для продолжений "##"), а не перебором всех подстрок.
+Сложность на слово - O(длина слова * число кусков) вместо O(длина слова ^ 2 * число кусков) со склейкой строк.
+"""
+import collections
+import unicodedata
+from typing import Dict, List
+
+
+UNK_TOKEN = "[UNK]"
+CONTINUATION_PREFIX = "##"
+MAX_INPUT_CHARS_PER_WORD = 200
+
+# классы символов
+_CHAR_DEFAULT = 0
+_CHAR_REMOVE = 1  # нулевой символ, U+FFFD, управляющие символы
+_CHAR_WHITESPACE = 2
+_CHAR_PUNCTUATION = 3
+_CHAR_CHINESE = 4
+
+
+def load_vocab(vocab_file: str) -> Dict[str, int]:
+    """
+    как bert.tokenization.load_vocab: piece -> номер строки
+    """
+    vocab = collections.OrderedDict()
+    index = 0
+    with open(vocab_file, encoding="utf-8") as f:
+        for line in f:
+            token = line.strip()
+            vocab[token] = index
+            index += 1
+    return vocab
+
+
+class FastFullTokenizer:
+    def __init__(
+            self,
+            vocab_file: str = None,
+            do_lower_case: bool = True,
+            vocab: Dict[str, int] = None,
+            unk_token: str = UNK_TOKEN,
+            max_input_chars_per_word: int = MAX_INPUT_CHARS_PER_WORD
+    ):
+        """
+        :param vocab_file: путь к vocab.txt
+        :param do_lower_case: как у FullTokenizer
+        :param vocab: готовый словарь piece -> id (вместо vocab_file)
+        """
+        assert (vocab_file is None) != (vocab is None), "expected exactly one of vocab_file, vocab"
+        self.vocab = vocab if vocab is not None else load_vocab(vocab_file)
+        self.inv_vocab = {v: k for k, v in self.vocab.items()}
+        self.basic_tokenizer = FastBasicTokenizer(do_lower_case=do_lower_case)
+        self.wordpiece_tokenizer = TrieWordpieceTokenizer(
+            vocab=self.vocab,
+            unk_token=unk_token,
+            max_input_chars_per_word=max_input_chars_per_word
+        )
+
+    def tokenize(self, text: str) -> List[str]:
+        split_tokens = []
+        for token in self.basic_tokenizer.tokenize(text):
+            split_tokens += self.wordpiece_tokenizer.tokenize_word(token)
+        return split_tokens
+
+    def convert_tokens_to_ids(self, tokens: List[str]) -> List[int]:
+        return [self.vocab[token] for token in tokens]
+
+    def convert_ids_to_tokens(self, ids: List[int]) -> List[str]:
+        return [self.inv_vocab[i] for i in ids]
+
+
+class FastBasicTokenizer:
+    def __init__(self, do_lower_case: bool = True):
+        self.do_lower_case = do_lower_case
+        self._char2class = {}
+
+    def tokenize(self, text: str) -> List[str]:
+        # очистка текста и пробелы вокруг иероглифов
+        chars = []
+        char2class = self._char2class
+        for char in text:
+            c = char2class.get(char)
+            if c is None:
+                c = char2class[char] = _get_char_class(char)
+            if c == _CHAR_DEFAULT or c == _CHAR_PUNCTUATION:
+                chars.append(char)
+            elif c == _CHAR_WHITESPACE:
+                chars.append(" ")
+            elif c == _CHAR_CHINESE:
+                chars.append(" ")
+                chars.append(char)
+                chars.append(" ")
+        text = "".join(chars)
+
+        split_tokens = []
+        for token in text.split():
+            if self.do_lower_case:
+                token = token.lower()
+                token = _strip_accents(token)
+            split_tokens += self._split_on_punctuation(token)
+        # как whitespace_tokenize(" ".join(split_tokens)) в оригинале
+        return " ".join(split_tokens).split()
+
+    def _split_on_punctuation(self, token: str) -> List[str]:
+        char2class = self._char2class
+        output = []
+        start_new_word = True
+        for char in token:
+            c = char2class.get(char)
+            if c is None:
+                c = char2class[char] = _get_char_class(char)
+            if c == _CHAR_PUNCTUATION:
+                output.append(char)
+                start_new_word = True
+            else:
+                if start_new_word:
+                    output.append(char)
+                    start_new_word = False
+                else:
+                    output[-1] += char
+        return output
+
+
+class TrieWordpieceTokenizer:
+    """
+    Жадный поиск самого длинного куска из словаря, как в bert.tokenization.WordpieceTokenizer.
+    Узел дерева - словарь символ -> узел; по ключу None в узле лежит кусок, который заканчивается в этом узле.
+    """
+    def __init__(
+            self,
+            vocab: Dict[str, int],
+            unk_token: str = UNK_TOKEN,
+            max_input_chars_per_word: int = MAX_INPUT_CHARS_PER_WORD
+    ):
+        self.vocab = vocab
+        self.unk_token = unk_token
+        self.max_input_chars_per_word = max_input_chars_per_word
+        self.trie_start = {}  # куски начала слова
+        self.trie_continuation = {}  # куски продолжения слова: ключи без "##", значения - с "##"
+        for piece in vocab:
+            if piece.startswith(CONTINUATION_PREFIX):
+                _add_to_trie(self.trie_continuation, piece[len(CONTINUATION_PREFIX):], piece)
+            # кусок "##foo" - валидное начало слова "##foo...", как и в оригинале
+            _add_to_trie(self.trie_start, piece, piece)
+
+    def tokenize(self, text: str) -> List[str]:
+        output_tokens = []
+        for token in text.split():
+            output_tokens += self.tokenize_word(token)
+        return output_tokens
+
+    def tokenize_word(self, word: str) -> List[str]:
+        n = len(word)
+        if n > self.max_input_chars_per_word:
+            return [self.unk_token]
+        sub_tokens = []
+        start = 0
+        trie = self.trie_start
+        while start < n:
+            node = trie
+            end = -1
+            cur_substr = None
+            for i in range(start, n):
+                node = node.get(word[i])
+                if node is None:
+                    break
+                piece = node.get(None)
+                if piece is not None:
+                    end = i + 1
+                    cur_substr = piece
+            if cur_substr is None:
+                return [self.unk_token]
+            sub_tokens.append(cur_substr)
+            start = end
+            trie = self.trie_continuation
+        return sub_tokens
+
+
+def _add_to_trie(trie: Dict, key: str, value: str):
+    node = trie
+    for char in key:
+        node = node.setdefault(char, {})
+    node[None] = value
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize("NFD", text)
+    return "".join(char for char in text if unicodedata.category(char) != "Mn")
+
+
+def _get_char_class(char: str) -> int:
+    """
+    класс символа в терминах bert.tokenization.BasicTokenizer.
+    порядок проверок как в _clean_text и _tokenize_chinese_chars
+    """
+    cp = ord(char)
+    if cp == 0 or cp == 0xfffd or _is_control(char):
+        return _CHAR_REMOVE
+    if _is_whitespace(char):
+        return _CHAR_WHITESPACE
+    if _is_chinese_char(cp):
+        return _CHAR_CHINESE
+    if _is_punctuation(char):
+        return _CHAR_PUNCTUATION
+    return _CHAR_DEFAULT
+
+
+def _is_whitespace(char: str) -> bool:
+    if char == " " or char == "\t" or char == "\n" or char == "\r":
+        return True
+    return unicodedata.category(char) == "Zs"
+
+
+def _is_control(char: str) -> bool:
+    if char == "\t" or char == "\n" or char == "\r":
+        return False
+    return unicodedata.category(char).startswith("C")
+
+
+def _is_punctuation(char: str) -> bool:
+    cp = ord(char)
+    if (33 <= cp <= 47) or (58 <= cp <= 64) or (91 <= cp <= 96) or (123 <= cp <= 126):
+        return True
+    return unicodedata.category(char).startswith("P")
+
+
+def _is_chinese_char(cp: int) -> bool:
+    return (
+        (0x4E00 <= cp <= 0x9FFF) or
+        (0x3400 <= cp <= 0x4DBF) or
+        (0x20000 <= cp <= 0x2A6DF) or
+        (0x2A700 <= cp <= 0x2B73F) or
+        (0x2B740 <= cp <= 0x2B81F) or
+        (0x2B820 <= cp <= 0x2CEAF) or
+        (0xF900 <= cp <= 0xFAFF) or
+        (0x2F800 <= cp <= 0x2FA1F)
+    )
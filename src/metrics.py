@@ -1,6 +1,7 @@
 import subprocess
 from typing import List, Dict, Union, Set, Tuple
 from collections import defaultdict
+from src.data.base import Example
 from src.utils import get_entity_spans
 
 
@@ -158,6 +159,292 @@ def get_coreferense_resolution_metrics(path_true, path_pred, scorer_path, metric
     return stdout
 
 
+# coreference resolution без perl-скрипта
+
+
+COREF_METRICS = ("muc", "bcub", "ceafm", "ceafe", "blanc")
+
+
+def get_coreference_resolution_metrics_v2(
+        examples_true: List[Example],
+        examples_pred: List[Example],
+        metrics: Tuple[str, ...] = COREF_METRICS
+) -> Dict[str, Dict[str, float]]:
+    """
+    Аналог to_conll + get_coreferense_resolution_metrics + parse_conll_metrics, но без временных файлов
+    и без запуска scorer.pl: метрики MUC, B3, CEAFm, CEAFe, BLANC считаются прямо по id_chain сущностей.
+    Как и в scorer.pl с аргументом <document-id> = none, числители и знаменатели суммируются по документам,
+    выравнивание кластеров в CEAF делается внутри документа.
+
+    * упоминание - (index_abs первого токена, index_abs последнего токена) сущности;
+    * кластер - множество упоминаний с одинаковым id_chain; синглтоны учитываются;
+    * если один и тот же спан указан у нескольких сущностей, то учитывается первая из них.
+
+    :param examples_true: документы с истинными id_chain
+    :param examples_pred: документы с предсказанными id_chain. сопоставляются с examples_true по id
+    :param metrics: какие метрики считать
+    :return: {metric: {"recall": r, "precision": p, "f1": f}}, значения - доли (как в parse_conll_metrics)
+    """
+    for metric in metrics:
+        assert metric in COREF_METRICS, f"expected metric in {COREF_METRICS}, but got {metric}"
+    id2pred = {x.id: x for x in examples_pred}
+    assert len(id2pred) == len(examples_pred), "examples must have unique ids"
+
+    # счётчики: [числитель recall, знаменатель recall, числитель precision, знаменатель precision]
+    counts = {metric: [0.0, 0.0, 0.0, 0.0] for metric in metrics if metric != "blanc"}
+    # счётчики blanc: [tp_c, c_k, c_r, tp_n, n_k, n_r]
+    counts_blanc = [0, 0, 0, 0, 0, 0]
+    count_fns = {
+        "muc": _get_muc_counts,
+        "bcub": _get_b_cubed_counts,
+        "ceafm": _get_ceafm_counts,
+        "ceafe": _get_ceafe_counts,
+    }
+
+    for x in examples_true:
+        key = get_coreference_clusters(x)
+        response = get_coreference_clusters(id2pred[x.id]) if x.id in id2pred else []
+        for metric, c in counts.items():
+            for i, v in enumerate(count_fns[metric](key, response)):
+                c[i] += v
+        if "blanc" in metrics:
+            for i, v in enumerate(_get_blanc_counts(key, response)):
+                counts_blanc[i] += v
+
+    res = {}
+    for metric in metrics:
+        if metric == "blanc":
+            res[metric] = _get_blanc_metrics(*counts_blanc)
+        else:
+            r_num, r_den, p_num, p_den = counts[metric]
+            recall = r_num / r_den if r_den > 0 else 0.0
+            precision = p_num / p_den if p_den > 0 else 0.0
+            res[metric] = {"recall": recall, "precision": precision, "f1": _f1(precision, recall)}
+    return res
+
+
+def get_coreference_clusters(x: Example) -> List[Set[Tuple[int, int]]]:
+    """
+    кластеры упоминаний документа по id_chain сущностей
+    """
+    chain2mentions = {}
+    seen = set()
+    for entity in x.entities:
+        assert entity.id_chain is not None, f"[{x.id}] entity {entity.id} has no id_chain"
+        mention = entity.tokens[0].index_abs, entity.tokens[-1].index_abs
+        if mention in seen:
+            continue
+        seen.add(mention)
+        chain2mentions.setdefault(entity.id_chain, set()).add(mention)
+    return list(chain2mentions.values())
+
+
+def _f1(precision: float, recall: float) -> float:
+    if precision + recall == 0.0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def _get_partition_size(cluster: Set, mention2cluster: Dict) -> int:
+    """
+    на сколько частей разбивается кластер кластерами другого разбиения.
+    упоминания, которых нет в другом разбиении, образуют отдельные части
+    """
+    parts = set()
+    num_missing = 0
+    for m in cluster:
+        if m in mention2cluster:
+            parts.add(mention2cluster[m])
+        else:
+            num_missing += 1
+    return len(parts) + num_missing
+
+
+def _get_mention2cluster(clusters: List[Set]) -> Dict:
+    return {m: i for i, c in enumerate(clusters) for m in c}
+
+
+def _get_muc_counts(key: List[Set], response: List[Set]) -> Tuple[float, float, float, float]:
+    """
+    R = sum_k(|k| - |p(k)|) / sum_k(|k| - 1), P - симметрично
+    """
+    mention2key = _get_mention2cluster(key)
+    mention2response = _get_mention2cluster(response)
+    r_num = sum(len(k) - _get_partition_size(k, mention2response) for k in key)
+    r_den = sum(len(k) - 1 for k in key)
+    p_num = sum(len(r) - _get_partition_size(r, mention2key) for r in response)
+    p_den = sum(len(r) - 1 for r in response)
+    return r_num, r_den, p_num, p_den
+
+
+def _get_overlaps(key: List[Set], response: List[Set]) -> Dict[Tuple[int, int], int]:
+    """
+    {(индекс кластера key, индекс кластера response): |k & r|} только для пересекающихся пар
+    """
+    mention2response = _get_mention2cluster(response)
+    overlaps = defaultdict(int)
+    for i, k in enumerate(key):
+        for m in k:
+            if m in mention2response:
+                overlaps[i, mention2response[m]] += 1
+    return overlaps
+
+
+def _get_b_cubed_counts(key: List[Set], response: List[Set]) -> Tuple[float, float, float, float]:
+    """
+    R = sum_k sum_r |k & r|^2 / |k| / sum_k |k|, P - симметрично
+    """
+    overlaps = _get_overlaps(key, response)
+    r_num = sum(n ** 2 / len(key[i]) for (i, _), n in overlaps.items())
+    p_num = sum(n ** 2 / len(response[j]) for (_, j), n in overlaps.items())
+    r_den = sum(len(k) for k in key)
+    p_den = sum(len(r) for r in response)
+    return r_num, r_den, p_num, p_den
+
+
+def _get_ceafm_counts(key: List[Set], response: List[Set]) -> Tuple[float, float, float, float]:
+    """
+    phi_3(k, r) = |k & r|
+    """
+    overlaps = _get_overlaps(key, response)
+    scores = [[0.0] * len(response) for _ in key]
+    for (i, j), n in overlaps.items():
+        scores[i][j] = float(n)
+    similarity = get_max_assignment_score(scores)
+    return similarity, sum(len(k) for k in key), similarity, sum(len(r) for r in response)
+
+
+def _get_ceafe_counts(key: List[Set], response: List[Set]) -> Tuple[float, float, float, float]:
+    """
+    phi_4(k, r) = 2 * |k & r| / (|k| + |r|)
+    """
+    overlaps = _get_overlaps(key, response)
+    scores = [[0.0] * len(response) for _ in key]
+    for (i, j), n in overlaps.items():
+        scores[i][j] = 2.0 * n / (len(key[i]) + len(response[j]))
+    similarity = get_max_assignment_score(scores)
+    return similarity, len(key), similarity, len(response)
+
+
+def _get_blanc_counts(key: List[Set], response: List[Set]) -> Tuple[int, int, int, int, int, int]:
+    """
+    BLANC с учётом несовпадающих упоминаний (Luo et al., 2014):
+    coreference links - пары упоминаний одного кластера, non-coreference links - пары упоминаний разных кластеров.
+    :return: tp_c, c_k, c_r, tp_n, n_k, n_r
+    """
+    # граничный случай: по одному упоминанию в key и response. ссылок нет вообще,
+    # поэтому документ считается либо полностью верным, либо полностью неверным (как в scorer.pl)
+    if len(key) == len(response) == 1 and len(key[0]) == len(response[0]) == 1:
+        tp = 1 if key[0] == response[0] else 0
+        return tp, 1, 1, tp, 1, 1
+
+    mention2key = _get_mention2cluster(key)
+    mention2response = _get_mention2cluster(response)
+    overlaps = _get_overlaps(key, response)
+
+    num_key = len(mention2key)
+    num_response = len(mention2response)
+    c_k = sum(len(k) * (len(k) - 1) // 2 for k in key)
+    c_r = sum(len(r) * (len(r) - 1) // 2 for r in response)
+    n_k = num_key * (num_key - 1) // 2 - c_k
+    n_r = num_response * (num_response - 1) // 2 - c_r
+    tp_c = sum(n * (n - 1) // 2 for n in overlaps.values())
+
+    # non-coreference links, которые есть в обоих разбиениях:
+    # пары общих упоминаний минус пары, лежащие в одном кластере хотя бы в одном из разбиений
+    common_key_sizes = defaultdict(int)
+    common_response_sizes = defaultdict(int)
+    for (i, j), n in overlaps.items():
+        common_key_sizes[i] += n
+        common_response_sizes[j] += n
+    num_common = sum(overlaps.values())
+    same_key = sum(n * (n - 1) // 2 for n in common_key_sizes.values())
+    same_response = sum(n * (n - 1) // 2 for n in common_response_sizes.values())
+    tp_n = num_common * (num_common - 1) // 2 - same_key - same_response + tp_c
+    return tp_c, c_k, c_r, tp_n, n_k, n_r
+
+
+def _get_blanc_metrics(tp_c: int, c_k: int, c_r: int, tp_n: int, n_k: int, n_r: int) -> Dict[str, float]:
+    """
+    граничные случаи - как в scorer.pl: если в key нет coreference links, то BLANC = метрики по non-coreference links;
+    если нет non-coreference links - то по coreference links.
+    """
+    def get_prf(tp, n_true, n_pred):
+        if n_true == 0 and n_pred == 0:
+            return 1.0, 1.0, 1.0
+        if n_true == 0 or n_pred == 0:
+            return 0.0, 0.0, 0.0
+        return tp / n_true, tp / n_pred, 2.0 * tp / (n_true + n_pred)
+
+    r_c, p_c, f_c = get_prf(tp_c, c_k, c_r)
+    r_n, p_n, f_n = get_prf(tp_n, n_k, n_r)
+    if c_k == 0:
+        recall, precision, f1 = r_n, p_n, f_n
+    elif n_k == 0:
+        recall, precision, f1 = r_c, p_c, f_c
+    else:
+        recall, precision, f1 = (r_c + r_n) / 2, (p_c + p_n) / 2, (f_c + f_n) / 2
+    return {"recall": recall, "precision": precision, "f1": f1}
+
+
+def get_max_assignment_score(scores: List[List[float]]) -> float:
+    """
+    Максимальная сумма весов паросочетания в двудольном графе (венгерский алгоритм, O(n^2 * m)).
+    :param scores: матрица весов [n, m], n и m могут не совпадать
+    :return: сумма весов оптимального паросочетания
+    """
+    n = len(scores)
+    m = len(scores[0]) if n > 0 else 0
+    if n == 0 or m == 0:
+        return 0.0
+    transposed = n > m
+    if transposed:
+        scores = [list(row) for row in zip(*scores)]
+        n, m = m, n
+    # минимизация стоимости -score; строки - 1..n, столбцы - 1..m
+    inf = float("inf")
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)  # p[j] - строка, назначенная столбцу j
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = inf
+            j1 = 0
+            row = scores[i0 - 1]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = -row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+    return sum(scores[p[j] - 1][j - 1] for j in range(1, m + 1) if p[j] != 0)
+
+
 def classification_report_set(y_true: Set[Tuple], y_pred: Set[Tuple]) -> Dict:
     """
     ребро - (head_label, start_head, end_head, dep_label, start_dep, end_dep, relation_label)
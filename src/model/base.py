@@ -1,20 +1,44 @@
 import random
 import os
+import time
 import json
 import math
-from typing import Dict, List, Callable, Tuple, Iterable
+from contextlib import closing
+from typing import Dict, List, Callable, Tuple, Iterable, Iterator
 from abc import ABC, abstractmethod
-from collections import namedtuple
 
 import tensorflow as tf
 import numpy as np
 import tqdm
-from bert.modeling import BertModel, BertConfig
+from bert.modeling import (
+    BertModel,
+    BertConfig,
+    embedding_lookup,
+    create_initializer,
+    layer_norm_and_dropout,
+    transformer_model,
+    get_activation
+)
 from bert.optimization import create_optimizer
 
-from src.data.base import Example
-from src.utils import train_test_split, get_filtered_by_length_chunks, log
+from src.data.base import Example, BertInputs
+from src.utils import (
+    train_test_split,
+    get_filtered_by_length_chunks,
+    iter_batches,
+    log,
+    LengthIndex,
+    LengthIndexCache,
+    BatchingPolicies,
+    batches_indices_gen,
+    get_padding_report,
+    get_batch_cost,
+    get_bucketed_batches,
+    get_example_length,
+    prefetch_gen
+)
 from src.model.layers import StackedBiRNN
+from src.model.inputs import get_bert_inputs
 
 
 class ModeKeys:
@@ -23,10 +47,9 @@ class ModeKeys:
     TEST = "test"  # don't need labels, dropout off
 
 
-BertInputs = namedtuple(
-    "BertInputs",
-    ["input_ids", "input_mask", "segment_ids", "first_pieces_coords", "num_tokens", "num_pieces"]
-)
+class TrainSamplers:
+    RANDOM = "random"  # на каждом шаге случайные batch_size кусков
+    BUCKETED = "bucketed"  # за эпоху каждый кусок - один раз, батчи из кусков близкой длины (см. get_bucketed_batches)
 
 
 class BaseModel(ABC):
@@ -38,6 +61,11 @@ class BaseModel(ABC):
             "embedder": {
                 ...
             },
+            "bert": {
+                ...
+                "packing": False,  # опционально, упаковка коротких кусков в одну строку (см. src.model.inputs)
+                "packing_maxlen": 512  # опционально, для packing
+            },
             "ner": {
                 "loss_coef": 0.0,
                 ...
@@ -50,11 +78,24 @@ class BaseModel(ABC):
         "training": {
             "num_epochs": 100,
             "batch_size": 16,
-            "max_epochs_wo_improvement": 10
+            "max_epochs_wo_improvement": 10,
+            "sampler": "random",  # опционально, см. TrainSamplers
+            "max_tokens_per_batch": 10000,  # опционально, для "bucketed"
+            "bucket_width": 16,  # опционально, для "bucketed"
+            "head_coef": 0.0,  # опционально, для "bucketed", см. _get_head_size
+            "num_epoch_steps": None,  # число шагов за эпоху для lr schedule; обязательно для "bucketed" (см. get_num_epoch_steps)
+            "prefetch": 2  # опционально, сколько feed_dict готовить заранее в фоновом потоке; 0 - без потока
         },
         "inference": {
-            "window": 1,
-            "max_tokens_per_batch": 10000
+            "window": 1,  # None - куски без перекрытий по бюджету кусочков (см. split_example_v2, max_pieces)
+            "stride": 1,
+            "max_tokens_per_batch": 10000,
+            "batching_policy": "greedy",  # опционально, см. src.utils.BatchingPolicies
+            "attention_coef": 0.0,  # опционально, для "min_cost"
+            "batch_overhead": 10000,  # опционально, для "min_cost"
+            "max_attention_per_batch": None,  # опционально, для "min_cost"
+            "head_coef": 0.0,  # опционально, вес квадрата размера головы в стоимости батча (см. _get_head_size)
+            "report_batch_costs": False  # опционально, печатать оценку и время sess.run каждого батча
         },
         "optimizer": {
             "init_lr": 2e-5,
@@ -74,6 +115,9 @@ class BaseModel(ABC):
         self.train_op = None
         self.training_ph = None
 
+        self._run_time = 0.0  # время sess.run текущего батча _batches_gen (см. _run_timed)
+        self._length_index_cache = LengthIndexCache()  # индекс длин кусков для _batches_gen
+
     # специфичные для каждой модели методы
 
     @abstractmethod
@@ -139,6 +183,118 @@ class BaseModel(ABC):
 
     # общие методы для всех моделей
 
+    def predict_stream(self, examples: Iterable[Example], num_docs_per_batch: int = 100, **kwargs) -> Iterator[Example]:
+        """
+        Потоковый инференс: документы копятся порциями по num_docs_per_batch, для каждой порции вызывается predict,
+        после чего документы отдаются наружу. В памяти держится не более одной порции.
+        Пример пайплайна:
+        examples = iter_collection(data_dir)
+        examples = iter_preprocessed(examples, tokenizer=tokenizer, window=window, stride=stride)
+        to_brat(model.predict_stream(examples), output_dir=output_dir, write_mode="w")
+
+        :param examples: поток исходных документов. атрибут chunks должен быть заполнен!
+        :param num_docs_per_batch: сколько документов подавать в predict за раз
+        :param kwargs: аргументы predict
+        """
+        for docs in iter_batches(examples, batch_size=num_docs_per_batch):
+            self.predict(docs, **kwargs)
+            yield from docs
+
+    def _get_head_size(self, x: Example) -> int:
+        """
+        размер головы модели на примере: тензоры вида [N, E, E, ...] дают вклад head_coef * E ** 2 в стоимость батча.
+        0 - у модели нет таких тензоров
+        """
+        return 0
+
+    def _batches_gen(
+            self,
+            examples: List[Example],
+            pieces_level: bool,
+            max_tokens_per_batch: int = None,
+            report: bool = True,
+            length_index: LengthIndex = None
+    ) -> Iterator[List[Example]]:
+        """
+        батчи для evaluate и predict по настройкам config["inference"] (см. src.utils.batches_indices_gen).
+        разбиение считается заранее, поэтому отчёт об эффективности паддинга печатается до первого батча.
+        после последнего батча печатается сравнение оценки стоимости батчей с фактическим временем их обработки
+        (время sess.run, если вызывающий код запускает граф через _run_timed)
+        :param max_tokens_per_batch: по умолчанию - config["inference"]["max_tokens_per_batch"]
+        :param report: печатать ли отчёты
+        :param length_index: индекс длин examples. по умолчанию берётся из кэша модели: при повторном вызове
+         на тех же кусках (evaluate на каждой эпохе) он не строится заново (см. LengthIndexCache)
+        """
+        config = self.config["inference"]
+        if max_tokens_per_batch is None:
+            max_tokens_per_batch = config["max_tokens_per_batch"]
+        attention_coef = config.get("attention_coef", 0.0)
+        head_coef = config.get("head_coef", 0.0)
+        if length_index is None:
+            length_index = self._length_index_cache.get(examples, pieces_level=pieces_level)
+        else:
+            assert len(length_index) == len(examples), f"{len(length_index)} != {len(examples)}"
+            assert length_index.pieces_level == pieces_level
+        head_sizes = [self._get_head_size(x) for x in examples] if head_coef else None
+        batches = list(batches_indices_gen(
+            length_index.lengths,
+            max_tokens_per_batch=max_tokens_per_batch,
+            ids=length_index.ids,
+            indices_sorted=length_index.indices_sorted,
+            policy=config.get("batching_policy", BatchingPolicies.GREEDY),
+            attention_coef=attention_coef,
+            batch_overhead=config.get("batch_overhead"),
+            max_attention_per_batch=config.get("max_attention_per_batch"),
+            head_sizes=head_sizes,
+            head_coef=head_coef
+        ))
+        if report:
+            d = get_padding_report(length_index.lengths, batches, attention_coef=attention_coef)
+            print("padding report:", ", ".join(f"{k}: {round(v, 4)}" for k, v in d.items()))
+
+        costs_estimated = []
+        costs_observed = []
+        for batch in batches:
+            costs_estimated.append(get_batch_cost(
+                length_index.lengths,
+                batch,
+                attention_coef=attention_coef,
+                head_sizes=head_sizes,
+                head_coef=head_coef
+            ))
+            self._run_time = 0.0
+            yield [examples[i] for i in batch]
+            costs_observed.append(self._run_time)
+
+        if report and costs_observed:
+            if config.get("report_batch_costs", False):
+                for k, batch in enumerate(batches):
+                    print(
+                        f"batch {k}: size: {len(batch)}, "
+                        f"max len: {max(length_index.lengths[i] for i in batch)}, "
+                        f"max head size: {max(head_sizes[i] for i in batch) if head_sizes is not None else 0}, "
+                        f"estimated cost: {round(costs_estimated[k], 1)}, run time: {round(costs_observed[k], 4)}s"
+                    )
+            total_estimated = sum(costs_estimated)
+            total_observed = sum(costs_observed)
+            slowest = int(np.argmax(costs_observed))
+            print(
+                f"batch costs: num batches: {len(costs_observed)}, "
+                f"estimated: {round(total_estimated, 1)}, run time: {round(total_observed, 4)}s, "
+                f"seconds per 1k cost: {round(total_observed / max(total_estimated, 1e-9) * 1000, 6)}, "
+                f"slowest batch: {slowest} (estimated: {round(costs_estimated[slowest], 1)}, "
+                f"run time: {round(costs_observed[slowest], 4)}s)"
+            )
+
+    def _run_timed(self, fetches, feed_dict: Dict):
+        """
+        sess.run с замером времени: оно суммируется в фактическую стоимость текущего батча _batches_gen
+        """
+        t0 = time.perf_counter()
+        res = self.sess.run(fetches, feed_dict=feed_dict)
+        self._run_time += time.perf_counter() - t0
+        return res
+
     def build(self, mode: str = ModeKeys.TRAIN):
         self._set_placeholders()
         with tf.variable_scope(self.model_scope):
@@ -215,26 +371,28 @@ class BaseModel(ABC):
         )
 
         batch_size = self.config["training"]["batch_size"]
-        num_epoch_steps = math.ceil(len(chunks_train) / batch_size)
+        num_epoch_steps_schedule = self.config["training"].get("num_epoch_steps")
+        prefetch = self.config["training"].get("prefetch", 2)
         best_score = -1
         num_steps_wo_improvement = 0
         verbose_fn = verbose_fn if verbose_fn is not None else print
         train_loss = []
 
         for epoch in range(self.config["training"]["num_epochs"]):
-            for _ in tqdm.trange(num_epoch_steps):
-                if len(chunks_train) > batch_size:
-                    chunks_batch = random.sample(chunks_train, batch_size)
-                else:
-                    chunks_batch = chunks_train
-                feed_dict = self._get_feed_dict(chunks_batch, mode=ModeKeys.TRAIN)
-                try:
-                    _, loss = self.sess.run([train_op, self.loss], feed_dict=feed_dict)
-                    assert not np.isnan(loss), "loss becomes nan"
-                    train_loss.append(loss)
-                except Exception as e:
-                    print("current batch:", [x.id for x in chunks_batch])
-                    raise e
+            batches = self._get_train_batches(chunks_train)
+            if num_epoch_steps_schedule is not None and len(batches) != num_epoch_steps_schedule:
+                print(f"WARNING: lr schedule assumes {num_epoch_steps_schedule} steps per epoch, "
+                      f"but got {len(batches)} steps")
+            # closing: при исключении в sess.run фоновый поток останавливается сразу, а не при сборке traceback
+            with closing(prefetch_gen(self._train_feed_dicts_gen(batches), maxsize=prefetch)) as gen:
+                for chunks_batch, feed_dict in tqdm.tqdm(gen, total=len(batches)):
+                    try:
+                        _, loss = self.sess.run([train_op, self.loss], feed_dict=feed_dict)
+                        assert not np.isnan(loss), "loss becomes nan"
+                        train_loss.append(loss)
+                    except Exception as e:
+                        print("current batch:", [x.id for x in chunks_batch])
+                        raise e
 
             # pycharm bug:
             # Cannot find reference {mean, std} in __init__.pyi | __init__.pxd
@@ -270,6 +428,66 @@ class BaseModel(ABC):
             print(f"restoring model from {checkpoint_path}")
             saver.restore(self.sess, checkpoint_path)
 
+    def _train_feed_dicts_gen(self, batches: List[List[Example]]) -> Iterator[Tuple[List[Example], Dict]]:
+        """
+        пары (батч, feed_dict) для обучения. в train вычисляется в фоновом потоке (см. src.utils.prefetch_gen)
+        """
+        for chunks_batch in batches:
+            try:
+                feed_dict = self._get_feed_dict(chunks_batch, mode=ModeKeys.TRAIN)
+            except Exception as e:
+                print("current batch:", [x.id for x in chunks_batch])
+                raise e
+            yield chunks_batch, feed_dict
+
+    def _get_train_batches(self, chunks: List[Example], rng=None) -> List[List[Example]]:
+        """
+        батчи на одну эпоху обучения в зависимости от config["training"]["sampler"] (см. TrainSamplers)
+        :param rng: генератор для перемешивания в sampler="bucketed" (см. get_bucketed_batches).
+         по умолчанию - модуль random
+        """
+        config = self.config["training"]
+        sampler = config.get("sampler", TrainSamplers.RANDOM)
+        if sampler == TrainSamplers.RANDOM:
+            batch_size = config["batch_size"]
+            num_epoch_steps = math.ceil(len(chunks) / batch_size)
+            if len(chunks) > batch_size:
+                return [random.sample(chunks, batch_size) for _ in range(num_epoch_steps)]
+            else:
+                return [chunks for _ in range(num_epoch_steps)]
+        elif sampler == TrainSamplers.BUCKETED:
+            head_coef = config.get("head_coef", 0.0)
+            batches = get_bucketed_batches(
+                lengths=[get_example_length(x, pieces_level=self._is_bpe_level) for x in chunks],
+                max_tokens_per_batch=config["max_tokens_per_batch"],
+                bucket_width=config.get("bucket_width", 16),
+                rng=rng,
+                head_sizes=[self._get_head_size(x) for x in chunks] if head_coef else None,
+                head_coef=head_coef
+            )
+            return [[chunks[i] for i in batch] for batch in batches]
+        else:
+            raise NotImplementedError(f"expected sampler in {{random, bucketed}}, but got {sampler}")
+
+    def get_num_epoch_steps(self, examples_train: List[Example]) -> int:
+        """
+        число шагов за эпоху при текущих настройках config["training"].
+        для sampler="bucketed" оно зависит от длин кусков, поэтому его нужно посчитать до build и записать в
+        config["training"]["num_epoch_steps"], чтоб lr schedule в _set_train_op соответствовал фактическому обучению:
+        model = ...
+        model.config["training"]["num_epoch_steps"] = model.get_num_epoch_steps(examples_train)
+        model.build()
+        """
+        chunks_train = get_filtered_by_length_chunks(
+            examples=examples_train, maxlen=self.config["training"]["maxlen"], pieces_level=self._is_bpe_level
+        )
+        if self.config["training"].get("sampler", TrainSamplers.RANDOM) == TrainSamplers.RANDOM:
+            return math.ceil(len(chunks_train) / self.config["training"]["batch_size"])
+        # от перемешивания число батчей почти не зависит: отличия только на границах батчей внутри корзин.
+        # свой генератор, чтоб не сдвигать глобальный random, от которого зависит обучение
+        rng = np.random.RandomState(228)
+        return len(self._get_train_batches(chunks_train, rng=rng))
+
     @log
     def cross_validate(
             self,
@@ -430,6 +648,8 @@ class BaseModelBert(BaseModel):
             bert_dim = self.config["model"]["bert"]["params"]["hidden_size"]
             x = tf.random.uniform((input_shape[0], input_shape[1], bert_dim))
             return x
+        elif self.config["model"]["bert"].get("packing", False):
+            return self._build_bert_packed(training)
         else:
             bert_scope = self.config["model"]["bert"]["scope"]
             reuse = not training
@@ -445,6 +665,76 @@ class BaseModelBert(BaseModel):
                 x = model.get_sequence_output()
             return x
 
+    def _build_bert_packed(self, training):
+        """
+        то же, что BertModel(...).get_sequence_output(), но для упакованного входа (см. src.model.inputs):
+        в input_mask_ph лежат номера сегментов, внимание - только внутри сегмента, позиции - с нуля в каждом сегменте.
+        BertModel не принимает маску внимания [N, T, T] и позиции, поэтому граф собирается из тех же функций
+        bert.modeling в тех же variable scopes, и веса чекпоинта подгружаются как обычно.
+        """
+        bert_scope = self.config["model"]["bert"]["scope"]
+        reuse = not training
+        bert_config = BertConfig.from_dict(self.config["model"]["bert"]["params"])
+        if not training:
+            bert_config.hidden_dropout_prob = 0.0
+            bert_config.attention_probs_dropout_prob = 0.0
+
+        segments = self.input_mask_ph  # [N, T]
+        # маска внимания [N, T, T]: позиции одного сегмента, кроме паддинга
+        attention_mask = tf.logical_and(
+            tf.equal(segments[:, :, None], segments[:, None, :]),
+            tf.greater(segments[:, None, :], 0)
+        )
+        attention_mask = tf.cast(attention_mask, tf.int32)
+        # позиция = индекс - число непаддинговых позиций более ранних сегментов строки
+        num_prev = tf.logical_and(
+            tf.greater(segments[:, None, :], 0),
+            tf.less(segments[:, None, :], segments[:, :, None])
+        )
+        num_prev = tf.reduce_sum(tf.cast(num_prev, tf.int32), axis=-1)  # [N, T]
+        position_ids = tf.range(tf.shape(segments)[1])[None, :] - num_prev
+        position_ids *= tf.sign(segments)  # паддинг - позиция 0
+
+        with tf.variable_scope(bert_scope, reuse=reuse):
+            with tf.variable_scope("bert"):
+                with tf.variable_scope("embeddings"):
+                    x, _ = embedding_lookup(
+                        input_ids=self.input_ids_ph,
+                        vocab_size=bert_config.vocab_size,
+                        embedding_size=bert_config.hidden_size,
+                        initializer_range=bert_config.initializer_range,
+                        word_embedding_name="word_embeddings",
+                        use_one_hot_embeddings=False
+                    )
+                    token_type_table = tf.get_variable(
+                        name="token_type_embeddings",
+                        shape=[bert_config.type_vocab_size, bert_config.hidden_size],
+                        initializer=create_initializer(bert_config.initializer_range)
+                    )
+                    x += tf.gather(token_type_table, self.segment_ids_ph)
+                    position_table = tf.get_variable(
+                        name="position_embeddings",
+                        shape=[bert_config.max_position_embeddings, bert_config.hidden_size],
+                        initializer=create_initializer(bert_config.initializer_range)
+                    )
+                    x += tf.gather(position_table, position_ids)
+                    x = layer_norm_and_dropout(x, bert_config.hidden_dropout_prob)
+                with tf.variable_scope("encoder"):
+                    x = transformer_model(
+                        input_tensor=x,
+                        attention_mask=attention_mask,
+                        hidden_size=bert_config.hidden_size,
+                        num_hidden_layers=bert_config.num_hidden_layers,
+                        num_attention_heads=bert_config.num_attention_heads,
+                        intermediate_size=bert_config.intermediate_size,
+                        intermediate_act_fn=get_activation(bert_config.hidden_act),
+                        hidden_dropout_prob=bert_config.hidden_dropout_prob,
+                        attention_probs_dropout_prob=bert_config.attention_probs_dropout_prob,
+                        initializer_range=bert_config.initializer_range,
+                        do_return_all_layers=False
+                    )
+        return x
+
     def _set_layers(self):
         self.bert_dropout = tf.keras.layers.Dropout(self.config["model"]["bert"]["dropout"])
         if self.config["model"]["birnn"]["use"]:
@@ -488,10 +778,18 @@ class BaseModelBert(BaseModel):
             saver.restore(self.sess, checkpoint_path)
 
     def _set_train_op(self):
-        num_samples = self.config["training"]["num_train_samples"]
-        batch_size = self.config["training"]["batch_size"]
+        num_epoch_steps = self.config["training"].get("num_epoch_steps")
+        if num_epoch_steps is None:
+            sampler = self.config["training"].get("sampler", TrainSamplers.RANDOM)
+            assert sampler == TrainSamplers.RANDOM, \
+                f'number of steps per epoch for sampler "{sampler}" depends on lengths of training chunks, ' \
+                f'so config["training"]["num_epoch_steps"] must be set before build ' \
+                f'(see BaseModel.get_num_epoch_steps). otherwise lr schedule will not match actual training'
+            num_samples = self.config["training"]["num_train_samples"]
+            batch_size = self.config["training"]["batch_size"]
+            num_epoch_steps = int(num_samples / batch_size)
         num_epochs = self.config["training"]["num_epochs"]
-        num_train_steps = int(num_samples / batch_size) * num_epochs
+        num_train_steps = num_epoch_steps * num_epochs
         warmup_proportion = self.config["optimizer"]["warmup_proportion"]
         num_warmup_steps = int(num_train_steps * warmup_proportion)
         init_lr = self.config["optimizer"]["init_lr"]
@@ -520,65 +818,20 @@ class BaseModelBert(BaseModel):
             x = self.birnn_bert(x, training=self.training_ph, mask=sequence_mask)  # [N, num_tokens, cell_dim * 2]
         return x
 
-    def _get_bert_input_for_feed_dict(self, examples: List[Example]) -> BertInputs:
-        input_ids = []
-        input_mask = []
-        segment_ids = []
-        first_pieces_coords = []
-        num_tokens = []
-        num_pieces = []
-
-        for i, x in enumerate(examples):
-            input_ids_i = []
-            input_mask_i = []
-            segment_ids_i = []
-            first_pieces_coords_i = []
-            num_tokens_i = 0
-
-            # [CLS]
-            input_ids_i.append(self.config["model"]["bert"]["cls_token_id"])
-            input_mask_i.append(1)
-            segment_ids_i.append(0)
-
-            for t in x.tokens:
-                n = len(t.token_ids)
-                assert n != 0, f"[{x.id}] token {t} could not be split by pieces! " \
-                    f"unicode code points: {[ord(c) for c in t.text]}"
-                first_pieces_coords_i.append((i, len(input_ids_i)))
-                input_ids_i += t.token_ids
-                input_mask_i += [1] * n
-                segment_ids_i += [0] * n
-                num_tokens_i += 1
-
-            # [SEP]
-            input_ids_i.append(self.config["model"]["bert"]["sep_token_id"])
-            input_mask_i.append(1)
-            segment_ids_i.append(0)
-
-            input_ids.append(input_ids_i)
-            input_mask.append(input_mask_i)
-            segment_ids.append(segment_ids_i)
-            first_pieces_coords.append(first_pieces_coords_i)
-            num_tokens.append(num_tokens_i)
-            num_pieces.append(len(input_ids_i))
-
-        # padding
-        pad_token_id = self.config["model"]["bert"]["pad_token_id"]
-        num_tokens_max = max(num_tokens)
-        num_pieces_max = max(num_pieces)
-        for i in range(len(examples)):
-            input_ids[i] += [pad_token_id] * (num_pieces_max - num_pieces[i])
-            input_mask[i] += [0] * (num_pieces_max - num_pieces[i])
-            segment_ids[i] += [0] * (num_pieces_max - num_pieces[i])
-            first_pieces_coords[i] += [(i, 0)] * (num_tokens_max - num_tokens[i])
-
-        return BertInputs(
-            input_ids=input_ids,
-            input_mask=input_mask,
-            segment_ids=segment_ids,
-            first_pieces_coords=first_pieces_coords,
-            num_tokens=num_tokens,
-            num_pieces=num_pieces
+    def _get_bert_input_for_feed_dict(self, examples: List[Example], root_token_id: int = None) -> BertInputs:
+        """
+        см. src.model.inputs.get_bert_inputs.
+        при config["model"]["bert"]["packing"] куски упаковываются в строки длины не больше
+        config["model"]["bert"]["packing_maxlen"] (по умолчанию 512)
+        """
+        bert_config = self.config["model"]["bert"]
+        return get_bert_inputs(
+            examples,
+            cls_token_id=bert_config["cls_token_id"],
+            sep_token_id=bert_config["sep_token_id"],
+            pad_token_id=bert_config["pad_token_id"],
+            root_token_id=root_token_id,
+            packing_maxlen=bert_config.get("packing_maxlen", 512) if bert_config.get("packing", False) else None
         )
 
 
@@ -655,6 +908,10 @@ class BaseModelRelationExtraction(BaseModelNER):
         with tf.variable_scope(self.re_scope):
             self._build_re_head()
 
+    def _get_head_size(self, x: Example) -> int:
+        # логиты [N, E, E, num_relations]
+        return len(x.entities)
+
     # TODO: костыль
     def _build_ner_head(self):
         pass
@@ -805,6 +1062,10 @@ class BaseModeCoreferenceResolution(BaseModel):
         with tf.variable_scope(self.coref_scope):
             self._build_coref_head()
 
+    def _get_head_size(self, x: Example) -> int:
+        # логиты [N, E, E + 1]: кандидаты в антецеденты - все упоминания и фиктивный
+        return len(x.entities) + 1
+
     @abstractmethod
     def _build_coref_head(self):
         pass
@@ -6,7 +6,6 @@ import tensorflow as tf
 import numpy as np
 
 from src.data.base import Example, Arc
-from src.data.io import to_conll
 from src.model.base import BaseModeCoreferenceResolution, BaseModelBert, ModeKeys
 from src.model.layers import GraphEncoder, GraphEncoderInputs, MLP
 from src.model.utils import (
@@ -15,8 +14,8 @@ from src.model.utils import (
     get_sent_pairs_to_predict_for,
     get_sent_ids_to_predict_for
 )
-from src.metrics import get_coreferense_resolution_metrics
-from src.utils import batches_gen, get_connected_components, parse_conll_metrics, log
+from src.metrics import get_coreference_resolution_metrics_v2
+from src.utils import get_connected_components, log
 
 
 # TODO: span size features
@@ -197,15 +196,12 @@ class BaseBertForCoreferenceResolution(BaseModeCoreferenceResolution, BaseModelB
 
         head2dep = {}  # (file, head) -> {dep, score}
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            re_labels_pred, re_logits_pred = self.sess.run(
+            re_labels_pred, re_logits_pred = self._run_timed(
                 [self.labels_pred, self.logits_pred],
                 feed_dict=feed_dict
             )
@@ -222,10 +218,13 @@ class BaseBertForCoreferenceResolution(BaseModeCoreferenceResolution, BaseModelB
 
                 num_sentences = id_to_num_sentences[chunk.parent]
                 end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                assert window is None or end_rel < window, \
+                    f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                 is_first = chunk.tokens[0].id_sent == 0
                 is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                pairs = get_sent_pairs_to_predict_for(end=end_rel, is_first=is_first, is_last=is_last, window=window)
+                pairs = get_sent_pairs_to_predict_for(
+                    end=end_rel, is_first=is_first, is_last=is_last, window=window, stride=stride
+                )
 
                 # предсказанные лейблы, которые можно получить из предиктов для кусочка chunk
                 for id_sent_rel_a, id_sent_rel_b in pairs:
@@ -402,16 +401,13 @@ class BertForCoreferenceResolutionMentionPair(BaseBertForCoreferenceResolution):
 
         head2dep = {}  # (file, head) -> {dep, score}
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
 
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            total_loss_i, d, re_labels_pred, re_logits_pred = self.sess.run(
+            total_loss_i, d, re_labels_pred, re_logits_pred = self._run_timed(
                 [self.total_loss, self.loss_denominator, self.labels_pred, self.logits_pred],
                 feed_dict=feed_dict
             )
@@ -436,10 +432,13 @@ class BertForCoreferenceResolutionMentionPair(BaseBertForCoreferenceResolution):
 
                 num_sentences = id_to_num_sentences[chunk.parent]
                 end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                assert window is None or end_rel < window, \
+                    f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                 is_first = chunk.tokens[0].id_sent == 0
                 is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                pairs = get_sent_pairs_to_predict_for(end=end_rel, is_first=is_first, is_last=is_last, window=window)
+                pairs = get_sent_pairs_to_predict_for(
+                    end=end_rel, is_first=is_first, is_last=is_last, window=window, stride=stride
+                )
 
                 index_head_to_index_dep = {}
                 for arc in chunk.arcs:
@@ -513,19 +512,7 @@ class BertForCoreferenceResolutionMentionPair(BaseBertForCoreferenceResolution):
         # print("total loss:", total_loss)
         # print("denominator:", loss_denominator)
 
-        to_conll(examples=examples, path=self.config["valid"]["path_true"])
-        to_conll(examples=examples_valid_copy, path=self.config["valid"]["path_pred"])
-
-        metrics = {}
-        for metric in ["muc", "bcub", "ceafm", "ceafe", "blanc"]:
-            stdout = get_coreferense_resolution_metrics(
-                path_true=self.config["valid"]["path_true"],
-                path_pred=self.config["valid"]["path_pred"],
-                scorer_path=self.config["valid"]["scorer_path"],
-                metric=metric
-            )
-            is_blanc = metric == "blanc"
-            metrics[metric] = parse_conll_metrics(stdout=stdout, is_blanc=is_blanc)
+        metrics = get_coreference_resolution_metrics_v2(examples_true=examples, examples_pred=examples_valid_copy)
 
         score = (metrics["muc"]["f1"] + metrics["bcub"]["f1"] + metrics["ceafm"]["f1"] + metrics["ceafe"]["f1"]) / 4.0
         accuracy = num_right_preds / num_entities_total_chunk_level
@@ -664,15 +651,12 @@ class BertForCoreferenceResolutionMentionRanking(BaseBertForCoreferenceResolutio
 
         head2dep = {}  # (file, head) -> {dep, score}
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            total_loss_i, d, re_labels_pred, re_logits_pred = self.sess.run(
+            total_loss_i, d, re_labels_pred, re_logits_pred = self._run_timed(
                 [self.total_loss, self.loss_denominator, self.labels_pred, self.logits_pred],
                 feed_dict=feed_dict
             )
@@ -691,10 +675,13 @@ class BertForCoreferenceResolutionMentionRanking(BaseBertForCoreferenceResolutio
 
                 num_sentences = id_to_num_sentences[chunk.parent]
                 end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                assert window is None or end_rel < window, \
+                    f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                 is_first = chunk.tokens[0].id_sent == 0
                 is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                pairs = get_sent_pairs_to_predict_for(end=end_rel, is_first=is_first, is_last=is_last, window=window)
+                pairs = get_sent_pairs_to_predict_for(
+                    end=end_rel, is_first=is_first, is_last=is_last, window=window, stride=stride
+                )
 
                 # предсказанные лейблы, которые можно получить из предиктов для кусочка chunk
                 for id_sent_rel_a, id_sent_rel_b in pairs:
@@ -751,19 +738,7 @@ class BertForCoreferenceResolutionMentionRanking(BaseBertForCoreferenceResolutio
         # compute performance info
         loss = total_loss / loss_denominator
 
-        to_conll(examples=examples, path=self.config["valid"]["path_true"])
-        to_conll(examples=examples_valid_copy, path=self.config["valid"]["path_pred"])
-
-        metrics = {}
-        for metric in ["muc", "bcub", "ceafm", "ceafe", "blanc"]:
-            stdout = get_coreferense_resolution_metrics(
-                path_true=self.config["valid"]["path_true"],
-                path_pred=self.config["valid"]["path_pred"],
-                scorer_path=self.config["valid"]["scorer_path"],
-                metric=metric
-            )
-            is_blanc = metric == "blanc"
-            metrics[metric] = parse_conll_metrics(stdout=stdout, is_blanc=is_blanc)
+        metrics = get_coreference_resolution_metrics_v2(examples_true=examples, examples_pred=examples_valid_copy)
 
         score = (metrics["muc"]["f1"] + metrics["bcub"]["f1"] + metrics["ceafm"]["f1"] + metrics["ceafe"]["f1"]) / 4.0
         d = {
@@ -815,6 +790,7 @@ class BertForCoreferenceResolutionMentionRankingNewInference(BertForCoreferenceR
     def predict(self, examples: List[Example], flat_chains: bool = True, **kwargs) -> None:
         batch_size = 16
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
         for start in range(0, len(examples), batch_size):
             end = start + batch_size
             examples_batch = examples[start:end]
@@ -827,18 +803,21 @@ class BertForCoreferenceResolutionMentionRankingNewInference(BertForCoreferenceR
                 id2embeddings[x.id] = {}  # (start, end) -> np.array размерности D
                 example_ids.append(x.id)
                 id_to_num_sentences[x.id] = x.tokens[-1].id_sent + 1
-            gen = batches_gen(examples=chunks_batch, max_tokens_per_batch=10000, pieces_level=True)
+            gen = self._batches_gen(chunks_batch, pieces_level=True, max_tokens_per_batch=10000, report=False)
             for batch in gen:
                 feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-                x_ent_pred = self.sess.run(self.x_ent_pred, feed_dict=feed_dict)  # [num_chunks, E, D]
+                x_ent_pred = self._run_timed(self.x_ent_pred, feed_dict=feed_dict)  # [num_chunks, E, D]
                 for i in range(len(batch)):
                     chunk = batch[i]
                     num_sentences = id_to_num_sentences[chunk.parent]
                     end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                    assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                    assert window is None or end_rel < window, \
+                        f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                     is_first = chunk.tokens[0].id_sent == 0
                     is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                    sent_ids = get_sent_ids_to_predict_for(is_first=is_first, is_last=is_last, window=window)
+                    sent_ids = get_sent_ids_to_predict_for(
+                        is_first=is_first, is_last=is_last, window=window, stride=stride, end=end_rel
+                    )
 
                     index2entity = {entity.index: entity for entity in chunk.entities}
                     for j in range(len(chunk.entities)):
@@ -7,7 +7,7 @@ from src.model.base import BaseModeDependencyParsing, BaseModelBert, ModeKeys
 from src.model.layers import GraphEncoder, GraphEncoderInputs
 from src.model.utils import get_additive_mask
 from src.data.base import Example
-from src.utils import batches_gen, mst, get_filtered_by_length_chunks, log
+from src.utils import mst, get_filtered_by_length_chunks, log
 
 
 class BertForDependencyParsing(BaseModeDependencyParsing, BaseModelBert):
@@ -95,56 +95,19 @@ class BertForDependencyParsing(BaseModeDependencyParsing, BaseModelBert):
 
     def _get_feed_dict(self, examples: List[Example], mode: str):
         """
-        копипаста из BaseModelBert. _get_bert_input_for_feed_dict связана
-        с добавлением айдишника специального токена под ROOT
+        входы bert - как в BaseModelBert, но с [ROOT] после [CLS]
         :param examples:
         :param mode:
         :return:
         """
-        # bert
-        input_ids = []
-        input_mask = []
-        segment_ids = []
-
-        # ner
-        first_pieces_coords = []
-        num_pieces = []
-        num_tokens = []
+        bert_inputs = self._get_bert_input_for_feed_dict(
+            examples, root_token_id=self.config["model"]["bert"]["root_token_id"]
+        )
 
         labels = []
-
-        # filling
-        for i, x in enumerate(examples):
-            input_ids_i = []
-            input_mask_i = []
-            segment_ids_i = []
-            first_pieces_coords_i = []
-
-            # [CLS]
-            input_ids_i.append(self.config["model"]["bert"]["cls_token_id"])
-            input_mask_i.append(1)
-            segment_ids_i.append(0)
-
-            # [ROOT]
-            input_ids_i.append(self.config["model"]["bert"]["root_token_id"])
-            input_mask_i.append(1)
-            segment_ids_i.append(0)
-
-            first_pieces_coords_i.append((i, 1))
-
-            ptr = 2
-
-            # tokens
-            for j, t in enumerate(x.tokens):
-                assert len(t.token_ids) > 0
-                first_pieces_coords_i.append((i, ptr))
-                num_pieces_ij = len(t.token_ids)
-                input_ids_i += t.token_ids
-                input_mask_i += [1] * num_pieces_ij
-                segment_ids_i += [0] * num_pieces_ij
-                ptr += num_pieces_ij
-
-                if mode != ModeKeys.TEST:
+        if mode != ModeKeys.TEST:
+            for i, x in enumerate(examples):
+                for j, t in enumerate(x.tokens):
                     assert isinstance(t.id_head, int)
                     assert isinstance(t.rel, str)
                     if t.id_head == -1:
@@ -153,38 +116,15 @@ class BertForDependencyParsing(BaseModeDependencyParsing, BaseModelBert):
                         k = t.id_head + 1
                     labels.append((i, j, k, self.rel_enc[t.rel]))
 
-            # [SEP]
-            input_ids_i.append(self.config["model"]["bert"]["sep_token_id"])
-            input_mask_i.append(1)
-            segment_ids_i.append(0)
-
-            # write
-            num_pieces.append(len(input_ids_i))
-            num_tokens.append(len(x.tokens))
-            input_ids.append(input_ids_i)
-            input_mask.append(input_mask_i)
-            segment_ids.append(segment_ids_i)
-            first_pieces_coords.append(first_pieces_coords_i)
-
-        # padding
-        pad_token_id = self.config["model"]["bert"]["pad_token_id"]
-        num_tokens_max = max(num_tokens)
-        num_pieces_max = max(num_pieces)
-        for i in range(len(examples)):
-            input_ids[i] += [pad_token_id] * (num_pieces_max - num_pieces[i])
-            input_mask[i] += [0] * (num_pieces_max - num_pieces[i])
-            segment_ids[i] += [0] * (num_pieces_max - num_pieces[i])
-            first_pieces_coords[i] += [(i, 0)] * (num_tokens_max - num_tokens[i])
-
         training = mode == ModeKeys.TRAIN
 
         d = {
-            self.input_ids_ph: input_ids,
-            self.input_mask_ph: input_mask,
-            self.segment_ids_ph: segment_ids,
-            self.first_pieces_coords_ph: first_pieces_coords,
-            self.num_pieces_ph: num_pieces,
-            self.num_tokens_ph: num_tokens,
+            self.input_ids_ph: bert_inputs.input_ids,
+            self.input_mask_ph: bert_inputs.input_mask,
+            self.segment_ids_ph: bert_inputs.segment_ids,
+            self.first_pieces_coords_ph: bert_inputs.first_pieces_coords,
+            self.num_pieces_ph: bert_inputs.num_pieces,
+            self.num_tokens_ph: bert_inputs.num_tokens,
             self.training_ph: training
         }
 
@@ -209,10 +149,10 @@ class BertForDependencyParsing(BaseModeDependencyParsing, BaseModelBert):
                 assert t.rel is None
 
         max_tokens_per_batch = self.config["inference"]["max_tokens_per_batch"]
-        gen = batches_gen(examples=chunks, max_tokens_per_batch=max_tokens_per_batch, pieces_level=self._is_bpe_level)
+        gen = self._batches_gen(chunks, pieces_level=self._is_bpe_level, max_tokens_per_batch=max_tokens_per_batch)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            s_arc, type_labels_pred, = self.sess.run([self.s_arc, self.type_labels_pred], feed_dict=feed_dict)
+            s_arc, type_labels_pred, = self._run_timed([self.s_arc, self.type_labels_pred], feed_dict=feed_dict)
             for i, x in enumerate(batch):
                 num_tokens_i = len(x.tokens)
                 s_arc_i = s_arc[i, :num_tokens_i, :num_tokens_i + 1]  # [T, T + 1]
@@ -242,10 +182,10 @@ class BertForDependencyParsing(BaseModeDependencyParsing, BaseModelBert):
         total_loss_type = 0.0
 
         max_tokens_per_batch = self.config["inference"]["max_tokens_per_batch"]
-        gen = batches_gen(examples=chunks, max_tokens_per_batch=max_tokens_per_batch, pieces_level=self._is_bpe_level)
+        gen = self._batches_gen(chunks, pieces_level=self._is_bpe_level, max_tokens_per_batch=max_tokens_per_batch)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            s_arc, type_labels_pred, loss_arc_i, loss_type_i = self.sess.run(
+            s_arc, type_labels_pred, loss_arc_i, loss_type_i = self._run_timed(
                 [self.s_arc, self.type_labels_pred, self.total_loss_arc, self.total_loss_type],
                 feed_dict=feed_dict
             )
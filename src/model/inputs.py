@@ -0,0 +1,183 @@
+"""
+Входы bert для feed_dict. Без зависимости от tensorflow, чтоб можно было тестировать и переиспользовать
+вне моделей (см. также src.data.columnar.ColumnarCorpus.get_bert_inputs).
+
+Упаковка (packing): несколько коротких кусков кладутся в одну строку входа bert друг за другом,
+каждый со своими [CLS] и [SEP]. В input_mask вместо единиц пишется номер сегмента (куска) в строке,
+начиная с 1; 0 - паддинг. По input_mask строится блочно-диагональная маска внимания и позиции,
+которые начинаются с нуля в каждом сегменте (см. BaseModelBert._build_bert_packed).
+Без упаковки каждый кусок - отдельная строка с единственным сегментом 1, то есть input_mask совпадает с обычным.
+first_pieces_coords по-прежнему имеет размерность [num_chunks, num_tokens_max, 2], но указывает на (строка, позиция)
+в упакованном входе, поэтому tf.gather_nd(bert_out, first_pieces_coords) сразу возвращает эмбеддинги токенов
+по кускам, и головы моделей не меняются.
+
+get_bert_inputs собирает numpy-массивы int32 без поэлементных циклов по кусочкам: кусочки каждого куска
+один раз склеиваются в массив и кэшируются (см. get_chunk_pieces), а матрицы батча заполняются
+векторными присваиваниями по заранее посчитанным координатам.
+"""
+import weakref
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from src.data.base import Example, BertInputs
+from src.utils import get_tokens_refs, is_same_refs
+
+
+def pack_sequences(lengths: Sequence[int], maxlen: int) -> List[List[int]]:
+    """
+    Раскладка последовательностей по строкам длины не больше maxlen: first fit decreasing.
+    Последовательность длиннее maxlen занимает отдельную строку.
+    :param lengths: длины последовательностей
+    :param maxlen: вместимость строки
+    :return: rows: индексы последовательностей по строкам
+    """
+    rows = []
+    free = []  # свободное место в строках
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        n = lengths[i]
+        for k in range(len(rows)):
+            if free[k] >= n:
+                rows[k].append(i)
+                free[k] -= n
+                break
+        else:
+            rows.append([i])
+            free.append(maxlen - n)
+    return rows
+
+
+# кусок -> (ссылки, id кусочков, начала токенов в кусочках).
+# ссылки на список токенов и token_ids крайних токенов проверяются по is (см. src.utils.get_tokens_refs),
+# так что после замены токенов или повторного apply_bpe значение пересчитывается
+_chunk_pieces = weakref.WeakKeyDictionary()
+
+
+def clear_chunk_pieces_cache():
+    """
+    сброс кэша кусочков (например, для замера первой эпохи в bin/benchmark.py). для корректности не нужен
+    """
+    _chunk_pieces.clear()
+
+
+def get_chunk_pieces(x: Example) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param x: кусок
+    :return: token_ids: [num_pieces] id кусочков куска; starts: [num_tokens] начала токенов в token_ids
+    """
+    refs = get_tokens_refs(x, "token_ids")
+    v = _chunk_pieces.get(x)
+    if v is None or not is_same_refs(v[0], refs):
+        token_ids = []
+        starts = []
+        for t in x.tokens:
+            assert len(t.token_ids) != 0, f"[{x.id}] token {t} could not be split by pieces! " \
+                f"unicode code points: {[ord(c) for c in t.text]}"
+            starts.append(len(token_ids))
+            token_ids += t.token_ids
+        v = _chunk_pieces[x] = refs, np.array(token_ids, dtype=np.int32), np.array(starts, dtype=np.int32)
+    return v[1:]
+
+
+def get_bert_inputs(
+        examples: List[Example],
+        cls_token_id: int,
+        sep_token_id: int,
+        pad_token_id: int = 0,
+        root_token_id: int = None,
+        packing_maxlen: int = None
+) -> BertInputs:
+    """
+    входы bert для батча кусков; поля - массивы np.int32
+    :param examples: куски
+    :param cls_token_id:
+    :param sep_token_id:
+    :param pad_token_id:
+    :param root_token_id: если задан, то после [CLS] вставляется [ROOT] (dependency parsing),
+     и его координата - первая в first_pieces_coords куска. num_tokens при этом [ROOT] не учитывает
+    :param packing_maxlen: если задан, то куски упаковываются в строки длины не больше packing_maxlen
+    :return:
+    """
+    pieces = [get_chunk_pieces(x) for x in examples]
+    n = len(examples)
+    prefix = 1 if root_token_id is None else 2  # [CLS] или [CLS] [ROOT]
+    num_pieces_chunk = np.array([len(p) for p, _ in pieces], dtype=np.int32)  # без спец. токенов
+    num_tokens = np.array([len(s) for _, s in pieces], dtype=np.int32)
+    num_pieces = num_pieces_chunk + prefix + 1
+
+    # строка и начало каждого куска в строке
+    if packing_maxlen is None:
+        row = np.arange(n, dtype=np.int32)
+        offset = np.zeros(n, dtype=np.int32)
+        segment = np.ones(n, dtype=np.int32)
+        num_rows = n
+        row_len = num_pieces
+    else:
+        rows = pack_sequences(num_pieces.tolist(), maxlen=packing_maxlen)
+        num_rows = len(rows)
+        row = np.zeros(n, dtype=np.int32)
+        offset = np.zeros(n, dtype=np.int32)
+        segment = np.zeros(n, dtype=np.int32)
+        row_len = np.zeros(num_rows, dtype=np.int32)
+        for id_row, row_chunks in enumerate(rows):
+            pos = 0
+            for id_segment, i in enumerate(row_chunks):
+                row[i] = id_row
+                offset[i] = pos
+                segment[i] = id_segment + 1
+                pos += num_pieces[i]
+            row_len[id_row] = pos
+
+    num_pieces_max = int(row_len.max())
+    input_ids = np.full((num_rows, num_pieces_max), pad_token_id, dtype=np.int32)
+    input_mask = np.zeros((num_rows, num_pieces_max), dtype=np.int32)
+    segment_ids = np.zeros((num_rows, num_pieces_max), dtype=np.int32)
+
+    # спец. токены
+    input_ids[row, offset] = cls_token_id
+    if root_token_id is not None:
+        input_ids[row, offset + 1] = root_token_id
+    input_ids[row, offset + prefix + num_pieces_chunk] = sep_token_id
+
+    # кусочки: позиция j-го кусочка i-го куска - offset[i] + prefix + j
+    rows_rep, cols = _get_ranges_coords(row, offset + prefix, num_pieces_chunk)
+    if len(cols) > 0:
+        input_ids[rows_rep, cols] = np.concatenate([p for p, _ in pieces])
+
+    # маска: номер сегмента на всей длине куска со спец. токенами
+    rows_rep, cols = _get_ranges_coords(row, offset, num_pieces)
+    input_mask[rows_rep, cols] = np.repeat(segment, num_pieces)
+
+    # координаты первых кусочков; паддинг - (строка, начало куска)
+    num_coords = num_tokens + (prefix - 1)
+    first_pieces_coords = np.zeros((n, int(num_coords.max()), 2), dtype=np.int32)
+    first_pieces_coords[:, :, 0] = row[:, None]
+    first_pieces_coords[:, :, 1] = offset[:, None]
+    if root_token_id is not None:
+        first_pieces_coords[:, 0, 1] = offset + 1
+    chunks_rep, cols = _get_ranges_coords(np.arange(n), np.full(n, prefix - 1), num_tokens)
+    if len(cols) > 0:
+        starts = np.concatenate([s for _, s in pieces])
+        first_pieces_coords[chunks_rep, cols, 1] = np.repeat(offset + prefix, num_tokens) + starts
+
+    return BertInputs(
+        input_ids=input_ids,
+        input_mask=input_mask,
+        segment_ids=segment_ids,
+        first_pieces_coords=first_pieces_coords,
+        num_tokens=num_tokens,
+        num_pieces=num_pieces
+    )
+
+
+def _get_ranges_coords(rows: np.ndarray, starts: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    координаты ячеек отрезков [starts[i], starts[i] + lengths[i]) в строках rows[i]
+    :return: rows_rep: [sum(lengths)]; cols: [sum(lengths)]
+    """
+    total = int(lengths.sum())
+    rows_rep = np.repeat(rows, lengths)
+    # позиция внутри отрезка: сквозной индекс минус начало отрезка в сквозной нумерации
+    range_starts = np.cumsum(lengths) - lengths
+    cols = np.arange(total) - np.repeat(range_starts, lengths) + np.repeat(starts, lengths)
+    return rows_rep, cols
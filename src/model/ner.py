@@ -8,7 +8,7 @@ from src.model.base import BaseModelNER, BaseModelBert, ModeKeys
 from src.model.layers import GraphEncoder, GraphEncoderInputs
 from src.model.utils import upper_triangular
 from src.metrics import classification_report, classification_report_ner
-from src.utils import get_entity_spans, batches_gen, get_filtered_by_length_chunks, log
+from src.utils import get_entity_spans, get_filtered_by_length_chunks, log
 
 
 class BertForNerAsSequenceLabeling(BaseModelNER, BaseModelBert):
@@ -95,14 +95,10 @@ class BertForNerAsSequenceLabeling(BaseModelNER, BaseModelBert):
         total_loss = 0.0
         loss_denominator = 0
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=self._is_bpe_level
-        )
+        gen = self._batches_gen(chunks, pieces_level=self._is_bpe_level)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            total_loss_i, d, ner_labels_pred = self.sess.run(
+            total_loss_i, d, ner_labels_pred = self._run_timed(
                 [self.total_loss, self.loss_denominator, self.ner_preds_inference], feed_dict=feed_dict
             )
             total_loss += total_loss_i
@@ -169,14 +165,10 @@ class BertForNerAsSequenceLabeling(BaseModelNER, BaseModelBert):
         assert len(id2example) == len(examples), f"examples must have unique ids, " \
             f"but got {len(id2example)} unique ids among {len(examples)} examples"
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=self._is_bpe_level
-        )
+        gen = self._batches_gen(chunks, pieces_level=self._is_bpe_level)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            ner_labels_pred = self.sess.run(self.ner_preds_inference, feed_dict=feed_dict)
+            ner_labels_pred = self._run_timed(self.ner_preds_inference, feed_dict=feed_dict)
 
             m = max(len(x.tokens) for x in batch)
             assert m == ner_labels_pred.shape[1], f'{m} != {ner_labels_pred.shape[1]}'
@@ -420,14 +412,10 @@ class BertForNerAsDependencyParsing(BaseModelNER, BaseModelBert):
         loss_denominator = 0
         no_entity_label = "O"  # TODO: брать из конфига
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            total_loss_i, d, ner_logits = self.sess.run([self.total_loss, self.loss_denominator, self.ner_logits_inference], feed_dict=feed_dict)
+            total_loss_i, d, ner_logits = self._run_timed([self.total_loss, self.loss_denominator, self.ner_logits_inference], feed_dict=feed_dict)
             total_loss += total_loss_i
             loss_denominator += d
 
@@ -483,14 +471,10 @@ class BertForNerAsDependencyParsing(BaseModelNER, BaseModelBert):
         assert len(id2example) == len(examples), f"examples must have unique ids, " \
             f"but got {len(id2example)} unique ids among {len(examples)} examples"
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            ner_logits = self.sess.run(self.ner_logits_inference, feed_dict=feed_dict)
+            ner_logits = self._run_timed(self.ner_logits_inference, feed_dict=feed_dict)
 
             for i, chunk in enumerate(batch):
                 example = id2example[chunk.parent]
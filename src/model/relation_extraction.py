@@ -10,7 +10,7 @@ from src.model.layers import StackedBiRNN, GraphEncoder, GraphEncoderInputs
 from src.model.utils import upper_triangular, get_entities_representation, get_sent_pairs_to_predict_for
 from src.metrics import classification_report, classification_report_ner
 from src.model.ner import BertForNerAsSequenceLabeling
-from src.utils import get_entity_spans, batches_gen, get_filtered_by_length_chunks, log
+from src.utils import get_entity_spans, get_filtered_by_length_chunks, log
 
 
 class BertForRelationExtraction(BaseModelRelationExtraction, BaseModelBert):
@@ -201,14 +201,10 @@ class BertForRelationExtraction(BaseModelRelationExtraction, BaseModelBert):
             examples=examples, maxlen=self.config["inference"]["maxlen"], pieces_level=self._is_bpe_level
         )
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            loss_i, labels_pred = self.sess.run([self.total_loss, self.labels_pred], feed_dict=feed_dict)
+            loss_i, labels_pred = self._run_timed([self.total_loss, self.labels_pred], feed_dict=feed_dict)
             loss += loss_i
 
             for i, x in enumerate(batch):
@@ -266,6 +262,7 @@ class BertForRelationExtraction(BaseModelRelationExtraction, BaseModelBert):
             f"but got {len(id2example)} unique ids among {len(examples)} examples"
 
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
         no_rel_id = self.config["model"]["re"]["no_relation_id"]
         assert no_rel_id == 0
 
@@ -273,14 +270,10 @@ class BertForRelationExtraction(BaseModelRelationExtraction, BaseModelBert):
             examples=examples, maxlen=self.config["inference"]["maxlen"], pieces_level=self._is_bpe_level
         )
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            re_labels_pred = self.sess.run(self.labels_pred, feed_dict=feed_dict)  # [N, E, E]
+            re_labels_pred = self._run_timed(self.labels_pred, feed_dict=feed_dict)  # [N, E, E]
 
             for i in range(len(batch)):
                 chunk = batch[i]
@@ -288,10 +281,13 @@ class BertForRelationExtraction(BaseModelRelationExtraction, BaseModelBert):
 
                 num_sentences = id_to_num_sentences[chunk.parent]
                 end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                assert window is None or end_rel < window, \
+                    f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                 is_first = chunk.tokens[0].id_sent == 0
                 is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                pairs = get_sent_pairs_to_predict_for(end=end_rel, is_first=is_first, is_last=is_last, window=window)
+                pairs = get_sent_pairs_to_predict_for(
+                    end=end_rel, is_first=is_first, is_last=is_last, window=window, stride=stride
+                )
 
                 num_entities_i = len(chunk.entities)
                 arcs_pred = re_labels_pred[i, :num_entities_i, :num_entities_i]
@@ -516,14 +512,10 @@ class BertForNerAsSequenceLabelingAndRelationExtraction(BaseModelNerAndRelationE
         loss = 0.0
         loss_denominator = 0
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.VALID)
-            loss_i, labels_pred = self.sess.run([self.total_loss, self.labels_pred], feed_dict=feed_dict)
+            loss_i, labels_pred = self._run_timed([self.total_loss, self.labels_pred], feed_dict=feed_dict)
             loss += loss_i
 
             for i, x in enumerate(batch):
@@ -581,17 +573,14 @@ class BertForNerAsSequenceLabelingAndRelationExtraction(BaseModelNerAndRelationE
             f"but got {len(id2example)} unique ids among {len(examples)} examples"
 
         window = self.config["inference"]["window"]
+        stride = self.config["inference"].get("stride", 1)
         no_rel_id = self.config["model"]["re"]["no_relation_id"]
         assert no_rel_id == 0
 
-        gen = batches_gen(
-            examples=chunks,
-            max_tokens_per_batch=self.config["inference"]["max_tokens_per_batch"],
-            pieces_level=True
-        )
+        gen = self._batches_gen(chunks, pieces_level=True)
         for batch in gen:
             feed_dict = self._get_feed_dict(batch, mode=ModeKeys.TEST)
-            re_labels_pred = self.sess.run(self.labels_pred, feed_dict=feed_dict)  # [N, E, E]
+            re_labels_pred = self._run_timed(self.labels_pred, feed_dict=feed_dict)  # [N, E, E]
 
             for i in range(len(batch)):
                 chunk = batch[i]
@@ -599,10 +588,13 @@ class BertForNerAsSequenceLabelingAndRelationExtraction(BaseModelNerAndRelationE
 
                 num_sentences = id_to_num_sentences[chunk.parent]
                 end_rel = chunk.tokens[-1].id_sent - chunk.tokens[0].id_sent
-                assert end_rel < window, f"[{chunk.id}] relative end {end_rel} >= window size {window}"
+                assert window is None or end_rel < window, \
+                    f"[{chunk.id}] relative end {end_rel} >= window size {window}"
                 is_first = chunk.tokens[0].id_sent == 0
                 is_last = chunk.tokens[-1].id_sent == num_sentences - 1
-                pairs = get_sent_pairs_to_predict_for(end=end_rel, is_first=is_first, is_last=is_last, window=window)
+                pairs = get_sent_pairs_to_predict_for(
+                    end=end_rel, is_first=is_first, is_last=is_last, window=window, stride=stride
+                )
 
                 num_entities_i = len(chunk.entities)
                 arcs_pred = re_labels_pred[i, :num_entities_i, :num_entities_i]
@@ -2,6 +2,8 @@ from typing import Tuple, List
 import tensorflow as tf
 import numpy as np
 
+from src.utils import get_sent_pairs_to_predict_for, get_sent_ids_to_predict_for
+
 
 def get_labels_mask(labels_2d: tf.Tensor, values: tf.Tensor, sequence_len: tf.Tensor) -> tf.Tensor:
     """
@@ -370,88 +372,3 @@ def get_entity_pairs_mask(entity_sent_ids, i, j):
             mask[i, j] = 1
             mask[j, i] = 1
     return mask
-
-
-# 1 - общий случай
-# 2 - первый кусок
-# 3 - последний кусок
-grid_2 = np.tri(2).T
-grid_3 = np.tri(3).T
-grid_3_alt = np.array([
-    [2, 1, 1],
-    [0, 1, 3],
-    [0, 0, 3]
-])
-grid_4 = np.tri(4).T
-grid_5 = np.array([
-    [2, 2, 2, 1, 1],
-    [0, 2, 1, 1, 3],
-    [0, 0, 1, 3, 3],
-    [0, 0, 0, 3, 3],
-    [0, 0, 0, 0, 3]
-])
-
-pairs_2 = list(zip(*np.where(grid_2 == 1)))
-pairs_3 = list(zip(*np.where(grid_3 == 1)))
-pairs_3_1 = list(zip(*np.where(grid_3_alt == 1)))
-pairs_3_2 = list(zip(*np.where(grid_3_alt == 2)))
-pairs_3_3 = list(zip(*np.where(grid_3_alt == 3)))
-pairs_4 = list(zip(*np.where(grid_4 == 1)))
-pairs_5_1 = list(zip(*np.where(grid_5 == 1)))
-pairs_5_2 = list(zip(*np.where(grid_5 == 2)))
-pairs_5_3 = list(zip(*np.where(grid_5 == 3)))
-
-
-# TODO: протестировать!
-def get_sent_pairs_to_predict_for(end: int, is_first: bool, is_last: bool, window: int) -> List[Tuple]:
-    assert 0 <= end < window, f"end: {end}, window: {window}, is_first: {is_first}, is_last: {is_last}"
-
-    if window == 1:
-        return [(0, 0)]
-    elif window == 3:
-        res = pairs_3_1.copy()
-        if is_first:
-            res += pairs_3_2
-        if is_last:
-            res += pairs_3_3
-        return res
-    elif window == 5:
-        if end == 0:
-            return [(0, 0)]
-        elif end == 1:
-            return pairs_2.copy()
-        elif end == 2:
-            return pairs_3.copy()
-        elif end == 3:
-            return pairs_4.copy()
-        else:
-            res = pairs_5_1.copy()
-            if is_first:
-                res += pairs_5_2
-            if is_last:
-                res += pairs_5_3
-            return res
-    else:
-        raise NotImplementedError(f"expected window in {{1, 3, 5}}, but got {window}")
-
-
-def get_sent_ids_to_predict_for(is_first, is_last, window):
-    assert window in {1, 3, 5}
-    if window == 1:
-        return {0}
-    elif window == 3:
-        if is_first:
-            return {0, 1}
-        elif is_last:
-            return {1, 2}
-        else:
-            return {1}
-    elif window == 5:
-        if is_first:
-            return {0, 1, 2}
-        elif is_last:
-            return {2, 3, 4}
-        else:
-            return {2}
-    else:
-        raise NotImplementedError
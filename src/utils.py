@@ -1,9 +1,14 @@
+import hashlib
+import queue
 import random
 import re
+import sys
+import threading
+import weakref
 from datetime import datetime
-from collections import defaultdict
-from functools import wraps
-from typing import List, Dict, Set
+from collections import defaultdict, OrderedDict
+from functools import wraps, lru_cache
+from typing import List, Dict, Set, Tuple, Iterable, Iterator, Sequence, Hashable, Any
 
 import numpy as np
 
@@ -228,29 +233,512 @@ def parse_conll_metrics(stdout: str, is_blanc: bool) -> Dict:
     return d
 
 
-def batches_gen(examples: List[Example], max_tokens_per_batch: int = 10000, pieces_level: bool = False):
+class BatchingPolicies:
+    GREEDY = "greedy"  # примеры сортируются по длине, батч заполняется до max_tokens_per_batch
+    MIN_COST = "min_cost"  # разбиение отсортированных примеров на батчи с минимальной суммарной стоимостью
+
+
+def get_tokens_refs(x: Example, attr: str) -> Tuple:
+    """
+    дешёвая проверка того, что токены примера не менялись: сам список токенов и списки attr (pieces или token_ids)
+    первого и последнего токенов. значение кэша хранит ссылки на эти объекты и сравнивается по is (см. is_same_refs),
+    поэтому замена списка токенов или повторный apply_bpe с другим токенизатором делают значение невалидным.
+    замену кусочков только в середине примера проверка не ловит
+    """
+    tokens = x.tokens
+    if len(tokens) == 0:
+        return tokens,
+    return tokens, getattr(tokens[0], attr), getattr(tokens[-1], attr)
+
+
+def is_same_refs(a: Tuple, b: Tuple) -> bool:
+    return len(a) == len(b) and all(u is v for u, v in zip(a, b))
+
+
+# пример -> (ссылки, число токенов, число bpe-кусочков). длины считаются один раз,
+# а не при каждом вызове batches_gen (на каждой эпохе evaluate), и пересчитываются, если токены поменялись
+_example_lengths = weakref.WeakKeyDictionary()
+
+
+def get_example_length(x: Example, pieces_level: bool = False) -> int:
+    refs = get_tokens_refs(x, "pieces")
+    v = _example_lengths.get(x)
+    if v is None or not is_same_refs(v[0], refs):
+        v = _example_lengths[x] = refs, len(x.tokens), sum(len(t.pieces) for t in x.tokens)
+    return v[1 + int(pieces_level)]
+
+
+class LengthIndex:
+    """
+    длины примеров и их порядок по возрастанию длины.
+    строится один раз и может переиспользоваться между вызовами batches_gen над одним и тем же списком примеров
+    """
+    def __init__(self, examples: List[Example], pieces_level: bool = False):
+        self.pieces_level = pieces_level
+        self.lengths = [get_example_length(x, pieces_level=pieces_level) for x in examples]
+        self.ids = [x.id for x in examples]
+        self.indices_sorted = sorted(range(len(self.lengths)), key=self.lengths.__getitem__)
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+class LengthIndexCache:
+    """
+    LengthIndex последнего списка примеров. evaluate на каждой эпохе заново собирает список из тех же кусков
+    examples_valid, поэтому индекс переиспользуется, если примеры те же самые (сравнение по is), а не строится
+    и сортируется заново. хранит сильные ссылки на примеры последнего списка
+    """
+    def __init__(self):
+        self.examples = ()
+        self.index = None
+
+    def get(self, examples: List[Example], pieces_level: bool = False) -> LengthIndex:
+        if self.index is None or self.index.pieces_level != pieces_level or not is_same_refs(self.examples, examples):
+            self.examples = tuple(examples)
+            self.index = LengthIndex(examples, pieces_level=pieces_level)
+        return self.index
+
+
+def batches_gen(
+        examples: List[Example],
+        max_tokens_per_batch: int = 10000,
+        pieces_level: bool = False,
+        length_index: LengthIndex = None,
+        **kwargs
+):
     """
     batch_size * max_len_batch <= max_tokens_per_batch
+    :param length_index: готовый индекс длин examples (см. LengthIndex)
+    :param kwargs: политика батчевания, см. batches_indices_gen
     """
-    id2len = {}
-    for x in examples:
-        if pieces_level:
-            id2len[x.id] = sum(len(t.pieces) for t in x.tokens)
-        else:
-            id2len[x.id] = len(x.tokens)
+    if length_index is None:
+        length_index = LengthIndex(examples, pieces_level=pieces_level)
+    else:
+        assert len(length_index) == len(examples), f"{len(length_index)} != {len(examples)}"
+        assert length_index.pieces_level == pieces_level
+    gen = batches_indices_gen(
+        length_index.lengths,
+        max_tokens_per_batch=max_tokens_per_batch,
+        ids=length_index.ids,
+        indices_sorted=length_index.indices_sorted,
+        **kwargs
+    )
+    for batch_indices in gen:
+        yield [examples[i] for i in batch_indices]
+
+
+def batches_indices_gen(
+        lengths: Sequence[int],
+        max_tokens_per_batch: int = 10000,
+        ids: Sequence[str] = None,
+        indices_sorted: Sequence[int] = None,
+        policy: str = BatchingPolicies.GREEDY,
+        attention_coef: float = 0.0,
+        batch_overhead: float = None,
+        max_attention_per_batch: int = None,
+        head_sizes: Sequence[int] = None,
+        head_coef: float = 0.0
+) -> Iterator[List[int]]:
+    """
+    логика batches_gen над длинами примеров: отдаются индексы примеров.
+    нужно для случаев, когда примеры не материализованы в виде Example (см. src.data.columnar)
+    :param lengths: длины примеров
+    :param max_tokens_per_batch: batch_size * (max_len_batch + head_coef * max_head_size_batch ** 2)
+     <= max_tokens_per_batch
+    :param ids: идентификаторы примеров для сообщения об ошибке
+    :param indices_sorted: индексы примеров по возрастанию длины, если уже посчитаны
+    :param policy: см. BatchingPolicies
+    :param attention_coef: вес квадратичного по длине слагаемого (attention) в стоимости батча (для MIN_COST)
+    :param batch_overhead: стоимость одного шага в токенах (для MIN_COST). по умолчанию - max_tokens_per_batch
+    :param max_attention_per_batch: batch_size * max_len_batch ** 2 <= max_attention_per_batch (для MIN_COST)
+    :param head_sizes: размеры голов примеров, например число сущностей для тензоров пар [N, E, E, ...] в RE и coref
+    :param head_coef: вес квадрата размера головы в стоимости батча (в токенах)
+    """
+    if indices_sorted is None:
+        indices_sorted = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    if head_sizes is None:
+        head_coef = 0.0
+
+    if policy == BatchingPolicies.GREEDY:
+        yield from _batches_indices_greedy(
+            lengths,
+            indices_sorted,
+            max_tokens_per_batch=max_tokens_per_batch,
+            ids=ids,
+            head_sizes=head_sizes,
+            head_coef=head_coef
+        )
+    elif policy == BatchingPolicies.MIN_COST:
+        yield from _batches_indices_min_cost(
+            lengths,
+            indices_sorted,
+            max_tokens_per_batch=max_tokens_per_batch,
+            ids=ids,
+            attention_coef=attention_coef,
+            batch_overhead=batch_overhead,
+            max_attention_per_batch=max_attention_per_batch,
+            head_sizes=head_sizes,
+            head_coef=head_coef
+        )
+    else:
+        raise NotImplementedError(f"expected policy in {{greedy, min_cost}}, but got {policy}")
 
-    examples_sorted = sorted(examples, key=lambda example: id2len[example.id])
 
+def _batches_indices_greedy(
+        lengths: Sequence[int],
+        indices_sorted: Sequence[int],
+        max_tokens_per_batch: int,
+        ids: Sequence[str] = None,
+        head_sizes: Sequence[int] = None,
+        head_coef: float = 0.0
+) -> Iterator[List[int]]:
     batch = []
-    for x in examples_sorted:
-        if id2len[x.id] * (len(batch) + 1) <= max_tokens_per_batch:
-            batch.append(x)
+    max_head_size = 0
+    too_large = []
+    for i in indices_sorted:
+        if _get_example_cost(lengths, i, head_sizes, head_coef) > max_tokens_per_batch:
+            # пример, который не влезает в бюджет, идёт отдельным батчем (как в MIN_COST)
+            too_large.append(i)
+            if batch:
+                yield batch
+            yield [i]
+            batch = []
+            max_head_size = 0
+            continue
+        head_size = max(max_head_size, head_sizes[i]) if head_coef else 0
+        if (lengths[i] + head_coef * head_size ** 2) * (len(batch) + 1) <= max_tokens_per_batch:
+            batch.append(i)
+            max_head_size = head_size
         else:
-            assert len(batch) > 0, f"[{x.id}] too large example: sequence len is {id2len[x.id]}, " \
-                f"which is greater than max_tokens_per_batch: {max_tokens_per_batch}"
             yield batch
-            batch = [x]
-    yield batch
+            batch = [i]
+            max_head_size = head_sizes[i] if head_coef else 0
+    if batch or len(indices_sorted) == 0:
+        yield batch
+    _warn_too_large(too_large, lengths, max_tokens_per_batch, ids)
+
+
+def _get_example_cost(lengths: Sequence[int], i: int, head_sizes: Sequence[int] = None, head_coef: float = 0.0):
+    """
+    бюджет, который занимает пример в батче из одного примера
+    """
+    return lengths[i] + (head_coef * head_sizes[i] ** 2 if head_coef else 0.0)
+
+
+def _warn_too_large(too_large: List[int], lengths: Sequence[int], max_tokens_per_batch: int, ids: Sequence[str] = None):
+    """
+    одно предупреждение на все примеры, которые не влезли в бюджет и пошли отдельными батчами
+    """
+    if not too_large:
+        return
+    examples = [ids[i] if ids is not None else i for i in too_large[:10]]
+    print(f"WARNING: {len(too_large)} examples exceed max_tokens_per_batch: {max_tokens_per_batch} on their own "
+          f"and form separate batches. max length: {max(lengths[i] for i in too_large)}. examples: {examples}")
+
+
+def _batches_indices_min_cost(
+        lengths: Sequence[int],
+        indices_sorted: Sequence[int],
+        max_tokens_per_batch: int,
+        ids: Sequence[str] = None,
+        attention_coef: float = 0.0,
+        batch_overhead: float = None,
+        max_attention_per_batch: int = None,
+        head_sizes: Sequence[int] = None,
+        head_coef: float = 0.0
+) -> Iterator[List[int]]:
+    """
+    Отсортированные по длине примеры режутся на отрезки-батчи динамическим программированием.
+    Стоимость батча из b примеров с максимальной длиной l и максимальным размером головы e:
+    batch_overhead + b * (l + attention_coef * l ** 2 + head_coef * e ** 2),
+    то есть объём вычислений с учётом паддинга плюс фиксированная цена шага.
+    Ограничения по памяти (при b > 1): b * (l + head_coef * e ** 2) <= max_tokens_per_batch,
+    b * l ** 2 <= max_attention_per_batch.
+    В отсортированном порядке l - длина последнего примера отрезка, поэтому
+    dp[i + 1] = min_j dp[j] + cost(j, i), где j пробегает допустимые начала отрезка, заканчивающегося на i.
+    """
+    if batch_overhead is None:
+        batch_overhead = max_tokens_per_batch
+    n = len(indices_sorted)
+    if n == 0:
+        yield []
+        return
+
+    lengths_sorted = np.array([lengths[i] for i in indices_sorted], dtype=np.int64)
+    if head_coef:
+        head_sizes_sorted = np.array([head_sizes[i] for i in indices_sorted], dtype=np.float64)
+    else:
+        head_sizes_sorted = np.zeros(n, dtype=np.float64)
+    dp = np.zeros(n + 1, dtype=np.float64)
+    prev = np.zeros(n + 1, dtype=np.int64)  # начало последнего отрезка
+    for i in range(n):
+        l = int(lengths_sorted[i])
+        max_batch_size = i + 1
+        if l > 0:
+            max_batch_size = min(max_batch_size, max_tokens_per_batch // l)
+            if max_attention_per_batch is not None:
+                max_batch_size = min(max_batch_size, max_attention_per_batch // (l * l))
+        # пример, который не влезает в бюджет, идёт отдельным батчем (как в GREEDY)
+        max_batch_size = max(max_batch_size, 1)
+        start = i + 1 - max_batch_size
+        batch_sizes = np.arange(max_batch_size, 0, -1, dtype=np.float64)  # для j = start, ..., i
+        # максимальный размер головы на отрезке [j, i]
+        max_head_sizes = np.maximum.accumulate(head_sizes_sorted[start:i + 1][::-1])[::-1]
+        memory = batch_sizes * (l + head_coef * max_head_sizes ** 2)
+        is_valid = memory <= max_tokens_per_batch
+        is_valid[-1] = True
+        values = dp[start:i + 1] + batch_overhead + batch_sizes * (
+            l + attention_coef * l * l + head_coef * max_head_sizes ** 2
+        )
+        values[~is_valid] = np.inf
+        k = int(np.argmin(values))  # при равенстве - более длинный батч
+        dp[i + 1] = values[k]
+        prev[i + 1] = start + k
+
+    bounds = []
+    end = n
+    while end > 0:
+        bounds.append((int(prev[end]), end))
+        end = int(prev[end])
+    for start, end in reversed(bounds):
+        yield [indices_sorted[k] for k in range(start, end)]
+    too_large = [
+        i for i in indices_sorted if _get_example_cost(lengths, i, head_sizes, head_coef) > max_tokens_per_batch
+    ]
+    _warn_too_large(too_large, lengths, max_tokens_per_batch, ids)
+
+
+def get_batch_cost(
+        lengths: Sequence[int],
+        batch: List[int],
+        attention_coef: float = 0.0,
+        head_sizes: Sequence[int] = None,
+        head_coef: float = 0.0
+) -> float:
+    """
+    оценка стоимости батча с учётом паддинга: b * (l + attention_coef * l ** 2 + head_coef * e ** 2)
+    """
+    if not batch:
+        return 0.0
+    max_len = max(lengths[i] for i in batch)
+    max_head_size = max(head_sizes[i] for i in batch) if head_sizes is not None else 0
+    return len(batch) * (max_len + attention_coef * max_len ** 2 + head_coef * max_head_size ** 2)
+
+
+def get_bucketed_batches(
+        lengths: Sequence[int],
+        max_tokens_per_batch: int,
+        bucket_width: int = 16,
+        rng=None,
+        head_sizes: Sequence[int] = None,
+        head_coef: float = 0.0
+) -> List[List[int]]:
+    """
+    Батчи на одну эпоху обучения: каждый пример попадает ровно в один батч.
+    Примеры раскладываются по корзинам длины (length // bucket_width), внутри корзины перемешиваются и
+    набираются в батчи до бюджета batch_size * (max_len + head_coef * max_head_size ** 2) <= max_tokens_per_batch.
+    Паддинг внутри батча - не больше bucket_width. Порядок батчей тоже перемешивается.
+    :param lengths: длины примеров
+    :param max_tokens_per_batch: бюджет батча
+    :param bucket_width: ширина корзины
+    :param rng: генератор случайных чисел с методом shuffle (random.Random, np.random.RandomState).
+     по умолчанию - модуль random
+    :param head_sizes, head_coef: см. batches_indices_gen
+    :return: списки индексов примеров
+    """
+    assert bucket_width > 0
+    rng = rng if rng is not None else random
+    if head_sizes is None:
+        head_coef = 0.0
+
+    buckets = defaultdict(list)
+    for i, length in enumerate(lengths):
+        buckets[length // bucket_width].append(i)
+
+    batches = []
+    for key in sorted(buckets):
+        bucket = buckets[key]
+        rng.shuffle(bucket)
+        batch = []
+        max_len = 0
+        max_head_size = 0
+        for i in bucket:
+            max_len_i = max(max_len, lengths[i])
+            max_head_size_i = max(max_head_size, head_sizes[i]) if head_coef else 0
+            if batch and (max_len_i + head_coef * max_head_size_i ** 2) * (len(batch) + 1) > max_tokens_per_batch:
+                batches.append(batch)
+                batch = []
+                max_len_i = lengths[i]
+                max_head_size_i = head_sizes[i] if head_coef else 0
+            batch.append(i)
+            max_len = max_len_i
+            max_head_size = max_head_size_i
+        if batch:
+            batches.append(batch)
+    rng.shuffle(batches)
+    return batches
+
+
+def get_padding_report(lengths: Sequence[int], batches: List[List[int]], attention_coef: float = 0.0) -> Dict:
+    """
+    эффективность паддинга: доля полезных вычислений среди всех, с учётом дополнения до максимальной длины батча.
+    tokens - линейная часть (число позиций), attention - квадратичная (число пар позиций)
+    """
+    num_tokens = num_tokens_padded = 0
+    num_pairs = num_pairs_padded = 0
+    for batch in batches:
+        if not batch:
+            continue
+        max_len = max(lengths[i] for i in batch)
+        num_tokens += sum(lengths[i] for i in batch)
+        num_pairs += sum(lengths[i] ** 2 for i in batch)
+        num_tokens_padded += len(batch) * max_len
+        num_pairs_padded += len(batch) * max_len ** 2
+    cost = num_tokens + attention_coef * num_pairs
+    cost_padded = num_tokens_padded + attention_coef * num_pairs_padded
+    return {
+        "num_examples": sum(len(batch) for batch in batches),
+        "num_batches": sum(1 for batch in batches if batch),
+        "num_tokens": num_tokens,
+        "num_tokens_padded": num_tokens_padded,
+        "tokens_efficiency": num_tokens / max(num_tokens_padded, 1),
+        "attention_efficiency": num_pairs / max(num_pairs_padded, 1),
+        "cost_efficiency": cost / max(cost_padded, 1)
+    }
+
+
+def iter_batches(items: Iterable, batch_size: int) -> Iterator[List]:
+    """
+    нарезка потока на списки длины batch_size (последний может быть короче).
+    в памяти держится только текущий список
+    """
+    assert batch_size > 0
+    batch = []
+    for x in items:
+        batch.append(x)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_PREFETCH_END = object()
+
+
+def prefetch_gen(items: Iterable, maxsize: int = 2) -> Iterator:
+    """
+    элементы items, которые заранее вычисляются в фоновом потоке: пока потребитель обрабатывает текущий элемент,
+    в очереди готовятся следующие (не больше maxsize).
+    исключение в items пробрасывается потребителю на месте соответствующего элемента (с исходным traceback).
+    фоновый поток останавливается, когда генератор закрывается. после break генератор закрывается сам,
+    если на него больше нет ссылок; при исключении в теле цикла генератор жив, пока жив traceback,
+    поэтому потребитель должен закрыть его явно: with contextlib.closing(prefetch_gen(...)) as gen: ...
+    потоки, а не процессы: элементами могут быть feed_dict с плейсхолдерами tf, которые не сериализуются,
+    а sess.run и операции numpy отпускают GIL
+    :param items: итерируемый объект; вычисляется в фоновом потоке
+    :param maxsize: глубина очереди. 0 - без фонового потока, как обычная итерация по items
+    :return:
+    """
+    assert maxsize >= 0
+    if maxsize == 0:
+        yield from items
+        return
+
+    q = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for x in items:
+                if not put((x, None)):
+                    return
+        except BaseException:
+            put((None, sys.exc_info()[1]))
+            return
+        put((_PREFETCH_END, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            x, e = q.get()
+            if e is not None:
+                raise e
+            if x is _PREFETCH_END:
+                break
+            yield x
+    finally:
+        stop.set()
+        thread.join()
+
+
+class LRUCache:
+    """
+    словарь ограниченного размера: при переполнении выкидывается запись, к которой дольше всего не обращались
+    """
+    def __init__(self, maxsize: int = 100000):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def items(self) -> Iterator:
+        """
+        пары (ключ, значение) от самой старой записи к самой свежей
+        """
+        return iter(list(self._data.items()))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def get_tokenizer_hash(tokenizer) -> str:
+    """
+    хэш словаря (с учётом порядка, то есть id) и регистра.
+    у bert.tokenization.FullTokenizer словарь лежит в атрибуте vocab (OrderedDict: piece -> id)
+    """
+    h = hashlib.sha1()
+    basic_tokenizer = getattr(tokenizer, "basic_tokenizer", None)
+    h.update(f"do_lower_case={getattr(basic_tokenizer, 'do_lower_case', None)}\n".encode())
+    for piece, i in tokenizer.vocab.items():
+        h.update(f"{piece}\t{i}\n".encode())
+    return h.hexdigest()
 
 
 def get_filtered_by_length_chunks(
@@ -284,6 +772,90 @@ def get_filtered_by_length_chunks(
     return res
 
 
+def get_sent_pairs_to_predict_for(
+        end: int,
+        is_first: bool,
+        is_last: bool,
+        window: int,
+        stride: int = 1
+) -> List[Tuple[int, int]]:
+    """
+    Пары предложений (i, j), i <= j, в номерах относительно начала куска, предсказания для которых берутся из
+    данного куска. Куски документа начинаются с предложений 0, stride, 2 * stride, ... и содержат по window предложений
+    (последний кусок может быть короче). Пару покрывают несколько кусков; она достаётся тому,
+    чей центр ближе всего к середине пары; при равенстве - более позднему куску.
+    Если кусок первый (последний), то ему достаются и пары, которые отошли бы несуществующим кускам левее (правее).
+    При stride=1 и window in {1, 3, 5} результат совпадает с прежними фиксированными сетками (см. tests/test_utils.py).
+    Если window=None, то куски не перекрываются и имеют произвольное число предложений
+    (см. get_sentences_spans_by_budget): куску достаются все его пары.
+    :param end: номер последнего предложения куска относительно первого
+    :param is_first: кусок - первый в документе
+    :param is_last: кусок - последний в документе
+    :param window: число предложений в куске
+    :param stride: шаг между началами соседних кусков (в предложениях)
+    :return:
+    """
+    if window is None:
+        assert end >= 0, f"end: {end}"
+        return list(_get_sent_pairs_to_predict_for(end, True, True, end + 1, end + 1))
+    assert 0 <= end < window, f"end: {end}, window: {window}, is_first: {is_first}, is_last: {is_last}"
+    assert 1 <= stride <= window, f"stride: {stride}, window: {window}"
+    return list(_get_sent_pairs_to_predict_for(end, is_first, is_last, window, stride))
+
+
+def get_sent_ids_to_predict_for(
+        is_first: bool,
+        is_last: bool,
+        window: int,
+        stride: int = 1,
+        end: int = None
+) -> Set[int]:
+    """
+    Номера предложений (относительно начала куска), предсказания для которых берутся из данного куска.
+    То же правило, что и в get_sent_pairs_to_predict_for, применённое к парам (i, i).
+    :param end: номер последнего предложения куска относительно первого. обязателен при window=None
+    """
+    if window is None:
+        assert end is not None and end >= 0, f"end: {end}"
+        return set(range(end + 1))
+    assert 1 <= stride <= window, f"stride: {stride}, window: {window}"
+    return set(_get_sent_ids_to_predict_for(is_first, is_last, window, stride))
+
+
+@lru_cache(maxsize=None)
+def _get_sent_pairs_to_predict_for(end: int, is_first: bool, is_last: bool, window: int, stride: int) -> Tuple:
+    return tuple(
+        (i, j)
+        for i in range(end + 1)
+        for j in range(i, end + 1)
+        if _is_own_sent_pair(i, j, is_first, is_last, window, stride)
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_sent_ids_to_predict_for(is_first: bool, is_last: bool, window: int, stride: int) -> Tuple:
+    return tuple(i for i in range(window) if _is_own_sent_pair(i, i, is_first, is_last, window, stride))
+
+
+def _is_own_sent_pair(i: int, j: int, is_first: bool, is_last: bool, window: int, stride: int) -> bool:
+    # t - сдвиг куска относительно данного (в шагах stride). кусок t покрывает пару, если t * stride <= i
+    # и j <= t * stride + window - 1. сравниваем удвоенные координаты, чтоб не было дробей
+    t_min = -((window - 1 - j) // stride)
+    t_max = i // stride
+    if is_first:
+        t_min = max(t_min, 0)
+    if is_last:
+        t_max = min(t_max, 0)
+    best = None
+    best_dist = None
+    for t in range(t_min, t_max + 1):
+        dist = abs(i + j - 2 * t * stride - (window - 1))
+        if best_dist is None or dist <= best_dist:
+            best = t
+            best_dist = dist
+    return best == 0
+
+
 def log(func):
     """данный декоратор вешается только на методы классов!"""
     @wraps(func)
@@ -0,0 +1,112 @@
+import pickle
+import pytest
+from src.data.base import Token, TokenView, Entity, EntityView, Event, EventArgument, Arc, Example, Span
+
+
+def test_token_copy():
+    t = Token(text="мама", span_abs=Span(0, 4), pieces=["ма", "#ма"], token_ids=[1, 2])
+    t.label_ids = [0]
+    t_copy = t.copy
+    assert repr(t_copy) == repr(t)
+    assert t_copy.pieces == t.pieces and t_copy.pieces is not t.pieces
+    assert t_copy.label_ids == t.label_ids and t_copy.label_ids is not t.label_ids
+
+
+def test_example_copy():
+    x = Example(id="0", text="мама", tokens=[Token(text="мама")], entities=[Entity(id="T1")])
+    x_copy = x.copy
+    assert repr(x_copy) == repr(x)
+    assert x_copy.tokens is not x.tokens
+    assert x_copy.tokens[0] is x.tokens[0]
+
+
+def test_arc_copy():
+    arc = Arc(id="R1", head="T1", dep="T2", rel="FOO", head_index=0, dep_index=1)
+    arc_copy = arc.copy
+    assert repr(arc_copy) == repr(arc)
+    arc_copy.head_index = 5
+    assert arc.head_index == 0
+
+
+def test_event_copy():
+    event = Event(id="E1", trigger="T1", label="FOO", args=[EventArgument(id="T2", role="BAR")])
+    event_copy = event.copy
+    assert repr(event_copy) == repr(event)
+    assert event_copy.args == event.args and event_copy.args is not event.args
+
+
+def test_token_view():
+    t = Token(text="рама", span_abs=Span(10, 14), index_abs=3, pieces=["ра", "#ма"], token_ids=[1, 2], id_sent=1)
+    view = TokenView(t, offset=5, start=2)
+    assert view.text == "рама"
+    assert view.span_abs == Span(10, 14)
+    assert view.span_rel == Span(5, 9)
+    assert view.index_abs == 3
+    assert view.index_rel == 1
+    assert view.pieces is t.pieces
+    assert not hasattr(view, "label_ids")
+
+    # атрибуты уровня документа пишутся в токен документа
+    view.pieces = ["рама"]
+    assert t.pieces == ["рама"]
+
+    # атрибуты уровня куска - в само представление
+    view.label_ids = [7]
+    assert not hasattr(t, "label_ids")
+    t.label = "B-FOO"
+    assert view.label == "B-FOO"
+    view.reset()
+    assert (view.label, t.label) == (None, "B-FOO")
+
+    with pytest.raises(AttributeError):
+        view.index_rel = 0
+
+    t_copy = view.copy
+    assert isinstance(t_copy, Token)
+    assert (t_copy.span_rel, t_copy.index_rel, t_copy.pieces, t_copy.label_ids) == (Span(5, 9), 1, t.pieces, [7])
+    assert t_copy.label is None
+    assert t_copy.pieces is not t.pieces
+
+    # токен, общий для нескольких представлений, после pickle остаётся общим
+    views = pickle.loads(pickle.dumps([view, TokenView(t, offset=10, start=3)]))
+    assert views[0].token is views[1].token
+    assert (views[0].index_rel, views[1].index_rel) == (1, 0)
+
+
+def test_token_view_overlapping():
+    t = Token(text="рама", span_abs=Span(10, 14), index_abs=3)
+    view_1 = TokenView(t, offset=0, start=0)
+    view_2 = TokenView(t, offset=5, start=2)
+    view_1.id_head, view_1.rel = 0, "nsubj"
+    view_1.label_ids = [1]
+    assert (view_2.id_head, view_2.rel) == (None, None)
+    assert not hasattr(view_2, "label_ids")
+    view_2.label_ids = [2]
+    assert (view_1.label_ids, view_2.label_ids) == ([1], [2])
+
+
+def test_entity_view():
+    tokens = [Token(text="рама", span_abs=Span(10, 14), index_abs=3)]
+    entity = Entity(id="T1", label="FOO", tokens=tokens, attrs=[], index=5, id_chain=1)
+    view_1 = EntityView(entity, tokens=[TokenView(tokens[0], offset=0, start=0)])
+    view_2 = EntityView(entity, tokens=[TokenView(tokens[0], offset=5, start=2)])
+    assert (view_1.id, view_1.label, view_1.attrs) == ("T1", "FOO", entity.attrs)
+    assert (view_1.index, view_1.id_chain) == (5, 1)
+    assert view_2.tokens[0].index_rel == 1
+
+    # индексы и цепочки у каждого куска свои
+    view_1.index, view_1.id_chain = 0, None
+    view_2.index = 1
+    assert (view_1.index, view_2.index, entity.index) == (0, 1, 5)
+    assert (view_1.id_chain, view_2.id_chain, entity.id_chain) == (None, 1, 1)
+
+
+@pytest.mark.parametrize("obj", [
+    Token(), TokenView(Token(), offset=0, start=0), Entity(), EntityView(Entity(), tokens=[]), Arc(id="R1", head="T1", dep="T2", rel="FOO"), Example()
+])
+def test_slots(obj):
+    assert not hasattr(obj, "__dict__")
+    with pytest.raises(AttributeError):
+        obj.foo = 1
+    obj_new = pickle.loads(pickle.dumps(obj))
+    assert repr(obj_new) == repr(obj)
@@ -0,0 +1,121 @@
+import os
+import pytest
+from src.data.cache import load_or_build_corpus
+from src.data.exceptions import BadLineError
+
+
+DOCS = {
+    "doc_0": (
+        "Мама мыла раму. Компания ООО Ромашка обанкротилась.",
+        "T1\tPER 0 4\tМама\nT2\tORG 25 36\tООО Ромашка\nR1\tFOO Arg1:T1 Arg2:T2\n"
+    ),
+    "doc_1": (
+        "Иван купил машину. Петя спит.",
+        "T1\tPER 0 4\tИван\n"
+    ),
+}
+
+
+class Tokenizer:
+    """
+    каждый символ - отдельный кусок
+    """
+    def __init__(self, chars="абв"):
+        self.vocab = {c: i for i, c in enumerate(chars)}
+
+    @staticmethod
+    def tokenize(text):
+        return list(text)
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.get(x, -1) for x in tokens]
+
+
+def _write(data_dir, name, text, ann):
+    with open(os.path.join(data_dir, f"{name}.txt"), "w") as f:
+        f.write(text)
+    with open(os.path.join(data_dir, f"{name}.ann"), "w") as f:
+        f.write(ann)
+
+
+def _to_tuple(x):
+    return (
+        x.id,
+        [(t.text, t.span_abs) for t in x.tokens],
+        [
+            (
+                chunk.id,
+                chunk.text,
+                [(t.text, t.span_rel, t.index_rel, t.pieces, t.token_ids) for t in chunk.tokens],
+                [(e.id, e.index, [t.index_rel for t in e.tokens]) for e in chunk.entities],
+                [(a.id, a.head_index, a.dep_index) for a in chunk.arcs]
+            )
+            for chunk in x.chunks
+        ]
+    )
+
+
+@pytest.fixture
+def brat_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for name, (text, ann) in DOCS.items():
+        _write(data_dir, name, text, ann)
+    return str(data_dir)
+
+
+def test_load_or_build_corpus(brat_dir, tmp_path, capsys):
+    cache_path = str(tmp_path / "corpus.pkl")
+    kwargs = dict(data_dir=brat_dir, cache_path=cache_path, tokenizer=Tokenizer(), window=1, stride=1)
+
+    expected = load_or_build_corpus(**kwargs)
+    assert "num documents to build: 2" in capsys.readouterr().out
+    assert [x.id for x in expected] == ["doc_0", "doc_1"]
+    assert len(expected[0].chunks) == 2
+    assert expected[0].chunks[1].tokens[0].pieces == list("Компания")
+
+    # повторный запуск - всё из кэша
+    actual = load_or_build_corpus(**kwargs)
+    assert "num documents to build: 0" in capsys.readouterr().out
+    assert [_to_tuple(x) for x in actual] == [_to_tuple(x) for x in expected]
+
+    # изменился один документ - пересчитывается только он
+    _write(brat_dir, "doc_1", "Иван спит.", "T1\tPER 0 4\tИван\n")
+    actual = load_or_build_corpus(**kwargs)
+    assert "num documents to build: 1" in capsys.readouterr().out
+    assert _to_tuple(actual[0]) == _to_tuple(expected[0])
+    assert actual[1].text == "Иван спит."
+    assert len(actual[1].chunks) == 1
+
+    # удалённый документ пропадает из выдачи
+    os.remove(os.path.join(brat_dir, "doc_0.ann"))
+    actual = load_or_build_corpus(**kwargs)
+    assert "num documents to build: 0" in capsys.readouterr().out
+    assert [x.id for x in actual] == ["doc_1"]
+
+
+@pytest.mark.parametrize("kwargs_new", [
+    pytest.param(dict(window=2), id="window"),
+    pytest.param(dict(window=2, stride=2), id="stride"),
+    pytest.param(dict(tokens_pattern=r"\w+"), id="tokens_pattern"),
+    pytest.param(dict(tokenizer=Tokenizer(chars="абг")), id="vocab"),
+])
+def test_load_or_build_corpus_key_changed(brat_dir, tmp_path, capsys, kwargs_new):
+    cache_path = str(tmp_path / "corpus.pkl")
+    kwargs = dict(data_dir=brat_dir, cache_path=cache_path, tokenizer=Tokenizer(), window=1, stride=1)
+    load_or_build_corpus(**kwargs)
+    capsys.readouterr()
+    kwargs.update(kwargs_new)
+    load_or_build_corpus(**kwargs)
+    assert "num documents to build: 2" in capsys.readouterr().out
+
+
+def test_load_or_build_corpus_ignore_bad_examples(brat_dir, tmp_path, capsys):
+    _write(brat_dir, "doc_2", "Плохой документ.", "T1\tPER 0 6\tПлохой\nA1\tFoo\n")
+    cache_path = str(tmp_path / "corpus.pkl")
+    kwargs = dict(data_dir=brat_dir, cache_path=cache_path, tokenizer=Tokenizer(), window=1, stride=1)
+    examples = load_or_build_corpus(ignore_bad_examples=True, **kwargs)
+    assert [x.id for x in examples] == ["doc_0", "doc_1"]
+    # нераспаршенный документ закэширован в нестрогом режиме, но в строгом режиме на нём по-прежнему падаем
+    with pytest.raises(BadLineError):
+        load_or_build_corpus(ignore_bad_examples=False, **kwargs)
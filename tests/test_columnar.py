@@ -0,0 +1,150 @@
+import os
+import pytest
+import numpy as np
+
+from src.data.io import parse_collection
+from src.data.preprocessing import preprocess_example
+from src.data.columnar import write_columnar, ColumnarCorpus
+from src.utils import batches_gen, BatchingPolicies
+
+
+DOCS = {
+    "doc_0": (
+        "Мама мыла раму. Компания ООО Ромашка обанкротилась.",
+        "T1\tPER 0 4\tМама\nT2\tORG 25 36\tООО Ромашка\nT3\tORG 16 24\tКомпания\n"
+        "R1\tFOO Arg1:T3 Arg2:T2\n"
+    ),
+    "doc_1": (
+        "Иван купил машину. Петя спит. Иван спит.",
+        "T1\tPER 0 4\tИван\nT2\tPER 30 34\tИван\nR1\tBAR Arg1:T2 Arg2:T1\n"
+    ),
+    "doc_2": (
+        "Ничего нет.",
+        ""
+    ),
+}
+
+CLS, SEP, PAD = 101, 102, 0
+
+
+class Tokenizer:
+    vocab = {}
+
+    @staticmethod
+    def tokenize(text):
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    @staticmethod
+    def convert_tokens_to_ids(tokens):
+        return [sum(map(ord, x)) % 1000 + 1 for x in tokens]
+
+
+@pytest.fixture
+def chunks(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for name, (text, ann) in DOCS.items():
+        with open(os.path.join(data_dir, f"{name}.txt"), "w") as f:
+            f.write(text)
+        with open(os.path.join(data_dir, f"{name}.ann"), "w") as f:
+            f.write(ann)
+    examples = parse_collection(str(data_dir))
+    res = []
+    for x in examples:
+        preprocess_example(x, tokenizer=Tokenizer, window=2, stride=1)
+        res += x.chunks
+    return res
+
+
+def _get_bert_inputs_expected(examples):
+    """
+    копия логики BaseModelBert._get_bert_input_for_feed_dict
+    """
+    input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces = [], [], [], [], []
+    for i, x in enumerate(examples):
+        input_ids_i = [CLS]
+        first_pieces_coords_i = []
+        for t in x.tokens:
+            first_pieces_coords_i.append((i, len(input_ids_i)))
+            input_ids_i += t.token_ids
+        input_ids_i.append(SEP)
+        input_ids.append(input_ids_i)
+        input_mask.append([1] * len(input_ids_i))
+        first_pieces_coords.append(first_pieces_coords_i)
+        num_tokens.append(len(x.tokens))
+        num_pieces.append(len(input_ids_i))
+    for i in range(len(examples)):
+        input_ids[i] += [PAD] * (max(num_pieces) - num_pieces[i])
+        input_mask[i] += [0] * (max(num_pieces) - num_pieces[i])
+        first_pieces_coords[i] += [(i, 0)] * (max(num_tokens) - num_tokens[i])
+    return input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_columnar(chunks, tmp_path, mmap):
+    path = str(tmp_path / "corpus")
+    write_columnar(chunks, path)
+    corpus = ColumnarCorpus(path, mmap=mmap)
+    assert len(corpus) == len(chunks)
+    assert corpus.ids == [x.id for x in chunks]
+
+    ner_enc = {"O": 0, "PER": 1, "ORG": 2}
+    re_enc = {"O": 0, "FOO": 1, "BAR": 2}
+
+    for indices in [[0], [1, 0], list(range(len(chunks))), [len(chunks) - 1, 2]]:
+        examples = [chunks[i] for i in indices]
+
+        bert_inputs = corpus.get_bert_inputs(indices, cls_token_id=CLS, sep_token_id=SEP, pad_token_id=PAD)
+        input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces = _get_bert_inputs_expected(examples)
+        assert bert_inputs.input_ids.tolist() == input_ids
+        assert bert_inputs.input_mask.tolist() == input_mask
+        assert bert_inputs.segment_ids.tolist() == np.zeros_like(input_ids).tolist()
+        assert bert_inputs.first_pieces_coords.tolist() == [[list(c) for c in x] for x in first_pieces_coords]
+        assert bert_inputs.num_tokens.tolist() == num_tokens
+        assert bert_inputs.num_pieces.tolist() == num_pieces
+
+        ner_labels = []
+        mention_spans = []
+        re_labels = []
+        coref_labels = []
+        for i, x in enumerate(examples):
+            for entity in x.entities:
+                start, end = entity.tokens[0].index_rel, entity.tokens[-1].index_rel
+                ner_labels.append([i, start, end, ner_enc[entity.label]])
+                mention_spans.append([i, start, end])
+            for arc in x.arcs:
+                re_labels.append([i, arc.head_index, arc.dep_index, re_enc[arc.rel]])
+            id2entity = {entity.id: entity for entity in x.entities}
+            head2dep = {arc.head: id2entity[arc.dep] for arc in x.arcs}
+            for entity in x.entities:
+                dep_index = head2dep[entity.id].index + 1 if entity.id in head2dep else 0
+                coref_labels.append([i, entity.index, dep_index])
+        assert corpus.get_ner_labels(indices, ner_enc).tolist() == (ner_labels or [[0, 0, 0, 0]])
+        assert corpus.get_mention_spans(indices).tolist() == (mention_spans or [[0, 0, 0]])
+        assert corpus.get_re_labels(indices, re_enc).tolist() == (re_labels or [[0, 0, 0, 0]])
+        assert corpus.get_coref_labels(indices).tolist() == (coref_labels or [[0, 0, 0]])
+
+
+@pytest.mark.parametrize("max_tokens_per_batch, pieces_level", [
+    (10, False),
+    (20, True),
+    (1000, False),
+])
+@pytest.mark.parametrize("policy", [BatchingPolicies.GREEDY, BatchingPolicies.MIN_COST])
+def test_columnar_batches_gen(chunks, tmp_path, max_tokens_per_batch, pieces_level, policy):
+    path = str(tmp_path / "corpus")
+    write_columnar(chunks, path)
+    corpus = ColumnarCorpus(path)
+    expected = [
+        [x.id for x in batch]
+        for batch in batches_gen(
+            chunks, max_tokens_per_batch=max_tokens_per_batch, pieces_level=pieces_level, policy=policy
+        )
+    ]
+    actual = [
+        [corpus.ids[i] for i in batch]
+        for batch in corpus.batches_gen(
+            max_tokens_per_batch=max_tokens_per_batch, pieces_level=pieces_level, policy=policy
+        )
+    ]
+    assert actual == expected
@@ -0,0 +1,220 @@
+import random
+import pytest
+import numpy as np
+
+from src.data.base import Example, Token, BertInputs
+from src.model.inputs import pack_sequences, get_bert_inputs, get_chunk_pieces, clear_chunk_pieces_cache
+
+
+CLS, SEP, PAD, ROOT = 101, 102, 0, 103
+
+
+def _get_examples(rng, n):
+    examples = []
+    for i in range(n):
+        tokens = [
+            Token(text=f"t{j}", token_ids=[rng.randint(1000, 2000) for _ in range(rng.randint(1, 3))])
+            for j in range(rng.randint(1, 20))
+        ]
+        examples.append(Example(id=f"chunk_{i}", tokens=tokens))
+    return examples
+
+
+def _get_bert_inputs_expected(examples, root_token_id=None):
+    """
+    копия старой логики BaseModelBert._get_bert_input_for_feed_dict (и DependencyParserBert._get_feed_dict)
+    """
+    input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces = [], [], [], [], []
+    for i, x in enumerate(examples):
+        input_ids_i = [CLS]
+        first_pieces_coords_i = []
+        if root_token_id is not None:
+            first_pieces_coords_i.append((i, 1))
+            input_ids_i.append(root_token_id)
+        for t in x.tokens:
+            first_pieces_coords_i.append((i, len(input_ids_i)))
+            input_ids_i += t.token_ids
+        input_ids_i.append(SEP)
+        input_ids.append(input_ids_i)
+        input_mask.append([1] * len(input_ids_i))
+        first_pieces_coords.append(first_pieces_coords_i)
+        num_tokens.append(len(x.tokens))
+        num_pieces.append(len(input_ids_i))
+    for i in range(len(examples)):
+        input_ids[i] += [PAD] * (max(num_pieces) - num_pieces[i])
+        input_mask[i] += [0] * (max(num_pieces) - num_pieces[i])
+        first_pieces_coords[i] += [(i, 0)] * (max(num_tokens) - num_tokens[i])
+    return input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces
+
+
+def _get_bert_inputs_lists_expected(
+        examples, cls_token_id, sep_token_id, pad_token_id=0, root_token_id=None, packing_maxlen=None
+):
+    """
+    копия прежней реализации get_bert_inputs с упаковкой: вложенные списки
+    """
+    segments = []  # bpe-кусочки куска со спец. токенами
+    segments_coords = []  # позиции первых кусочков токенов внутри сегмента
+    num_tokens = []
+    for x in examples:
+        segment = [cls_token_id]
+        coords = []
+        if root_token_id is not None:
+            coords.append(len(segment))
+            segment.append(root_token_id)
+        for t in x.tokens:
+            n = len(t.token_ids)
+            assert n != 0, f"[{x.id}] token {t} could not be split by pieces! " \
+                f"unicode code points: {[ord(c) for c in t.text]}"
+            coords.append(len(segment))
+            segment += t.token_ids
+        segment.append(sep_token_id)
+        segments.append(segment)
+        segments_coords.append(coords)
+        num_tokens.append(len(x.tokens))
+    num_pieces = [len(segment) for segment in segments]
+
+    if packing_maxlen is None:
+        rows = [[i] for i in range(len(examples))]
+    else:
+        rows = pack_sequences(num_pieces, maxlen=packing_maxlen)
+
+    input_ids = []
+    input_mask = []
+    first_pieces_coords = [None] * len(examples)
+    pad_coords = [None] * len(examples)
+    for id_row, row in enumerate(rows):
+        input_ids_row = []
+        input_mask_row = []
+        for id_segment, i in enumerate(row):
+            offset = len(input_ids_row)
+            first_pieces_coords[i] = [(id_row, offset + j) for j in segments_coords[i]]
+            pad_coords[i] = (id_row, offset)
+            input_ids_row += segments[i]
+            input_mask_row += [id_segment + 1] * num_pieces[i]
+        input_ids.append(input_ids_row)
+        input_mask.append(input_mask_row)
+
+    # padding
+    num_pieces_max = max(len(x) for x in input_ids)
+    num_coords_max = max(len(x) for x in first_pieces_coords)
+    segment_ids = []
+    for k in range(len(rows)):
+        n = num_pieces_max - len(input_ids[k])
+        input_ids[k] += [pad_token_id] * n
+        input_mask[k] += [0] * n
+        segment_ids.append([0] * num_pieces_max)
+    for i in range(len(examples)):
+        first_pieces_coords[i] += [pad_coords[i]] * (num_coords_max - len(first_pieces_coords[i]))
+
+    return BertInputs(
+        input_ids=input_ids,
+        input_mask=input_mask,
+        segment_ids=segment_ids,
+        first_pieces_coords=first_pieces_coords,
+        num_tokens=num_tokens,
+        num_pieces=num_pieces
+    )
+
+
+@pytest.mark.parametrize("lengths, maxlen, expected", [
+    ([], 10, []),
+    ([5, 5, 5], 10, [[0, 1], [2]]),
+    ([3, 8, 2, 7], 10, [[1, 2], [3, 0]]),
+    ([12, 4], 10, [[0], [1]]),  # длиннее maxlen - отдельная строка
+])
+def test_pack_sequences(lengths, maxlen, expected):
+    assert pack_sequences(lengths, maxlen=maxlen) == expected
+
+
+@pytest.mark.parametrize("root_token_id", [None, ROOT])
+def test_get_bert_inputs_unpacked(root_token_id):
+    examples = _get_examples(random.Random(228), 10)
+    bert_inputs = get_bert_inputs(
+        examples, cls_token_id=CLS, sep_token_id=SEP, pad_token_id=PAD, root_token_id=root_token_id
+    )
+    input_ids, input_mask, first_pieces_coords, num_tokens, num_pieces = _get_bert_inputs_expected(
+        examples, root_token_id=root_token_id
+    )
+    assert bert_inputs.input_ids.tolist() == input_ids
+    assert bert_inputs.input_mask.tolist() == input_mask
+    assert bert_inputs.segment_ids.tolist() == [[0] * len(x) for x in input_ids]
+    assert bert_inputs.first_pieces_coords.tolist() == [[list(c) for c in x] for x in first_pieces_coords]
+    assert bert_inputs.num_tokens.tolist() == num_tokens
+    assert bert_inputs.num_pieces.tolist() == num_pieces
+
+
+@pytest.mark.parametrize("root_token_id", [None, ROOT])
+@pytest.mark.parametrize("packing_maxlen", [16, 32, 128])
+def test_get_bert_inputs_packed(root_token_id, packing_maxlen):
+    examples = _get_examples(random.Random(1337), 20)
+    kwargs = dict(cls_token_id=CLS, sep_token_id=SEP, pad_token_id=PAD, root_token_id=root_token_id)
+    expected = get_bert_inputs(examples, **kwargs)
+    actual = get_bert_inputs(examples, packing_maxlen=packing_maxlen, **kwargs)
+
+    assert len(actual.input_ids) <= len(examples)
+    assert actual.num_tokens.tolist() == expected.num_tokens.tolist()
+    assert actual.num_pieces.tolist() == expected.num_pieces.tolist()
+    assert len(actual.first_pieces_coords) == len(examples)
+
+    # координаты упакованного входа указывают на те же кусочки
+    for i in range(len(examples)):
+        for (row, pos), (row_expected, pos_expected) in zip(
+                actual.first_pieces_coords[i], expected.first_pieces_coords[i]
+        ):
+            assert actual.input_ids[row][pos] == expected.input_ids[row_expected][pos_expected]
+
+    # сегменты: непрерывные, с [CLS] в начале и [SEP] в конце, нумерация с 1 без пропусков
+    num_segments = 0
+    for input_ids, input_mask in zip(actual.input_ids.tolist(), actual.input_mask.tolist()):
+        num_pieces_row = sum(m > 0 for m in input_mask)
+        assert all(m == 0 for m in input_mask[num_pieces_row:])
+        assert all(t == PAD for t in input_ids[num_pieces_row:])
+        segments = input_mask[:num_pieces_row]
+        assert segments == sorted(segments)
+        assert set(segments) == set(range(1, max(segments) + 1))
+        assert num_pieces_row <= packing_maxlen or max(segments) == 1
+        for pos, m in enumerate(segments):
+            if pos == 0 or segments[pos - 1] != m:
+                assert input_ids[pos] == CLS
+            if pos == num_pieces_row - 1 or segments[pos + 1] != m:
+                assert input_ids[pos] == SEP
+        num_segments += max(segments)
+    assert num_segments == len(examples)
+
+
+@pytest.mark.parametrize("root_token_id", [None, ROOT])
+@pytest.mark.parametrize("packing_maxlen", [None, 16, 64])
+def test_get_bert_inputs_lists(root_token_id, packing_maxlen):
+    examples = _get_examples(random.Random(42), 30)
+    kwargs = dict(
+        cls_token_id=CLS, sep_token_id=SEP, pad_token_id=PAD, root_token_id=root_token_id, packing_maxlen=packing_maxlen
+    )
+    expected = _get_bert_inputs_lists_expected(examples, **kwargs)
+    for _ in range(2):  # второй раз - с кэшем кусочков
+        actual = get_bert_inputs(examples, **kwargs)
+        for field in actual._fields:
+            assert getattr(actual, field).dtype == np.int32
+            assert np.asarray(getattr(expected, field)).tolist() == getattr(actual, field).tolist(), field
+
+
+def test_get_chunk_pieces_stale():
+    x = Example(id="0", tokens=[Token(text="a", token_ids=[1, 2]), Token(text="b", token_ids=[3])])
+    assert [v.tolist() for v in get_chunk_pieces(x)] == [[1, 2, 3], [0, 2]]
+    assert get_chunk_pieces(x)[0] is get_chunk_pieces(x)[0]
+
+    # bpe-кусочки токена заменены
+    x.tokens[-1].token_ids = [4, 5]
+    assert [v.tolist() for v in get_chunk_pieces(x)] == [[1, 2, 4, 5], [0, 2]]
+
+    # токены заменены
+    x.tokens = x.tokens[:1]
+    assert [v.tolist() for v in get_chunk_pieces(x)] == [[1, 2], [0]]
+
+    # замену кусочков только в середине куска проверка не ловит (см. src.utils.get_tokens_refs)
+    x.tokens = [Token(text="a", token_ids=[1]), Token(text="b", token_ids=[2]), Token(text="c", token_ids=[3])]
+    get_chunk_pieces(x)
+    x.tokens[1].token_ids = [7]
+    assert get_chunk_pieces(x)[0].tolist() == [1, 2, 3]
+    clear_chunk_pieces_cache()
+    assert get_chunk_pieces(x)[0].tolist() == [1, 7, 3]
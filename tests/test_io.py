@@ -0,0 +1,325 @@
+import os
+import random
+import unicodedata
+from collections import defaultdict
+import pytest
+from src.data.io import (
+    parse_collection,
+    iter_collection,
+    get_invalid_char_indices,
+    fix_entity_span,
+    remove_bad_ids,
+    get_tokens_in_span,
+    to_brat,
+    to_brat_v2,
+    from_conllu,
+    iter_conllu
+)
+from src.data.base import Token, Span, Entity, Event, EventArgument, Arc, Example, TOKENS_EXPRESSION
+from src.data.exceptions import BadLineError
+
+
+DOCS = {
+    "doc_0": (
+        "Мама мыла раму. Компания ООО Ромашка обанкротилась.",
+        "T1\tPER 0 4\tМама\nT2\tORG 25 36\tООО Ромашка\nR1\tFOO Arg1:T1 Arg2:T2\n"
+    ),
+    "doc_1": (
+        "Иван купил машину.",
+        "T1\tPER 0 4\tИван\n"
+    ),
+    # сломанная строка .ann
+    "doc_2": (
+        "Петя спит.",
+        "T1\tPER 0 4\n"
+    ),
+    "doc_3": (
+        "Завод закрыли в 2020 году.",
+        "T1\tORG 0 5\tЗавод\nE1\tClose:T1\n"
+    ),
+}
+
+
+@pytest.fixture
+def brat_dir(tmp_path):
+    for name, (text, ann) in DOCS.items():
+        with open(os.path.join(tmp_path, f"{name}.txt"), "w") as f:
+            f.write(text)
+        with open(os.path.join(tmp_path, f"{name}.ann"), "w") as f:
+            f.write(ann)
+    return str(tmp_path)
+
+
+def _to_tuple(x):
+    return (
+        x.id,
+        x.text,
+        [(t.text, t.span_abs, t.index_abs) for t in x.tokens],
+        [(e.id, e.label, e.text, [t.index_abs for t in e.tokens]) for e in x.entities],
+        [(a.id, a.head, a.dep, a.rel) for a in x.arcs],
+        [(e.id, e.trigger, e.label) for e in x.events]
+    )
+
+
+@pytest.mark.parametrize("num_workers", [None, 1, 2, 3])
+def test_parse_collection_num_workers(brat_dir, num_workers):
+    expected = parse_collection(brat_dir, ignore_bad_examples=True)
+    actual = parse_collection(brat_dir, ignore_bad_examples=True, num_workers=num_workers)
+    assert [x.id for x in actual] == ["doc_0", "doc_1", "doc_3"]
+    assert [_to_tuple(x) for x in actual] == [_to_tuple(x) for x in expected]
+
+
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_parse_collection_bad_example(brat_dir, num_workers):
+    with pytest.raises(BadLineError):
+        parse_collection(brat_dir, ignore_bad_examples=False, num_workers=num_workers)
+
+
+@pytest.mark.parametrize("num_workers, buffer_size", [
+    (None, None),
+    (2, None),
+    (2, 1),
+    (3, 2),
+])
+def test_iter_collection(brat_dir, num_workers, buffer_size):
+    expected = parse_collection(brat_dir, ignore_bad_examples=True)
+    error_counts = {"BadLineError": 0}
+    gen = iter_collection(
+        brat_dir, ignore_bad_examples=True, num_workers=num_workers, buffer_size=buffer_size, error_counts=error_counts
+    )
+    first = next(gen)
+    assert first.id == "doc_0"
+    actual = [first] + list(gen)
+    assert [_to_tuple(x) for x in actual] == [_to_tuple(x) for x in expected]
+    assert error_counts == {"BadLineError": 1}
+
+
+# очистка текста от "плохих" символов
+
+
+def _fix_entity_span_expected(span, bad_ids):
+    """
+    исходная реализация: цикл по всем bad_ids
+    """
+    start, end = span
+    start_new = start
+    end_new = end
+    bad_ids_entity = []
+    for i in bad_ids:
+        if i <= start:
+            start_new -= 1
+            end_new -= 1
+            if i == start:
+                bad_ids_entity.append(0)
+        elif start < i < end:
+            end_new -= 1
+            bad_ids_entity.append(i - start)
+    return start_new, end_new, bad_ids_entity
+
+
+def _get_invalid_char_indices_expected(text):
+    """
+    копия прежней реализации get_invalid_char_indices: проверка каждого символа
+    """
+    res = []
+    for i, char in enumerate(text):
+        cp = ord(char)
+        if cp == 0 or cp == 0xfffd or (char not in "\t\n\r" and unicodedata.category(char).startswith("C")):
+            res.append(i)
+    return res
+
+
+def test_get_invalid_char_indices():
+    rng = random.Random(228)
+    special = [0, 0xfffd, 0x200b, 0xd800, 0x7, 0x9, 0xa, 0xd, 0x85, 0x1f600, 0xe0001, 0x10ffff]
+    for _ in range(1000):
+        text = "".join(
+            chr(rng.choice([rng.randint(0, 0x10ffff), rng.randint(0, 0x500), rng.choice(special)]))
+            for _ in range(rng.randint(0, 50))
+        )
+        assert get_invalid_char_indices(text) == _get_invalid_char_indices_expected(text)
+
+
+def test_fix_entity_span():
+    rng = random.Random(228)
+    for _ in range(1000):
+        n = rng.randint(0, 30)
+        bad_ids = sorted(rng.sample(range(n), rng.randint(0, n)))
+        start = rng.randint(0, n)
+        end = rng.randint(start, n)
+        assert fix_entity_span((start, end), bad_ids) == _fix_entity_span_expected((start, end), bad_ids)
+
+
+def test_remove_bad_ids():
+    text = "a\x07bc​\x00d"
+    bad_ids = get_invalid_char_indices(text)
+    assert bad_ids == [1, 4, 5]
+    assert remove_bad_ids(text, bad_ids) == "abcd"
+    assert remove_bad_ids(text, []) == text
+
+
+def test_parse_collection_bad_chars(tmp_path):
+    text = "Мама\x07 мыла ​раму. ООО\x00 Ромашка."
+    ann = "T1\tPER 0 5\tМама\x07\nT2\tORG 18 30\tООО\x00 Ромашка\n"
+    with open(os.path.join(tmp_path, "doc.txt"), "w") as f:
+        f.write(text)
+    with open(os.path.join(tmp_path, "doc.ann"), "w") as f:
+        f.write(ann)
+    x = parse_collection(str(tmp_path))[0]
+    assert x.text == "Мама мыла раму. ООО Ромашка."
+    assert [(e.span, e.text, [t.text for t in e.tokens]) for e in x.entities] == [
+        ((0, 4), "Мама", ["Мама"]),
+        ((16, 27), "ООО Ромашка", ["ООО", "Ромашка"]),
+    ]
+
+
+def test_get_tokens_in_span():
+    text = "Мама мыла раму, а Иван - нет."
+    tokens = [Token(text=m.group(), span_abs=Span(*m.span())) for m in TOKENS_EXPRESSION.finditer(text)]
+    token_starts = [t.span_abs.start for t in tokens]
+    start2token = {t.span_abs.start: t for t in tokens}
+    for start in range(len(text) + 1):
+        for end in range(len(text) + 1):
+            expected = [start2token[i] for i in range(start, end) if i in start2token]
+            assert get_tokens_in_span(tokens, token_starts, start, end) == expected
+
+
+# to_brat
+
+
+def _to_brat_expected(examples, output_dir, write_mode, with_events):
+    """
+    исходная реализация: файлы открываются на каждый пример
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    event_counter = defaultdict(int)
+    for x in examples:
+        with open(os.path.join(output_dir, f"{x.filename}.txt"), write_mode) as f:
+            f.write(x.text)
+        with open(os.path.join(output_dir, f"{x.filename}.ann"), write_mode) as f:
+            events = {}
+            for entity in x.entities:
+                start = entity.tokens[0].span_abs.start
+                end = entity.tokens[-1].span_abs.end
+                f.write(f"{entity.id}\t{entity.label} {start} {end}\t{entity.text}\n")
+                if with_events and entity.is_event_trigger and entity.id not in events:
+                    events[entity.id] = Event(id=event_counter[x.filename], trigger=entity.id, label=entity.label)
+                    event_counter[x.filename] += 1
+            for arc in x.arcs:
+                if arc.head in events:
+                    events[arc.head].args.append(EventArgument(id=arc.dep, role=arc.rel))
+                else:
+                    f.write(f"{arc.id}\t{arc.rel} Arg1:{arc.head} Arg2:{arc.dep}\n")
+            for event in events.values():
+                role2count = defaultdict(int)
+                args = []
+                for arg in event.args:
+                    i = role2count[arg.role]
+                    args.append(f"{arg.role}{i + 1 if i > 0 else ''}:{arg.id}")
+                    role2count[arg.role] += 1
+                f.write(" ".join([f"E{event.id}\t{event.label}:{event.trigger}"] + args) + "\n")
+
+
+def _get_brat_examples():
+    def example(filename, text, trigger=False):
+        tokens = [Token(text=m.group(), span_abs=Span(*m.span())) for m in TOKENS_EXPRESSION.finditer(text)]
+        entities = [
+            Entity(id="T1", label="PER", text=tokens[0].text, tokens=tokens[:1]),
+            Entity(id="T2", label="Bankruptcy", text=tokens[1].text, tokens=tokens[1:2], is_event_trigger=trigger),
+        ]
+        arcs = [
+            Arc(id="R1", head="T2", dep="T1", rel="Bankrupt"),
+            Arc(id="R2", head="T2", dep="T1", rel="Bankrupt"),
+            Arc(id="R3", head="T1", dep="T2", rel="FOO"),
+        ]
+        return Example(filename=filename, id=filename, text=text, tokens=tokens, entities=entities, arcs=arcs)
+
+    return [
+        example("a", "Иван обанкротился.", trigger=True),
+        example("a", "Петя обанкротился.", trigger=True),
+        example("b", "Мама мыла раму."),
+        example("a", "Вася обанкротился.", trigger=True),
+        example("c", "Вася спит."),
+        example("c", "Петя спит.", trigger=True),
+    ]
+
+
+def _read_dir(path):
+    res = {}
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name)) as f:
+            res[name] = f.read()
+    return res
+
+
+@pytest.mark.parametrize("write_mode", ["a", "w"])
+@pytest.mark.parametrize("num_workers", [None, 2])
+def test_to_brat(tmp_path, write_mode, num_workers):
+    examples = _get_brat_examples()
+    for with_events in [True, False]:
+        if not with_events and write_mode == "a":
+            continue
+        expected_dir = str(tmp_path / f"expected_{with_events}")
+        actual_dir = str(tmp_path / f"actual_{with_events}")
+        # для проверки режима "a" в папках уже что-то лежит
+        for d in [expected_dir, actual_dir]:
+            os.makedirs(d)
+            with open(os.path.join(d, "a.txt"), "w") as f:
+                f.write("старое содержимое. ")
+        _to_brat_expected(examples, expected_dir, write_mode=write_mode, with_events=with_events)
+        if with_events:
+            to_brat(iter(examples), actual_dir, write_mode=write_mode, num_workers=num_workers)
+        else:
+            to_brat_v2(iter(examples), actual_dir, num_workers=num_workers)
+        assert _read_dir(actual_dir) == _read_dir(expected_dir)
+
+
+CONLLU = """# sent_id = a.xml_1
+# text = Мама мыла раму.
+1\tМама\tмама\tNOUN\t_\t_\t2\tnsubj\t_\t_
+2\tмыла\tмыть\tVERB\t_\t_\t0\troot\t_\t_
+3\tраму\tрама\tNOUN\t_\t_\t2\tobj\t_\t_
+4\t.\t.\tPUNCT\t_\t_\t2\tpunct\t_\t_
+
+# sent_id = a.xml_2
+# text = Странное предложение
+1\tСтранное\tстранный\tADJ\t_\t_\t2\tamod\t_\t_
+1.1\tпредложение\tпредложение\tNOUN\t_\t_\t_\t_\t_\t_
+
+# sent_id = b.xml_1
+# text = Иван спит
+1\tИван\tиван\tPROPN\t_\t_\t2\tnsubj\t_\t_
+2\tспит\tспать\tVERB\t_\t_\t0\troot\t_\t_
+
+# sent_id = c.xml_1
+# text = Ура
+1\tУра\tура\tINTJ\t_\t_\t0\troot\t_\t_
+"""
+
+
+@pytest.mark.parametrize("num_workers, docs_per_shard", [(None, 64), (2, 1), (2, 2)])
+def test_from_conllu(tmp_path, num_workers, docs_per_shard):
+    path = str(tmp_path / "data.conllu")
+    with open(path, "w") as f:
+        f.write(CONLLU)
+    examples = from_conllu(path, warn=False, num_workers=num_workers, docs_per_shard=docs_per_shard)
+    assert [x.filename for x in examples] == ["a.xml", "b.xml", "c.xml"]
+    assert [[chunk.id for chunk in x.chunks] for x in examples] == [["a.xml_1"], ["b.xml_1"], ["c.xml_1"]]
+    chunk = examples[0].chunks[0]
+    assert chunk.text == "Мама мыла раму."
+    assert [(t.text, t.id_head, t.rel, t.pos) for t in chunk.tokens] == [
+        ("Мама", 1, "nsubj", "NOUN"),
+        ("мыла", -1, "root", "VERB"),
+        ("раму", 1, "obj", "NOUN"),
+        (".", 1, "punct", "PUNCT")
+    ]
+
+
+def test_iter_conllu(tmp_path):
+    path = str(tmp_path / "data.conllu")
+    with open(path, "w") as f:
+        f.write(CONLLU)
+    it = iter_conllu(path, warn=False)
+    x = next(it)
+    assert x.filename == "a.xml"
+    assert [x.filename for x in it] == ["b.xml", "c.xml"]
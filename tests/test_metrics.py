@@ -1,5 +1,14 @@
+import itertools
+import random
 import pytest
-from src.metrics import f1_precision_recall_support, classification_report, classification_report_ner
+from src.data.base import Example, Entity, Token
+from src.metrics import (
+    f1_precision_recall_support,
+    classification_report,
+    classification_report_ner,
+    get_coreference_resolution_metrics_v2,
+    get_max_assignment_score
+)
 
 
 @pytest.mark.parametrize("tp, fp, fn, expected", [
@@ -68,3 +77,177 @@ def test_classification_report(y_true, y_pred, expected):
     actual = classification_report(y_true=y_true, y_pred=y_pred, trivial_label=0)
     # print(actual)
     assert actual == expected
+
+
+def _build_coref_example(id, chains):
+    """
+    chains: список кластеров, кластер - список упоминаний (start, end) в индексах токенов
+    """
+    num_tokens = max(end for chain in chains for _, end in chain) + 1 if chains else 1
+    tokens = [Token(text="x", index_abs=i) for i in range(num_tokens)]
+    entities = []
+    for id_chain, chain in enumerate(chains):
+        for start, end in chain:
+            entity = Entity(id=f"T{len(entities)}", label="MENTION", tokens=tokens[start:end + 1], id_chain=id_chain)
+            entities.append(entity)
+    return Example(id=id, tokens=tokens, entities=entities)
+
+
+A, B, C, D, E = (0, 0), (1, 1), (2, 3), (4, 4), (5, 6)
+
+
+@pytest.mark.parametrize("key, response, expected", [
+    pytest.param(
+        [[A, B, C], [D, E]], [[A, B, C], [D, E]],
+        {metric: (1.0, 1.0) for metric in ["muc", "bcub", "ceafm", "ceafe", "blanc"]},
+        id="perfect"
+    ),
+    pytest.param(
+        [[A, B, C], [D, E]], [[A], [B], [C], [D], [E]],
+        {"muc": (0.0, 0.0), "bcub": (0.4, 1.0), "ceafm": (0.4, 0.4), "ceafe": ((1 / 2 + 2 / 3) / 2, (1 / 2 + 2 / 3) / 5)},
+        id="singletons"
+    ),
+    pytest.param(
+        [[A, B, C], [D, E]], [[A, B], [C, D, E]],
+        # ceafm: {A,B,C} <-> {A,B}, {D,E} <-> {C,D,E}; ceafe: (2 * 2 / 5 + 2 * 2 / 5) / 2
+        {"muc": (2 / 3, 2 / 3), "bcub": (11 / 15, 11 / 15), "ceafm": (0.8, 0.8), "ceafe": (0.8, 0.8)},
+        id="merge_split"
+    ),
+])
+def test_get_coreference_resolution_metrics_v2(key, response, expected):
+    examples_true = [_build_coref_example("0", key)]
+    examples_pred = [_build_coref_example("0", response)]
+    actual = get_coreference_resolution_metrics_v2(examples_true=examples_true, examples_pred=examples_pred)
+    for metric, (recall, precision) in expected.items():
+        assert actual[metric]["recall"] == pytest.approx(recall), metric
+        assert actual[metric]["precision"] == pytest.approx(precision), metric
+
+
+def _f(recall, precision):
+    return 2 * recall * precision / (recall + precision) if recall + precision > 0 else 0.0
+
+
+def _m(clusters):
+    """
+    "a bc def" -> [[a], [b, c], [d, e, f]]; упоминание-буква - однотокенный спан
+    """
+    return [[(ord(c) - ord("a"),) * 2 for c in cluster] for cluster in clusters.split()]
+
+
+PERFECT = {metric: (1.0, 1.0, 1.0) for metric in ["muc", "bcub", "ceafm", "ceafe", "blanc"]}
+
+
+# тест-кейсы reference coreference scorer (conll/reference-coreference-scorers, test/TestCases.README):
+# TC-A - ошибки упоминаний (пропущенные, лишние), TC-M - один кластер в key, TC-N - только синглтоны в key.
+# значения: {metric: (recall, precision, f1)}; для BLANC f1 - среднее f1 coreference и non-coreference links
+@pytest.mark.parametrize("key, response, expected", [
+    pytest.param("a bc def", "a bc def", PERFECT, id="TC-A-1"),
+    pytest.param(
+        "a bc def", "a de",
+        {
+            "muc": (1 / 3, 1.0, 0.5),
+            "bcub": (7 / 18, 1.0, 14 / 25),
+            "ceafm": (0.5, 1.0, 2 / 3),
+            "ceafe": (0.6, 0.9, 0.72),
+            "blanc": ((1 / 4 + 2 / 11) / 2, 1.0, (_f(1 / 4, 1.0) + _f(2 / 11, 1.0)) / 2)  # 0.21591, 1, 0.35385
+        },
+        id="TC-A-2"
+    ),
+    pytest.param(
+        "a bc def", "a bcx defy z",
+        {
+            "muc": (1.0, 3 / 5, 0.75),
+            "bcub": (1.0, 55 / 108, _f(1.0, 55 / 108)),
+            "ceafm": (1.0, 6 / 9, 0.8),
+            # общее сходство 1 + 4 / 5 + 6 / 7 = 93 / 35
+            "ceafe": (93 / 35 / 3, 93 / 35 / 4, _f(93 / 35 / 3, 93 / 35 / 4)),
+            "blanc": (1.0, (4 / 9 + 11 / 27) / 2, (_f(1.0, 4 / 9) + _f(1.0, 11 / 27)) / 2)
+        },
+        id="TC-A-3"
+    ),
+    pytest.param(
+        "a bc def", "a bcx dy z",
+        {
+            "muc": (1 / 3, 1 / 3, 1 / 3),
+            "bcub": ((3 + 1 / 3) / 6, (1 + 4 / 3 + 1 / 2) / 7, _f(5 / 9, 17 / 42)),
+            "ceafm": (4 / 6, 4 / 7, _f(4 / 6, 4 / 7)),
+            "ceafe": (2.2 / 3, 2.2 / 4, _f(2.2 / 3, 2.2 / 4)),  # 0.73333, 0.55, 0.62857
+            # 0.35227, 0.27206, 0.30357
+            "blanc": ((1 / 4 + 5 / 11) / 2, (1 / 4 + 5 / 17) / 2, (_f(1 / 4, 1 / 4) + _f(5 / 11, 5 / 17)) / 2)
+        },
+        id="TC-A-4"
+    ),
+    pytest.param("abcdef", "abcdef", PERFECT, id="TC-M-1"),
+    pytest.param(
+        "abcdef", "a b c d e f",
+        {
+            "muc": (0.0, 0.0, 0.0),
+            "bcub": (1 / 6, 1.0, 2 / 7),
+            "ceafm": (1 / 6, 1 / 6, 1 / 6),
+            "ceafe": (2 / 7, 2 / 7 / 6, _f(2 / 7, 2 / 7 / 6)),
+            "blanc": (0.0, 0.0, 0.0)
+        },
+        id="TC-M-2"
+    ),
+    pytest.param(
+        "abcdef", "abc def",
+        {
+            "muc": (4 / 5, 1.0, 8 / 9),
+            "bcub": (0.5, 1.0, 2 / 3),
+            "ceafm": (0.5, 0.5, 0.5),
+            "ceafe": (2 / 3, 1 / 3, 4 / 9),
+            "blanc": (0.4, 1.0, 4 / 7)
+        },
+        id="TC-M-3"
+    ),
+    pytest.param(
+        "a b c d e f", "a b c d e f",
+        dict(PERFECT, muc=(0.0, 0.0, 0.0)),  # в key нет coreference links, MUC не определён
+        id="TC-N-1"
+    ),
+    pytest.param(
+        "a b c d e f", "abcdef",
+        {
+            "muc": (0.0, 0.0, 0.0),
+            "bcub": (1.0, 1 / 6, 2 / 7),
+            "ceafm": (1 / 6, 1 / 6, 1 / 6),
+            "ceafe": (2 / 7 / 6, 2 / 7, _f(2 / 7 / 6, 2 / 7)),
+            "blanc": (0.0, 0.0, 0.0)
+        },
+        id="TC-N-2"
+    ),
+])
+def test_get_coreference_resolution_metrics_v2_reference_cases(key, response, expected):
+    examples_true = [_build_coref_example("0", _m(key))]
+    examples_pred = [_build_coref_example("0", _m(response))]
+    actual = get_coreference_resolution_metrics_v2(examples_true=examples_true, examples_pred=examples_pred)
+    for metric, (recall, precision, f1) in expected.items():
+        assert actual[metric]["recall"] == pytest.approx(recall), metric
+        assert actual[metric]["precision"] == pytest.approx(precision), metric
+        assert actual[metric]["f1"] == pytest.approx(f1), metric
+
+
+def test_get_coreference_resolution_metrics_v2_micro():
+    """
+    числители и знаменатели суммируются по документам
+    """
+    examples_true = [_build_coref_example("0", [[A, B]]), _build_coref_example("1", [[A, B, C, D, E]])]
+    examples_pred = [_build_coref_example("1", [[A, B, C], [D, E]]), _build_coref_example("0", [[A, B]])]
+    actual = get_coreference_resolution_metrics_v2(examples_true=examples_true, examples_pred=examples_pred)
+    # muc: recall (1 + 3) / (1 + 4), precision (1 + 3) / (1 + 3)
+    assert actual["muc"]["recall"] == pytest.approx(0.8)
+    assert actual["muc"]["precision"] == pytest.approx(1.0)
+    assert actual["muc"]["f1"] == pytest.approx(2 * 0.8 / 1.8)
+
+
+@pytest.mark.parametrize("n, m", [(1, 1), (2, 3), (3, 2), (4, 4), (5, 3)])
+def test_get_max_assignment_score(n, m):
+    rng = random.Random(228)
+    for _ in range(50):
+        scores = [[rng.choice([0, 0.5, 1, 2, 3]) for _ in range(m)] for _ in range(n)]
+        expected = max(
+            sum(scores[i][j] for i, j in zip(rows, cols))
+            for rows in itertools.permutations(range(n), min(n, m))
+            for cols in itertools.permutations(range(m), min(n, m))
+        )
+        assert get_max_assignment_score(scores) == pytest.approx(expected)
@@ -1,10 +1,102 @@
+import random
 import pytest
 from src.data.base import Languages, Example, Token, Span
-from src.data.preprocessing import get_sentences_spans, split_example_v1, split_example_v2, apply_bpe
+from src.data.io import parse_collection
+from src.model.inputs import get_chunk_pieces
+from src.utils import get_example_length
+from src.data.preprocessing import (
+    get_sentences_spans,
+    fix_pointers_fn,
+    split_example_v1,
+    split_example_v2,
+    apply_bpe,
+    preprocess_example,
+    examples_from_texts,
+    split_sentences,
+    SentencesCache,
+    preprocess_corpus,
+    apply_bpe_corpus,
+    BpeCache,
+    get_sentences_spans_by_budget,
+    get_sentences_spans_fixed_pointers
+)
 
 
 # get spans
 
+
+def _fix_pointers_fn_expected(pointers, entity_spans):
+    """
+    копия прежней реализации fix_pointers_fn: перебор всех спанов для каждой границы
+    """
+    res = []
+    for p in pointers:
+        is_good = True
+        for span in entity_spans:
+            if span.start < p <= span.end:
+                is_good = False
+                break
+        if is_good:
+            res.append(p)
+    return res
+
+
+def _get_sentences_spans_expected(entity_spans, pointers, window=1, stride=None):
+    """
+    копия прежней реализации get_sentences_spans: на каждом шаге просматриваются все спаны сущностей,
+    O(num_sentences * num_entities)
+    """
+    # stride
+    if stride is None:
+        stride = window
+    else:
+        assert stride <= window
+
+    # pointers
+    if len(pointers) == 0:
+        return []
+    elif len(pointers) == 1:
+        raise AssertionError
+    else:
+        assert pointers[0] == 0
+
+    num_sentences = len(pointers) - 1
+    if window >= num_sentences:
+        return [Span(start=0, end=num_sentences)]
+
+    res = []
+    start = 0
+    end = window
+    is_good_split = True  # разделение на предложения плохое, если оно проходит через именную сущность
+    bad_starts = set()  # индексы предложений, которые содержат только часть сущности
+    while True:
+        end_token_id = pointers[end]
+
+        for span in entity_spans:
+            if span[0] < end_token_id <= span[1]:
+                is_good_split = False
+                break
+
+        if is_good_split:
+            res.append(Span(start=start, end=end))
+            start = min(num_sentences - 1, start + stride)
+            while start in bad_starts:
+                start += 1
+            end = min(num_sentences, start + window)
+        else:
+            bad_starts.add(end)
+            end = min(num_sentences, end + 1)
+
+        if end == num_sentences:
+            res.append(Span(start=start, end=end))
+            break
+
+        # присвоение флагу is_good_split дефолтного значения
+        is_good_split = True
+
+    return res
+
+
 # TODO: лучше покрыть тестами случаи (w=2, s=1); (w=2, s=2)
 @pytest.mark.parametrize("entity_spans, pointers, window, stride, expected", [
     # w=1, s=1
@@ -26,7 +118,8 @@ from src.data.preprocessing import get_sentences_spans, split_example_v1, split_
     # w=2, s=2
     pytest.param([(0, 1), (2, 3), (4, 5)], [0, 2, 4, 6], 2, 2, [(0, 2), (2, 3)]),
 ])
-def test_get_sentences_spans(entity_spans, pointers, window, stride, expected):
+@pytest.mark.parametrize("get_sentences_spans", [get_sentences_spans, _get_sentences_spans_expected])
+def test_get_sentences_spans(get_sentences_spans, entity_spans, pointers, window, stride, expected):
     actual = get_sentences_spans(
         entity_spans=entity_spans,
         pointers=pointers,
@@ -37,7 +130,8 @@ def test_get_sentences_spans(entity_spans, pointers, window, stride, expected):
     assert actual == expected
 
 
-def test_get_sentences_spans_raise():
+@pytest.mark.parametrize("get_sentences_spans", [get_sentences_spans, _get_sentences_spans_expected])
+def test_get_sentences_spans_raise(get_sentences_spans):
     # pointers состоит из одного элемента
     with pytest.raises(AssertionError):
         get_sentences_spans(entity_spans=[], pointers=[1])
@@ -51,6 +145,55 @@ def test_get_sentences_spans_raise():
         get_sentences_spans(entity_spans=[], pointers=[], stride=2, window=1)
 
 
+def _generate_pointers_and_entity_spans(rng):
+    num_sentences = rng.randint(1, 30)
+    pointers = [0]
+    for _ in range(num_sentences):
+        pointers.append(pointers[-1] + rng.randint(1, 10))
+    num_tokens = pointers[-1]
+    entity_spans = []
+    for _ in range(rng.randint(0, 40)):
+        start = rng.randint(0, num_tokens - 1)
+        end = min(num_tokens - 1, start + rng.choice([0, 0, 1, 2, 5, 15]))
+        entity_spans.append(Span(start=start, end=end))
+    return pointers, entity_spans
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_fix_pointers_fn_random(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        pointers, entity_spans = _generate_pointers_and_entity_spans(rng)
+        expected = _fix_pointers_fn_expected(pointers=pointers, entity_spans=entity_spans)
+        assert fix_pointers_fn(pointers=pointers, entity_spans=entity_spans) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_get_sentences_spans_random(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        pointers, entity_spans = _generate_pointers_and_entity_spans(rng)
+        window = rng.randint(1, 5)
+        stride = rng.randint(1, window)
+        kwargs = dict(entity_spans=entity_spans, pointers=pointers, window=window, stride=stride)
+        assert get_sentences_spans(**kwargs) == _get_sentences_spans_expected(**kwargs)
+
+
+@pytest.mark.parametrize("num_sentences, window, stride, expected", [
+    pytest.param(3, 5, 1, [(0, 3)], id="window >= num_sentences"),
+    pytest.param(5, 3, 1, [(0, 3), (1, 4), (2, 5)], id="covered by full windows"),
+    pytest.param(4, 2, 2, [(0, 2), (2, 4)], id="covered by full windows, stride > 1"),
+    # хвост не попадает в последнее полное окно: добавляется укороченное окно с очередного шага
+    pytest.param(5, 2, 2, [(0, 2), (2, 4), (4, 5)], id="tail of one sentence"),
+    pytest.param(6, 4, 3, [(0, 4), (3, 6)], id="tail overlaps the last full window"),
+    pytest.param(8, 3, 3, [(0, 3), (3, 6), (6, 8)], id="tail of two sentences"),
+])
+def test_get_sentences_spans_fixed_pointers(num_sentences, window, stride, expected):
+    actual = get_sentences_spans_fixed_pointers(num_sentences=num_sentences, window=window, stride=stride)
+    assert actual == expected
+    assert actual[-1].end == num_sentences
+
+
 # split example
 
 
@@ -109,6 +252,67 @@ def test_split_example(example, window, stride, expected_num_chunks):
     _test_split_example(split_example_v2, example, window, stride, expected_num_chunks)
 
 
+def test_split_example_v2_overlapping_chunks():
+    x = examples_from_texts([TEXT], tokenizer=CharTokenizer)[0]
+    chunks = split_example_v2(x, window=2, stride=1)
+    assert len(chunks) == 2
+    t_1 = chunks[0].tokens[-1]
+    t_2 = next(t for t in chunks[1].tokens if t.index_abs == t_1.index_abs)
+    assert t_1.token is t_2.token  # общий токен двух кусков
+
+    # лейблы и предсказания одного куска не видны другому и документу
+    for chunk, label in zip(chunks, ["FOO", "BAR"]):
+        for t in chunk.tokens:
+            t.reset()
+            t.label = label
+            t.label_ids = [len(label)]
+            t.id_head = 0
+    assert (t_1.label, t_2.label) == ("FOO", "BAR")
+    assert t_1.label_ids is not t_2.label_ids
+    assert all(t.label is None and t.id_head is None for t in x.tokens)
+    assert chunks[0].tokens[0].copy.label == "FOO"
+
+
+# sentences cache
+
+
+TEXT = "Мама мыла раму. Компания ООО «Ромашка» обанкротилась!  Т.е. всё."
+
+
+def test_sentences_cache(tmp_path):
+    expected = split_sentences(TEXT)
+    assert expected[1] == [0, 4, 11, 17]
+
+    path = str(tmp_path / "sentences")
+    cache = SentencesCache(maxsize=1, path=path)
+    assert cache.get(TEXT) == expected
+    assert cache.get(TEXT) == expected
+    assert (cache.memory.hits, cache.memory.misses) == (1, 1)
+
+    # вытеснение из памяти: запись берётся с диска
+    assert cache.get("Ура.") == split_sentences("Ура.")
+    assert len(cache.memory) == 1
+    assert cache.get(TEXT) == expected
+    cache.close()
+
+    # после перезапуска
+    cache = SentencesCache(path=path)
+    assert cache.get(TEXT) == expected
+    assert len(cache.disk) == 2
+    cache.close()
+
+
+def test_split_example_v2_sentences_cache():
+    x = examples_from_texts([TEXT], tokenizer=CharTokenizer)[0]
+    cache = SentencesCache()
+    for window, stride in [(1, 1), (2, 1), (3, 3)]:
+        expected = split_example_v2(x, window=window, stride=stride)
+        actual = split_example_v2(x, window=window, stride=stride, sentences_cache=cache)
+        assert [(c.id, c.text, [t.span_rel for t in c.tokens]) for c in actual] == \
+               [(c.id, c.text, [t.span_rel for t in c.tokens]) for c in expected]
+    assert cache.memory.misses == 1
+
+
 # apply bpe
 
 
@@ -149,3 +353,248 @@ class Tokenizer:
 #         actual_labels += t.labels_pieces
 #     assert actual_pieces == expected_pieces
 #     assert actual_labels == expected_labels
+
+
+# examples from texts
+
+
+class CharTokenizer:
+    vocab = {}
+
+    @staticmethod
+    def tokenize(text):
+        return list(text)
+
+    @staticmethod
+    def convert_tokens_to_ids(tokens):
+        return [ord(x) for x in tokens]
+
+
+def test_apply_bpe_updates_chunk_pieces():
+    x = examples_from_texts([TEXT], tokenizer=CharTokenizer)[0]
+    chunk = split_example_v2(x, window=1, stride=1)[1]
+    chunk_other = split_example_v2(examples_from_texts(["Ура."], tokenizer=CharTokenizer)[0])[0]
+    assert get_chunk_pieces(chunk)[0].tolist() == [ord(c) for t in chunk.tokens for c in t.text]
+
+    # после apply_bpe с другим токенизатором кусочки пересчитываются
+    class UpperCharTokenizer(CharTokenizer):
+        @staticmethod
+        def tokenize(text):
+            return list(text.upper())
+
+    token_ids_other = get_chunk_pieces(chunk_other)[0]
+    apply_bpe(x, tokenizer=UpperCharTokenizer)
+    assert get_chunk_pieces(chunk)[0].tolist() == [ord(c) for t in chunk.tokens for c in t.text.upper()]
+
+    # кэш кусков других документов при этом не сбрасывается
+    assert get_chunk_pieces(chunk_other)[0] is token_ids_other
+
+
+def test_apply_bpe_updates_example_length():
+    x = examples_from_texts([TEXT], tokenizer=CharTokenizer)[0]
+    chunk = split_example_v2(x, window=1, stride=1)[0]
+    num_chars = sum(len(t.text) for t in chunk.tokens)
+    assert get_example_length(chunk, pieces_level=True) == num_chars
+    assert get_example_length(chunk) == len(chunk.tokens)
+
+    # после apply_bpe с другим токенизатором длина в кусочках пересчитывается
+    class DoubleCharTokenizer(CharTokenizer):
+        @staticmethod
+        def tokenize(text):
+            return [c for c in text for _ in range(2)]
+
+    apply_bpe(x, tokenizer=DoubleCharTokenizer)
+    assert get_example_length(chunk, pieces_level=True) == 2 * num_chars
+    assert get_example_length(chunk) == len(chunk.tokens)
+
+
+@pytest.mark.parametrize("window, stride", [(1, 1), (2, 1)])
+def test_examples_from_texts(tmp_path, window, stride):
+    """
+    результат должен совпадать с parse_collection + preprocess_example на файлах с пустой разметкой
+    """
+    texts = ["Мама мыла раму. Компания ООО Ромашка обанкротилась.", "Иван\u200b купил машину!", ""]
+    for i, text in enumerate(texts):
+        with open(tmp_path / f"{i}.txt", "w") as f:
+            f.write(text)
+        with open(tmp_path / f"{i}.ann", "w") as f:
+            f.write("")
+    expected = parse_collection(str(tmp_path))
+    for x in expected:
+        preprocess_example(x, tokenizer=CharTokenizer, window=window, stride=stride)
+    actual = examples_from_texts(texts, tokenizer=CharTokenizer, window=window, stride=stride)
+
+    def to_tuple(x):
+        return (
+            x.id,
+            x.text,
+            [(t.text, t.span_abs, t.id_sent) for t in x.tokens],
+            [
+                (chunk.id, chunk.text, [(t.text, t.span_rel, t.index_rel, t.pieces, t.token_ids) for t in chunk.tokens])
+                for chunk in x.chunks
+            ]
+        )
+
+    assert [to_tuple(x) for x in actual] == [to_tuple(x) for x in expected]
+    assert actual[1].text == "Иван купил машину!"
+
+
+def test_examples_from_texts_ids():
+    actual = examples_from_texts(["foo.", "bar."], tokenizer=CharTokenizer, ids=["a", "b"])
+    assert [(x.id, x.filename) for x in actual] == [("a", "a"), ("b", "b")]
+    assert [chunk.parent for chunk in actual[1].chunks] == ["b"]
+    with pytest.raises(AssertionError):
+        examples_from_texts(["foo.", "bar."], tokenizer=CharTokenizer, ids=["a", "a"])
+
+
+# preprocess corpus
+
+
+CORPUS = {
+    "0": (
+        "Мама мыла раму. Компания ООО Ромашка обанкротилась. Она разорилась.",
+        "T1\tPER 0 4\tМама\nT2\tORG 25 36\tООО Ромашка\nT3\tORG 16 24\tКомпания\nT4\tORG 52 55\tОна\n"
+        "R1\tCOREFERENCE Arg1:T4 Arg2:T2\nR2\tCOREFERENCE Arg1:T2 Arg2:T3\n"
+    ),
+    "1": ("Иван купил машину. Петя спит.", "T1\tPER 0 4\tИван\n"),
+    "2": ("", ""),
+}
+
+
+@pytest.mark.parametrize("num_workers, chunksize", [(2, None), (2, 1), (3, 2)])
+@pytest.mark.parametrize("window", [1, 2])
+def test_preprocess_corpus(tmp_path, num_workers, chunksize, window):
+    for name, (text, ann) in CORPUS.items():
+        with open(tmp_path / f"{name}.txt", "w") as f:
+            f.write(text)
+        with open(tmp_path / f"{name}.ann", "w") as f:
+            f.write(ann)
+
+    def to_tuple(x):
+        return (
+            x.id,
+            [(t.pieces, t.token_ids, t.id_sent) for t in x.tokens],
+            [e.id_chain for e in x.entities],
+            [
+                (
+                    chunk.id,
+                    chunk.text,
+                    chunk.parent,
+                    [(t.text, t.span_rel, t.index_rel, t.pieces) for t in chunk.tokens],
+                    [(e.id, e.index, e.id_chain, [t.index_rel for t in e.tokens]) for e in chunk.entities],
+                    [(a.id, a.head_index, a.dep_index) for a in chunk.arcs]
+                )
+                for chunk in x.chunks
+            ]
+        )
+
+    kwargs = dict(tokenizer=CharTokenizer, window=window, stride=1, assign_chains=True)
+    expected = preprocess_corpus(parse_collection(str(tmp_path)), **kwargs)
+    actual = preprocess_corpus(parse_collection(str(tmp_path)), num_workers=num_workers, chunksize=chunksize, **kwargs)
+    assert [to_tuple(x) for x in actual] == [to_tuple(x) for x in expected]
+    assert expected[0].entities[1].id_chain == expected[0].entities[3].id_chain
+    assert len(expected[0].chunks) == 3 - window + 1
+
+
+# chunking by budget
+
+
+@pytest.mark.parametrize("sent_num_pieces, sent_num_entities, max_pieces, max_entities, expected", [
+    pytest.param([], [], 10, None, []),
+    pytest.param([3], [0], 10, None, [(0, 1)]),
+    pytest.param([3, 3, 3, 3], [0, 0, 0, 0], 6, None, [(0, 2), (2, 4)]),
+    pytest.param([3, 3, 3, 3], [0, 0, 0, 0], 7, None, [(0, 2), (2, 4)]),
+    pytest.param([3, 3, 3, 3], [0, 0, 0, 0], 9, None, [(0, 3), (3, 4)]),
+    # предложение длиннее бюджета - отдельный кусок
+    pytest.param([2, 20, 2, 2], [0, 0, 0, 0], 5, None, [(0, 1), (1, 2), (2, 4)]),
+    # бюджет сущностей
+    pytest.param([1, 1, 1, 1], [2, 1, 1, 3], 100, 3, [(0, 2), (2, 3), (3, 4)]),
+    pytest.param([1, 1, 1, 1], [2, 1, 1, 3], 100, None, [(0, 4)]),
+])
+def test_get_sentences_spans_by_budget(sent_num_pieces, sent_num_entities, max_pieces, max_entities, expected):
+    actual = get_sentences_spans_by_budget(
+        sent_num_pieces=sent_num_pieces,
+        sent_num_entities=sent_num_entities,
+        max_pieces=max_pieces,
+        max_entities=max_entities
+    )
+    assert actual == [Span(start=start, end=end) for start, end in expected]
+
+
+@pytest.mark.parametrize("max_pieces, max_entities, expected", [
+    # кусочки по предложениям: [13, 32, 14], сущности: [1, 2, 1]
+    pytest.param(45, None, [("0_0-2", ["T1", "T3", "T2"]), ("0_2-3", ["T4"])]),
+    pytest.param(59, None, [("0_0-3", ["T1", "T3", "T2", "T4"])]),
+    pytest.param(59, 2, [("0_0-1", ["T1"]), ("0_1-2", ["T3", "T2"]), ("0_2-3", ["T4"])]),
+    pytest.param(10, None, [("0_0-1", ["T1"]), ("0_1-2", ["T3", "T2"]), ("0_2-3", ["T4"])]),
+])
+def test_preprocess_example_budget(tmp_path, max_pieces, max_entities, expected):
+    text, ann = CORPUS["0"]
+    with open(tmp_path / "0.txt", "w") as f:
+        f.write(text)
+    with open(tmp_path / "0.ann", "w") as f:
+        f.write(ann)
+    x = parse_collection(str(tmp_path))[0]
+    preprocess_example(x, tokenizer=CharTokenizer, window=1, max_pieces=max_pieces, max_entities=max_entities)
+    actual = [(chunk.id, [e.id for e in sorted(chunk.entities, key=lambda e: e.index)]) for chunk in x.chunks]
+    assert actual == expected
+    # куски не перекрываются и покрывают все токены документа
+    assert [t.index_abs for chunk in x.chunks for t in chunk.tokens] == [t.index_abs for t in x.tokens]
+
+
+# bpe cache
+
+
+class CountingTokenizer:
+    def __init__(self, vocab=None):
+        self.vocab = vocab if vocab is not None else {"ма": 1, "#ма": 2}
+        self.num_calls = 0
+
+    def tokenize(self, text):
+        self.num_calls += 1
+        return [text[i:i + 2] if i == 0 else "#" + text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab.get(x, 0) for x in tokens]
+
+
+def test_apply_bpe_cache():
+    tokenizer = CountingTokenizer()
+    x = Example(tokens=[Token(text="мама"), Token(text="мыла"), Token(text="мама")])
+    apply_bpe(x, tokenizer=tokenizer)
+    assert [(t.pieces, t.token_ids) for t in x.tokens] == [
+        (["ма", "#ма"], [1, 2]), (["мы", "#ла"], [0, 0]), (["ма", "#ма"], [1, 2])
+    ]
+    assert tokenizer.num_calls == 2
+    apply_bpe(x, tokenizer=tokenizer)  # общий кэш токенизатора
+    assert tokenizer.num_calls == 2
+
+
+def test_bpe_cache_persistence(tmp_path):
+    path = str(tmp_path / "bpe_cache.pkl")
+    tokenizer = CountingTokenizer()
+    cache = BpeCache(tokenizer, maxsize=2, path=path)
+    for text in ["мама", "мыла", "раму"]:
+        cache.get(text)
+    assert "мама" not in cache.memory
+    cache.save()
+
+    tokenizer_new = CountingTokenizer()
+    cache = BpeCache(tokenizer_new, path=path)
+    assert cache.get("раму") == (["ра", "#му"], [0, 0])
+    assert tokenizer_new.num_calls == 0
+
+    # другой словарь - кэш с диска не используется
+    cache = BpeCache(CountingTokenizer(vocab={"ма": 3}), path=path)
+    assert len(cache.memory) == 0
+
+
+def test_apply_bpe_corpus():
+    tokenizer = CountingTokenizer()
+    examples = [
+        Example(tokens=[Token(text="мама"), Token(text="мыла")]),
+        Example(tokens=[Token(text="мыла"), Token(text="мама"), Token(text="раму")]),
+    ]
+    apply_bpe_corpus(examples, tokenizer=tokenizer, bpe_cache=BpeCache(tokenizer, maxsize=1))
+    assert tokenizer.num_calls == 3
+    assert [t.token_ids for t in examples[1].tokens] == [[0, 0], [1, 2], [0, 0]]
@@ -0,0 +1,177 @@
+import random
+import unicodedata
+import pytest
+from src.data.tokenization import FastFullTokenizer, load_vocab
+
+
+# эталон - алгоритм bert.tokenization.FullTokenizer (без зависимости от tensorflow)
+
+
+def _is_whitespace(char):
+    if char == " " or char == "\t" or char == "\n" or char == "\r":
+        return True
+    return unicodedata.category(char) == "Zs"
+
+
+def _is_control(char):
+    if char == "\t" or char == "\n" or char == "\r":
+        return False
+    return unicodedata.category(char).startswith("C")
+
+
+def _is_punctuation(char):
+    cp = ord(char)
+    if (33 <= cp <= 47) or (58 <= cp <= 64) or (91 <= cp <= 96) or (123 <= cp <= 126):
+        return True
+    return unicodedata.category(char).startswith("P")
+
+
+def _is_chinese_char(cp):
+    return (0x4E00 <= cp <= 0x9FFF) or (0x3400 <= cp <= 0x4DBF) or (0x20000 <= cp <= 0x2A6DF) \
+        or (0x2A700 <= cp <= 0x2B73F) or (0x2B740 <= cp <= 0x2B81F) or (0x2B820 <= cp <= 0x2CEAF) \
+        or (0xF900 <= cp <= 0xFAFF) or (0x2F800 <= cp <= 0x2FA1F)
+
+
+def _whitespace_tokenize(text):
+    text = text.strip()
+    if not text:
+        return []
+    return text.split()
+
+
+class ReferenceTokenizer:
+    def __init__(self, vocab, do_lower_case):
+        self.vocab = vocab
+        self.do_lower_case = do_lower_case
+
+    def tokenize(self, text):
+        split_tokens = []
+        for token in self._basic_tokenize(text):
+            split_tokens += self._wordpiece_tokenize(token)
+        return split_tokens
+
+    def convert_tokens_to_ids(self, tokens):
+        return [self.vocab[t] for t in tokens]
+
+    def _basic_tokenize(self, text):
+        output = []
+        for char in text:
+            cp = ord(char)
+            if cp == 0 or cp == 0xfffd or _is_control(char):
+                continue
+            output.append(" " if _is_whitespace(char) else char)
+        text = "".join(output)
+        output = []
+        for char in text:
+            if _is_chinese_char(ord(char)):
+                output += [" ", char, " "]
+            else:
+                output.append(char)
+        text = "".join(output)
+        split_tokens = []
+        for token in _whitespace_tokenize(text):
+            if self.do_lower_case:
+                token = token.lower()
+                token = "".join(c for c in unicodedata.normalize("NFD", token) if unicodedata.category(c) != "Mn")
+            chars = list(token)
+            i = 0
+            start_new_word = True
+            words = []
+            while i < len(chars):
+                char = chars[i]
+                if _is_punctuation(char):
+                    words.append([char])
+                    start_new_word = True
+                else:
+                    if start_new_word:
+                        words.append([])
+                    start_new_word = False
+                    words[-1].append(char)
+                i += 1
+            split_tokens += ["".join(x) for x in words]
+        return _whitespace_tokenize(" ".join(split_tokens))
+
+    def _wordpiece_tokenize(self, text):
+        output_tokens = []
+        for token in _whitespace_tokenize(text):
+            chars = list(token)
+            if len(chars) > 200:
+                output_tokens.append("[UNK]")
+                continue
+            is_bad = False
+            start = 0
+            sub_tokens = []
+            while start < len(chars):
+                end = len(chars)
+                cur_substr = None
+                while start < end:
+                    substr = "".join(chars[start:end])
+                    if start > 0:
+                        substr = "##" + substr
+                    if substr in self.vocab:
+                        cur_substr = substr
+                        break
+                    end -= 1
+                if cur_substr is None:
+                    is_bad = True
+                    break
+                sub_tokens.append(cur_substr)
+                start = end
+            if is_bad:
+                output_tokens.append("[UNK]")
+            else:
+                output_tokens += sub_tokens
+        return output_tokens
+
+
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяАБВГДЁЖabcXYZ"
+EXTRA_CHARS = " \t\n.,!?«»—-()\"'%№ ​́\u0000�\x07é中文ё"
+
+
+def _build_vocab(rng, size=300):
+    pieces = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "", "##"] + list(ALPHABET) + ["##" + c for c in ALPHABET]
+    pieces += list(".,!?«»—-()\"'%№中文")
+    while len(pieces) < size:
+        piece = "".join(rng.choice(ALPHABET.lower()) for _ in range(rng.randint(2, 6)))
+        pieces.append(piece if rng.random() < 0.5 else "##" + piece)
+    vocab = {}
+    for piece in pieces:
+        if piece not in vocab:
+            vocab[piece] = len(vocab)
+    return vocab
+
+
+def _generate_text(rng):
+    chars = []
+    for _ in range(rng.randint(0, 60)):
+        if rng.random() < 0.8:
+            chars.append(rng.choice(ALPHABET))
+        else:
+            chars.append(rng.choice(EXTRA_CHARS))
+    if rng.random() < 0.05:
+        chars.append("я" * 201)
+    return "".join(chars)
+
+
+@pytest.mark.parametrize("do_lower_case", [True, False])
+def test_fast_full_tokenizer(do_lower_case):
+    rng = random.Random(228)
+    vocab = _build_vocab(rng)
+    expected_tokenizer = ReferenceTokenizer(vocab=vocab, do_lower_case=do_lower_case)
+    tokenizer = FastFullTokenizer(vocab=vocab, do_lower_case=do_lower_case)
+    for _ in range(2000):
+        text = _generate_text(rng)
+        expected = expected_tokenizer.tokenize(text)
+        actual = tokenizer.tokenize(text)
+        assert actual == expected, text
+        assert tokenizer.convert_tokens_to_ids(actual) == expected_tokenizer.convert_tokens_to_ids(expected)
+
+
+def test_load_vocab(tmp_path):
+    path = tmp_path / "vocab.txt"
+    with open(path, "w") as f:
+        f.write("[PAD]\n[UNK]\nма\n##ма\n")
+    tokenizer = FastFullTokenizer(vocab_file=str(path), do_lower_case=False)
+    assert load_vocab(str(path)) == {"[PAD]": 0, "[UNK]": 1, "ма": 2, "##ма": 3}
+    assert tokenizer.tokenize("мама мыла") == ["ма", "##ма", "[UNK]"]
+    assert tokenizer.convert_tokens_to_ids(["ма", "##ма", "[UNK]"]) == [2, 3, 1]
@@ -1,5 +1,26 @@
+import contextlib
+import itertools
+import random
+import threading
 import pytest
-from src.utils import get_entity_spans, get_connected_components
+import numpy as np
+from src.utils import (
+    get_entity_spans,
+    get_connected_components,
+    iter_batches,
+    LRUCache,
+    get_sent_pairs_to_predict_for,
+    get_sent_ids_to_predict_for,
+    batches_indices_gen,
+    get_padding_report,
+    get_batch_cost,
+    get_bucketed_batches,
+    BatchingPolicies,
+    prefetch_gen,
+    LengthIndexCache
+)
+from src.data.base import Example, Token
+from src.data.preprocessing import get_sentences_spans_fixed_pointers
 
 
 @pytest.mark.parametrize("labels, expected", [
@@ -55,3 +76,383 @@ def test_get_connected_components_error():
     g = {1: {2}}
     with pytest.raises(AssertionError):
         get_connected_components(g)
+
+
+@pytest.mark.parametrize("items, batch_size, expected", [
+    pytest.param([], 2, []),
+    pytest.param([1], 2, [[1]]),
+    pytest.param([1, 2], 2, [[1, 2]]),
+    pytest.param([1, 2, 3], 2, [[1, 2], [3]]),
+    pytest.param([1, 2, 3], 1, [[1], [2], [3]]),
+])
+def test_iter_batches(items, batch_size, expected):
+    actual = list(iter_batches(iter(items), batch_size=batch_size))
+    assert actual == expected
+
+
+@pytest.mark.parametrize("maxsize", [0, 1, 3])
+def test_prefetch_gen(maxsize):
+    assert list(prefetch_gen(iter(range(100)), maxsize=maxsize)) == list(range(100))
+    assert list(prefetch_gen([], maxsize=maxsize)) == []
+
+
+@pytest.mark.parametrize("maxsize", [0, 2])
+def test_prefetch_gen_exception(maxsize):
+    def gen():
+        yield 1
+        yield 2
+        raise ValueError("bad batch")
+
+    actual = []
+    with pytest.raises(ValueError, match="bad batch"):
+        for x in prefetch_gen(gen(), maxsize=maxsize):
+            actual.append(x)
+    assert actual == [1, 2]
+
+
+def test_prefetch_gen_early_stop():
+    num_threads = threading.active_count()
+    produced = []
+
+    def gen():
+        for i in itertools.count():
+            produced.append(i)
+            yield i
+
+    for x in prefetch_gen(gen(), maxsize=2):
+        if x == 5:
+            break
+    assert threading.active_count() == num_threads  # фоновый поток остановлен
+    assert len(produced) <= 5 + 1 + 2 + 1  # не больше глубины очереди сверх потреблённого
+
+
+def test_prefetch_gen_consumer_exception():
+    """
+    исключение потребителя, как в BaseModel.train: генератор в локальной переменной жив, пока жив traceback,
+    поэтому фоновый поток останавливает только явное закрытие (contextlib.closing)
+    """
+    def consume(gen):
+        with contextlib.closing(gen):
+            for x in gen:
+                if x == 5:
+                    raise ValueError
+
+    num_threads = threading.active_count()
+    try:
+        consume(prefetch_gen(itertools.count(), maxsize=2))
+    except ValueError as e:
+        error = e  # traceback держит кадр consume вместе с генератором
+    assert error.__traceback__ is not None
+    assert threading.active_count() == num_threads
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # теперь "b" - самая старая запись
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b", -1) == -1
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+# сетки прежней реализации (только window in {1, 3, 5}, stride = 1): 1 - общий случай, 2 - первый кусок, 3 - последний
+GRIDS = {
+    1: [[1]],
+    3: [
+        [2, 1, 1],
+        [0, 1, 3],
+        [0, 0, 3]
+    ],
+    5: [
+        [2, 2, 2, 1, 1],
+        [0, 2, 1, 1, 3],
+        [0, 0, 1, 3, 3],
+        [0, 0, 0, 3, 3],
+        [0, 0, 0, 0, 3]
+    ]
+}
+
+
+@pytest.mark.parametrize("window", [1, 3, 5])
+@pytest.mark.parametrize("is_first", [True, False])
+@pytest.mark.parametrize("is_last", [True, False])
+def test_get_sent_pairs_to_predict_for_grids(window, is_first, is_last):
+    grid = GRIDS[window]
+    codes = {1}
+    if is_first:
+        codes.add(2)
+    if is_last:
+        codes.add(3)
+    expected = {(i, j) for i in range(window) for j in range(window) if grid[i][j] in codes}
+    actual = get_sent_pairs_to_predict_for(end=window - 1, is_first=is_first, is_last=is_last, window=window)
+    assert set(actual) == expected
+    assert len(actual) == len(expected)
+
+
+@pytest.mark.parametrize("num_sentences", list(range(1, 13)))
+@pytest.mark.parametrize("window, stride", [(w, s) for w in range(1, 7) for s in range(1, w + 1)])
+def test_sent_pairs_ownership(num_sentences, window, stride):
+    """
+    каждая пара предложений, попавшая хотя бы в один кусок, и каждое предложение
+    должны достаться ровно одному куску
+    """
+    spans = get_sentences_spans_fixed_pointers(num_sentences=num_sentences, window=window, stride=stride)
+    pair2count = {}
+    sent2count = {}
+    for span in spans:
+        is_first = span.start == 0
+        is_last = span.end == num_sentences
+        for a in range(span.start, span.end):
+            for b in range(a, span.end):
+                pair2count.setdefault((a, b), 0)
+        end = span.end - span.start - 1
+        for i, j in get_sent_pairs_to_predict_for(
+                end=end, is_first=is_first, is_last=is_last, window=window, stride=stride
+        ):
+            pair2count[(span.start + i, span.start + j)] += 1
+        for i in get_sent_ids_to_predict_for(is_first=is_first, is_last=is_last, window=window, stride=stride):
+            if i <= end:
+                sent2count[span.start + i] = sent2count.get(span.start + i, 0) + 1
+    assert all(v == 1 for v in pair2count.values()), pair2count
+    assert sent2count == {i: 1 for i in range(num_sentences)}
+
+
+# предложения, которые прежняя реализация (только window in {1, 3, 5}, stride = 1) отдавала куску:
+# (window, is_first, is_last) -> ids. кусок, который одновременно первый и последний, прежняя реализация
+# считала только первым и теряла хвост; теперь ему достаются все предложения (см. test_get_sent_ids_to_predict_for)
+SENT_IDS = {
+    (1, False, False): {0},
+    (1, True, False): {0},
+    (1, False, True): {0},
+    (3, False, False): {1},
+    (3, True, False): {0, 1},
+    (3, False, True): {1, 2},
+    (5, False, False): {2},
+    (5, True, False): {0, 1, 2},
+    (5, False, True): {2, 3, 4},
+}
+
+
+@pytest.mark.parametrize("window, is_first, is_last", list(SENT_IDS))
+def test_get_sent_ids_to_predict_for_grids(window, is_first, is_last):
+    expected = SENT_IDS[(window, is_first, is_last)]
+    assert get_sent_ids_to_predict_for(is_first=is_first, is_last=is_last, window=window) == expected
+
+
+def test_get_sent_ids_to_predict_for():
+    assert get_sent_ids_to_predict_for(is_first=False, is_last=False, window=5) == {2}
+    assert get_sent_ids_to_predict_for(is_first=True, is_last=False, window=5) == {0, 1, 2}
+    assert get_sent_ids_to_predict_for(is_first=False, is_last=True, window=5) == {2, 3, 4}
+    assert get_sent_ids_to_predict_for(is_first=True, is_last=True, window=3) == {0, 1, 2}
+    assert get_sent_ids_to_predict_for(is_first=False, is_last=False, window=4, stride=2) == {1, 2}
+
+
+def test_sent_pairs_without_window():
+    """
+    window=None - куски без перекрытий: куску достаются все его пары и предложения
+    """
+    assert set(get_sent_pairs_to_predict_for(end=2, is_first=False, is_last=False, window=None)) == {
+        (0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2)
+    }
+    assert get_sent_ids_to_predict_for(is_first=False, is_last=False, window=None, end=2) == {0, 1, 2}
+
+
+def _get_batches_cost(lengths, batches, attention_coef, batch_overhead, head_sizes=None, head_coef=0.0):
+    cost = 0
+    for batch in batches:
+        cost += batch_overhead + get_batch_cost(
+            lengths, batch, attention_coef=attention_coef, head_sizes=head_sizes, head_coef=head_coef
+        )
+    return cost
+
+
+def _is_valid_batch(lengths, batch, max_tokens_per_batch, max_attention_per_batch, head_sizes, head_coef):
+    if len(batch) == 1:
+        return True
+    max_len = max(lengths[i] for i in batch)
+    max_head_size = max(head_sizes[i] for i in batch) if head_sizes is not None else 0
+    if len(batch) * (max_len + head_coef * max_head_size ** 2) > max_tokens_per_batch:
+        return False
+    if max_attention_per_batch is not None and len(batch) * max_len ** 2 > max_attention_per_batch:
+        return False
+    return True
+
+
+def _get_min_cost_brute_force(lengths, **kwargs):
+    """
+    перебор всех разрезаний отсортированных примеров на отрезки
+    """
+    indices_sorted = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    n = len(lengths)
+    best = None
+    for mask in itertools.product([False, True], repeat=n - 1):
+        bounds = [0] + [i + 1 for i in range(n - 1) if mask[i]] + [n]
+        batches = [indices_sorted[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+        if all(
+            _is_valid_batch(
+                lengths,
+                batch,
+                max_tokens_per_batch=kwargs["max_tokens_per_batch"],
+                max_attention_per_batch=kwargs["max_attention_per_batch"],
+                head_sizes=kwargs["head_sizes"],
+                head_coef=kwargs["head_coef"]
+            )
+            for batch in batches
+        ):
+            cost = _get_batches_cost(
+                lengths,
+                batches,
+                attention_coef=kwargs["attention_coef"],
+                batch_overhead=kwargs["batch_overhead"],
+                head_sizes=kwargs["head_sizes"],
+                head_coef=kwargs["head_coef"]
+            )
+            best = cost if best is None else min(best, cost)
+    return best
+
+
+def _generate_batching_kwargs(rng, n):
+    head_sizes = rng.choice([None, [rng.randint(0, 6) for _ in range(n)]])
+    return dict(
+        max_tokens_per_batch=rng.choice([20, 40, 100]),
+        attention_coef=rng.choice([0.0, 0.1]),
+        batch_overhead=rng.choice([0, 10, 50]),
+        max_attention_per_batch=rng.choice([None, 800]),
+        head_sizes=head_sizes,
+        head_coef=rng.choice([0.5, 1.0]) if head_sizes is not None else 0.0
+    )
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_batches_indices_gen_min_cost(seed):
+    rng = random.Random(seed)
+    lengths = [rng.randint(1, 20) for _ in range(rng.randint(1, 9))]
+    kwargs = _generate_batching_kwargs(rng, len(lengths))
+    batches = list(batches_indices_gen(lengths, policy=BatchingPolicies.MIN_COST, **kwargs))
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert _is_valid_batch(
+            lengths,
+            batch,
+            max_tokens_per_batch=kwargs["max_tokens_per_batch"],
+            max_attention_per_batch=kwargs["max_attention_per_batch"],
+            head_sizes=kwargs["head_sizes"],
+            head_coef=kwargs["head_coef"]
+        )
+    actual = _get_batches_cost(
+        lengths,
+        batches,
+        attention_coef=kwargs["attention_coef"],
+        batch_overhead=kwargs["batch_overhead"],
+        head_sizes=kwargs["head_sizes"],
+        head_coef=kwargs["head_coef"]
+    )
+    expected = _get_min_cost_brute_force(lengths, **kwargs)
+    assert actual == pytest.approx(expected)
+
+
+def test_batches_indices_gen_greedy_head_sizes():
+    lengths = [2, 2, 2, 2, 3]
+    head_sizes = [0, 3, 0, 0, 1]
+    # без головы: 4 * 2 <= 10, 5 * 3 > 10
+    assert list(batches_indices_gen(lengths, max_tokens_per_batch=10)) == [[0, 1, 2, 3], [4]]
+    # (2 + 0.5 * 3 ** 2) * 2 > 10: пример 1 открывает новый батч, в который больше ничего не влезает
+    actual = list(batches_indices_gen(lengths, max_tokens_per_batch=10, head_sizes=head_sizes, head_coef=0.5))
+    assert actual == [[0], [1], [2, 3], [4]]
+
+
+@pytest.mark.parametrize("policy", [BatchingPolicies.GREEDY, BatchingPolicies.MIN_COST])
+def test_batches_indices_gen_too_large(policy, capsys):
+    # пример 0 - самый короткий, но с головой не влезает в бюджет: (1 + 0.5 * 5 ** 2) > 10
+    lengths = [1, 2, 2, 30, 2]
+    head_sizes = [5, 0, 1, 0, 0]
+    actual = list(batches_indices_gen(
+        lengths, max_tokens_per_batch=10, ids=list("abcde"), policy=policy, head_sizes=head_sizes, head_coef=0.5
+    ))
+    assert [0] in actual
+    assert [3] in actual
+    assert sorted(i for batch in actual for i in batch) == list(range(len(lengths)))
+    for batch in actual:
+        if len(batch) > 1:
+            assert len(batch) * (max(lengths[i] for i in batch) + 0.5 * max(head_sizes[i] for i in batch) ** 2) <= 10
+    out = capsys.readouterr().out
+    assert out.count("WARNING") == 1
+    assert "2 examples exceed max_tokens_per_batch: 10" in out
+    assert "['a', 'd']" in out
+
+
+def test_batches_indices_gen_greedy_too_large_first():
+    assert list(batches_indices_gen([30, 1, 2], max_tokens_per_batch=20)) == [[1, 2], [0]]
+    assert list(batches_indices_gen([1, 1], max_tokens_per_batch=20, head_sizes=[10, 0], head_coef=1.0)) == [[0], [1]]
+    assert list(batches_indices_gen([], max_tokens_per_batch=20)) == [[]]
+
+
+def test_batches_indices_gen_min_cost_edge_cases():
+    assert list(batches_indices_gen([], policy=BatchingPolicies.MIN_COST)) == [[]]
+    assert list(batches_indices_gen([30, 1], max_tokens_per_batch=20, policy=BatchingPolicies.MIN_COST)) == [[1], [0]]
+    with pytest.raises(NotImplementedError):
+        list(batches_indices_gen([1], policy="foo"))
+
+
+def test_get_padding_report():
+    d = get_padding_report([2, 4, 3], [[0, 1], [2]], attention_coef=1.0)
+    assert d["num_examples"] == 3
+    assert d["num_batches"] == 2
+    assert d["num_tokens"] == 9
+    assert d["num_tokens_padded"] == 11
+    assert d["tokens_efficiency"] == pytest.approx(9 / 11)
+    assert d["attention_efficiency"] == pytest.approx(29 / 41)
+    assert d["cost_efficiency"] == pytest.approx(38 / 52)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("with_heads", [False, True])
+def test_get_bucketed_batches(seed, with_heads):
+    rng = random.Random(seed)
+    lengths = [rng.randint(1, 100) for _ in range(300)]
+    head_sizes = [rng.randint(0, 10) for _ in lengths] if with_heads else None
+    head_coef = 0.5 if with_heads else 0.0
+    kwargs = dict(max_tokens_per_batch=300, bucket_width=16, head_sizes=head_sizes, head_coef=head_coef)
+    batches = get_bucketed_batches(lengths, rng=random.Random(seed), **kwargs)
+    # каждый пример - ровно один раз
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        assert len({lengths[i] // 16 for i in batch}) == 1
+        if len(batch) > 1:
+            max_head_size = max(head_sizes[i] for i in batch) if with_heads else 0
+            assert len(batch) * (max(lengths[i] for i in batch) + head_coef * max_head_size ** 2) <= 300
+    # воспроизводимость и перемешивание между эпохами
+    assert get_bucketed_batches(lengths, rng=random.Random(seed), **kwargs) == batches
+    assert get_bucketed_batches(lengths, rng=random.Random(seed + 1), **kwargs) != batches
+
+
+def test_get_bucketed_batches_local_rng():
+    # свой генератор (как в BaseModel.get_num_epoch_steps) не сдвигает глобальный random
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 100) for _ in range(100)]
+    state = random.getstate()
+    batches = get_bucketed_batches(lengths, max_tokens_per_batch=300, rng=np.random.RandomState(228))
+    assert random.getstate() == state
+    assert get_bucketed_batches(lengths, max_tokens_per_batch=300, rng=np.random.RandomState(228)) == batches
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+
+def test_length_index_cache():
+    examples = [
+        Example(id=str(i), tokens=[Token(text="a", pieces=["a"] * n)] * (5 - i)) for i, n in enumerate([1, 3, 2])
+    ]
+    cache = LengthIndexCache()
+    index = cache.get(examples, pieces_level=True)
+    assert (index.lengths, index.indices_sorted) == ([5, 12, 6], [0, 2, 1])
+
+    # новый список из тех же примеров (как в evaluate на каждой эпохе) - тот же индекс
+    assert cache.get(list(examples), pieces_level=True) is index
+
+    # другие примеры, порядок или уровень длин - новый индекс
+    assert cache.get(examples[::-1], pieces_level=True) is not index
+    assert cache.get(examples, pieces_level=False).lengths == [5, 4, 3]
+    assert cache.get(examples[:2], pieces_level=False).lengths == [5, 4]